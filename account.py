@@ -1,23 +1,60 @@
+import threading
+
 from blockchain import recordBlockchainTransaction
+from eventBus import BUS
 
 class Account():
+    """A named account holding a balance.  Deposits and withdrawals are safe to make
+       from several threads; use stateLock.locked() on the account to make a sequence
+       of them atomic.  Once attached to a Ledger, every change is recorded there.
+    """
 
     def __init__(self, name, initialBalance=0.0):
         """Create account with the given name and starting balance
         """
         self.name = name
         self.balance = initialBalance
+        self.lock = threading.RLock()
+        self.ledger = None
+        self.generation = 0     # counts changes to the balance
+
+    def attach_ledger(self, ledger):
+        """Record this account's transactions in <ledger> from now on.  If the ledger
+           already knows the account, its balance is restored from there; otherwise the
+           current balance is recorded as the opening balance.
+        """
+        with self.lock:
+            self.ledger = ledger
+            balance = ledger.balance(self.name)
+            if balance is None:
+                ledger.append(self.name, "open", self.balance)
+            else:
+                self.balance = balance
+                self.generation += 1
+        return
 
     def withdraw(self, amount):
         """Reduce balance for this account by given amount
            Notify the blockchain object as we do this
         """   
-        self.balance -= amount
-        recordBlockchainTransaction(self.name,"debit",amount)
-        return self.balance
+        with self.lock:
+            self.balance -= amount
+            self.generation += 1
+            if self.ledger is not None:
+                self.ledger.append(self.name, "debit", amount)
+            recordBlockchainTransaction(self.name,"debit",amount)
+            BUS.publish('account', self.as_dict())
+            return self.balance
 
     def deposit(self, amount):
-        self.balance += amount
-        recordBlockchainTransaction(self.name,"credit",amount)
-        return self.balance
+        with self.lock:
+            self.balance += amount
+            self.generation += 1
+            if self.ledger is not None:
+                self.ledger.append(self.name, "credit", amount)
+            recordBlockchainTransaction(self.name,"credit",amount)
+            BUS.publish('account', self.as_dict())
+            return self.balance
 
+    def as_dict(self):
+        return {'name': self.name, 'balance': self.balance}
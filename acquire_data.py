@@ -1,15 +1,19 @@
 """ Reads the sensors and writes the results to the database
         -h             print this help text
-        --pause=10          reads the sensors every 10 seconds (default: 5 seconds)
+        --pause=10          reads the sensors every 10 seconds, on the clock (default: 5 seconds)
         --iters=25          run for 25 sets of sensor readings, then exit (default: 12 sets)
+        --buffer=60         hold up to 60 readings in memory between writes (default: write every set)
+        --simulate=1000     read 1000 simulated fridges instead of the thermometers
+        --deadband=0.1      only store readings that have changed by more than 0.1, or at least
+                            every 5 minutes (default: store every reading)
         --log=d/i/w   run with this level of debugging.  Options d,i,w (default: warning)
 """
 import sys
 import logging
 import getopt
-import time
-from sensor import TemperatureSensor
-from sensorStore import SensorStore
+from sensor import TemperatureSensor, I2CSensor
+from acquisition import SensorPoller, SamplingSchedule, DeadbandFilter
+from sensorStore import SensorStore, WriteBuffer
 import json
 
 logging.basicConfig(level=logging.DEBUG,
@@ -21,6 +25,9 @@ logger = logging.getLogger('acquire_data')
 # set defaults
 pause_time = 2        # read sensors every 5 seconds by default
 max_iterations = 5      # read sensors this many times before stopping (if -1,then never stop)
+buffer_rows = 0         # if >0, buffer this many readings before writing them in one go
+deadband = None         # if set, only store readings that change by more than this
+simulated_fridges = 0   # if >0, read this many simulated fridges instead of the sensors
 
 
 class Usage(Exception):
@@ -34,7 +41,8 @@ def main(argv=None):
     try:
         logging.debug("Parsing arguments")
         try:
-            opts, extra_args = getopt.getopt(argv[1:], "h", ["help", "debug=", "iters=", "pause="])
+            opts, extra_args = getopt.getopt(argv[1:], "h", ["help", "debug=", "iters=", "pause=", "buffer=",
+                                                             "deadband=", "simulate="])
         except getopt.GetoptError:
             print(__doc__)
             raise Usage("Help, unable to get options!")
@@ -45,26 +53,46 @@ def main(argv=None):
 
     global pause_time
     global max_iterations
+    global buffer_rows
+    global deadband
+    global simulated_fridges
 
     logging.info("Starting run with interval time of {} seconds for {} iterations".format(pause_time, max_iterations))
     store = SensorStore()
-
-    sensor_list = [TemperatureSensor("thermometer 1"), TemperatureSensor("thermometer 2")]
+    writer = store
+    if buffer_rows > 0:
+        writer = WriteBuffer(store, max_rows=buffer_rows)
+    readings_filter = None if deadband is None else DeadbandFilter(default_deadband=deadband)
+
+    if simulated_fridges > 0:
+        from simulator import FridgeFleet
+        sensor_list = FridgeFleet(simulated_fridges).sensors()
+    else:
+        sensor_list = [TemperatureSensor("thermometer 1"), TemperatureSensor("thermometer 2")]
+    poller = SensorPoller(sensor_list, timeout=min(2.0, pause_time), max_workers=min(len(sensor_list), 16))
+    schedule = SamplingSchedule(poller, default_interval=pause_time)
 
     iteration = 1    # count for current iteration
     while max_iterations == -1 or iteration <= max_iterations:
-        if iteration > 1:
-            logging.info("Pausing for {} seconds".format(pause_time))
-            time.sleep(pause_time)
-        sensor_readings = read_sensors(sensor_list)
-        store_sensor_readings(store, sensor_readings)
+        # wait for the next tick, rather than sleeping a fixed time that drifts by the
+        # time taken to read and store
+        schedule.wait()
+        sensor_readings = read_sensors(schedule)
+        unchanged = []
+        if readings_filter is not None:
+            sensor_readings, unchanged = readings_filter.split(sensor_readings)
+        store_sensor_readings(writer, sensor_readings, unchanged)
         iteration += 1   # starting next iteration
         logging.info("Completed iteration {}".format(iteration))
 
+    if writer is not store:
+        writer.close()     # flush anything still buffered
     readings = store.get_readings_as_dicts(10)
     print("Read back last few readings:")
     [print(r) for r in readings]
         
+    poller.close()
+    I2CSensor.close_buses()
     store.close()
     return
 
@@ -72,6 +100,9 @@ def main(argv=None):
 def parse_args(opts):
     global pause_time
     global max_iterations
+    global buffer_rows
+    global deadband
+    global simulated_fridges
 
     for opt, arg in opts:
         logging.debug("Option switch {} with argument {}".format(opt, arg))
@@ -88,29 +119,36 @@ def parse_args(opts):
             elif lvl == "w":
                 logger.setLevel(logging.WARNING)
         elif opt == "--pause":
-            pause_time = int(arg)
+            pause_time = float(arg)
+            if pause_time <= 0:
+                raise Usage("--pause must be more than 0 seconds")
             logging.debug("Pause time set to {}".format(pause_time))
         elif opt in "--iters":
             max_iterations = int(arg)
             logging.debug("Max iterations set to {}".format(max_iterations))
+        elif opt == "--buffer":
+            buffer_rows = int(arg)
+            logging.debug("Write buffer set to {} readings".format(buffer_rows))
+        elif opt == "--deadband":
+            deadband = float(arg)
+            logging.debug("Deadband set to {}".format(deadband))
+        elif opt == "--simulate":
+            simulated_fridges = int(arg)
+            logging.debug("Simulating {} fridges".format(simulated_fridges))
         else:
             assert False, "unhandled commandline argument"
     return
 
 
-def read_sensors(sensor_list):
+def read_sensors(schedule):
     logging.info(">>reading sensors")
-    sensor_readings = []
-    for s in sensor_list:
-        sensor_readings.append(s.get_reading())
-    return sensor_readings
+    return schedule.run_pending()
 
 
-def store_sensor_readings(store, readings):
+def store_sensor_readings(store, readings, unchanged=()):
     logging.info(">>storing sensor readings: {}".format(readings))
-    for r in readings:
-        store.add_reading(sensor_name=r.get_name(), when=r.get_timestamp(),
-                          reading_type=r.get_type(), value=r.get_value())
+    # unchanged readings aren't stored, but still count in the rollups
+    store.add_readings(readings, unchanged)
     return
 
 
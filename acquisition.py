@@ -0,0 +1,214 @@
+"""Reads a set of sensors concurrently, so one slow or hung device can't hold up the
+rest, and a cycle of readings takes about as long as the slowest sensor rather than
+the sum of them all.
+ - SensorPoller reads sensors on worker threads, giving each <timeout> seconds to
+   answer.  A sensor that misses the timeout is left out of that cycle's readings,
+   and is skipped altogether while its read is still outstanding, rather than tying
+   up another worker.
+ - SamplingSchedule decides which sensors to read when, each at its own interval
+"""
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import REGISTRY
+
+logger = logging.getLogger('acquisition')
+
+READ_SECONDS = REGISTRY.histogram('sensor_read_seconds', 'Time taken to read a sensor', ['sensor'])
+READ_FAILURES = REGISTRY.counter('sensor_read_failures_total',
+                                 'Sensor reads that timed out, raised, or were skipped as still busy',
+                                 ['sensor', 'reason'])
+CYCLE_SECONDS = REGISTRY.histogram('acquisition_cycle_seconds',
+                                   'Time taken to read every sensor due at a sampling tick')
+MISSED_DEADLINES = REGISTRY.counter('acquisition_missed_deadlines_total',
+                                    'Sampling ticks skipped because the previous cycle overran',
+                                    ['sensor'])
+
+
+class SensorPoller(object):
+
+    def __init__(self, sensors, timeout=2.0, max_workers=None):
+        self.sensors = list(sensors)
+        self.timeout = timeout
+        self.timeouts = {}          # sensor name: reads that missed the timeout
+        self.errors = {}            # sensor name: reads that raised an exception
+        self._busy = {}             # sensor name: future of a read that missed the timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.sensors) or 1,
+                                            thread_name_prefix="sensor")
+
+    def read_all(self):
+        """Read every sensor at once, waiting at most <timeout> seconds.
+           Returns: the SensorReadings of the sensors that answered in time, in sensor order
+        """
+        return self.read(self.sensors)
+
+    def read(self, sensors):
+        """Read the given sensors (some of ours) at once, as read_all()
+        """
+        futures = []
+        for sensor in sensors:
+            busy = self._busy.get(sensor.get_name())
+            if busy is not None:
+                if not busy.done():
+                    READ_FAILURES.inc(sensor=sensor.get_name(), reason="busy")
+                    logger.warning("Sensor '%s' is still busy, skipped", sensor.get_name())
+                    continue
+                del self._busy[sensor.get_name()]
+            futures.append((sensor, self._executor.submit(self._read, sensor)))
+
+        wait([future for sensor, future in futures], timeout=self.timeout)
+        readings = []
+        for sensor, future in futures:
+            name = sensor.get_name()
+            if not future.done():
+                self.timeouts[name] = self.timeouts.get(name, 0) + 1
+                self._busy[name] = future
+                READ_FAILURES.inc(sensor=name, reason="timeout")
+                logger.warning("Sensor '%s' didn't answer within %ss", name, self.timeout)
+            elif future.exception() is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                READ_FAILURES.inc(sensor=name, reason="error")
+                logger.error("Sensor '%s' failed: %s", name, future.exception())
+            else:
+                readings.append(future.result())
+        return readings
+
+    @staticmethod
+    def _read(sensor):
+        with READ_SECONDS.time(sensor=sensor.get_name()):
+            return sensor.get_reading()
+
+    def close(self):
+        """Stop the worker threads, without waiting for any hung reads
+        """
+        self._executor.shutdown(wait=False)
+        return
+
+
+class SamplingSchedule(object):
+    """Samples each sensor at its own interval (in seconds), on wall-clock ticks: a
+       sensor with a 60s interval is read on each whole minute, so timing never drifts
+       however long reads and writes take.  Sensors due at the same tick are read
+       together and handed over as one batch, to be written in one go.  A tick that
+       passes before the previous one's work is done is counted as missed for that
+       sensor, and skipped.
+    """
+
+    def __init__(self, poller, intervals=None, default_interval=5.0, now=None):
+        intervals = {} if intervals is None else intervals
+        self.poller = poller
+        self.intervals = {}         # sensor name: seconds
+        self.missed = {}            # sensor name: ticks missed
+        self._next = {}             # sensor name: time of its next tick
+        now = time.time() if now is None else now
+        for sensor in poller.sensors:
+            interval = intervals.get(sensor.get_name(), default_interval)
+            if interval <= 0:
+                raise ValueError("sampling interval for '{}' must be positive".format(sensor.get_name()))
+            self.intervals[sensor.get_name()] = interval
+            self._next[sensor.get_name()] = (math.floor(now / interval) + 1) * interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_tick(self):
+        return min(self._next.values())
+
+    def wait(self):
+        """Sleep until the next tick.  Returns: False if the schedule was stopped meanwhile
+        """
+        return not self._stop.wait(max(0.0, self.next_tick() - time.time()))
+
+    def run_pending(self, now=None):
+        """Read every sensor that is due.
+           Returns: the SensorReadings, in sensor order
+        """
+        now = time.time() if now is None else now
+        due = [sensor for sensor in self.poller.sensors if self._next[sensor.get_name()] <= now]
+        for sensor in due:
+            name = sensor.get_name()
+            interval = self.intervals[name]
+            missed = int((now - self._next[name]) // interval)
+            if missed > 0:
+                self.missed[name] = self.missed.get(name, 0) + missed
+                MISSED_DEADLINES.inc(missed, sensor=name)
+                logger.warning("Sensor '%s' missed %d sampling deadline(s)", name, missed)
+            # counted in whole ticks, so rounding errors can't add up to drift
+            self._next[name] = (round(self._next[name] / interval) + missed + 1) * interval
+        if not due:
+            return []
+        with CYCLE_SECONDS.time():
+            return self.poller.read(due)
+
+    def _run(self, handle_readings):
+        while self.wait():
+            readings = self.run_pending()
+            if readings:
+                try:
+                    handle_readings(readings)
+                except Exception:
+                    logger.exception("Failed to handle sensor readings")
+        return
+
+    def start(self, handle_readings):
+        """Sample in a background thread, calling handle_readings(readings) with each batch
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(handle_readings,),
+                                            name="Sensor sampling", daemon=True)
+            self._thread.start()
+        return
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return
+
+
+class DeadbandFilter(object):
+    """Decides which readings are worth storing: a sensor's reading is kept only when it
+       has moved more than the sensor's deadband from the last one kept, or when
+       <max_silence> seconds have passed since then, as a heartbeat showing the sensor
+       is still alive.  Steady readings are dropped, and can be filled back in as a step
+       function when read (see downsample.step_fill).
+    """
+
+    def __init__(self, deadbands=None, default_deadband=0.0, max_silence=300.0):
+        self.deadbands = {} if deadbands is None else deadbands    # sensor name: deadband
+        self.default_deadband = default_deadband
+        self.max_silence = max_silence
+        self.kept = 0
+        self.dropped = 0
+        self._last = {}             # sensor name: (epoch ms, value) of the last reading kept
+        self._lock = threading.Lock()
+
+    def filter(self, readings):
+        """Returns: the readings that should be stored, in the order given
+        """
+        return self.split(readings)[0]
+
+    def split(self, readings):
+        """Returns: (the readings that should be stored, those left out), each in the order given
+        """
+        silence_ms = self.max_silence * 1000
+        keep = []
+        drop = []
+        with self._lock:
+            for r in readings:
+                name = r.get_name()
+                last = self._last.get(name)
+                if (last is None
+                        or abs(r.get_value() - last[1]) > self.deadbands.get(name, self.default_deadband)
+                        or r.get_timestamp_ms() - last[0] >= silence_ms):
+                    self._last[name] = (r.get_timestamp_ms(), r.get_value())
+                    keep.append(r)
+                else:
+                    drop.append(r)
+            self.kept += len(keep)
+            self.dropped += len(drop)
+        return keep, drop
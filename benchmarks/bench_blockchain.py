@@ -0,0 +1,69 @@
+""" Measures how fast the blockchain miner turns queued transactions into blocks
+        --txs=100000        number of transactions to mine (default: 100000)
+        --block=2000        most transactions in a block (default: 2000)
+        --threads=4         number of threads submitting transactions (default: 4)
+    Prints the transactions/second submitted, and the blocks/second and
+    transactions/second mined.
+"""
+import getopt
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from blockchain import Blockchain
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    txs, block_txs, threads = 100000, 2000, 4
+    opts, extra_args = getopt.getopt(argv[1:], "h", ["help", "txs=", "block=", "threads="])
+    for opt, value in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--txs":
+            txs = int(value)
+        elif opt == "--block":
+            block_txs = int(value)
+        elif opt == "--threads":
+            threads = int(value)
+
+    chain = Blockchain(block_interval=0.1, max_block_txs=block_txs, keep_blocks=txs // block_txs + 1,
+                       max_pending=txs)
+
+    def submit(n):
+        for i in range(n):
+            chain.submit("fridge", "credit", 0.5)
+
+    # submitting, with the miner running alongside as it does in the server
+    chain.start()
+    workers = [threading.Thread(target=submit, args=(txs // threads,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    submitted = time.perf_counter() - start
+    chain.stop()
+
+    # mining alone, from a full queue
+    chain = Blockchain(max_block_txs=block_txs, keep_blocks=txs // block_txs + 1, max_pending=txs)
+    submit(txs)
+    start = time.perf_counter()
+    blocks = 0
+    while chain.mine() is not None:
+        blocks += 1
+    mined = time.perf_counter() - start
+
+    print("submit: {:.0f} tx/s from {} threads".format(txs / submitted, threads))
+    print("mine:   {:.1f} blocks/s, {:.0f} tx/s ({} blocks of up to {} tx)".format(
+        blocks / mined, txs / mined, blocks, block_txs))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
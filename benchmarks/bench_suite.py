@@ -0,0 +1,336 @@
+""" End-to-end benchmarks of the sensor ingest and query paths, and the fridge's web services.
+        --sizes=10000,100000    table sizes (rows) to measure query latency at
+                                (default: 10000,100000,1000000; up to 10000000 takes a while)
+        --duration=3            seconds to run each web service benchmark for (default: 3)
+        --clients=8             concurrent HTTP clients (default: 8)
+        --only=store,http       run only these groups: store, query, http (default: all)
+        --output=results.json   write the results as JSON to this file (default: print them)
+        --compare=old.json      also show the change from a previous run's results
+    Each result is {"benchmark", "params", "value", "unit"}, so runs from different
+    commits can be compared.
+"""
+import getopt
+import http.client
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sensorStore import SensorStore
+from sensorReading import SensorReading
+
+SENSOR_COUNT = 20
+READING_INTERVAL_MS = 5000
+
+
+def result(benchmark, value, unit, **params):
+    return {'benchmark': benchmark, 'params': params, 'value': round(value, 3), 'unit': unit}
+
+
+def synthetic_rows(first, count):
+    """<count> (name, epoch_ms, type, value) rows, continuing on from row <first>: readings
+       from SENSOR_COUNT sensors every READING_INTERVAL_MS
+    """
+    rows = []
+    for i in range(first, first + count):
+        sensor = i % SENSOR_COUNT
+        when = 1500000000000 + (i // SENSOR_COUNT) * READING_INTERVAL_MS
+        rows.append(("sensor {}".format(sensor), when, "temperature", 4.0 + (i % 97) / 10.0))
+    return rows
+
+
+def timed(function, repeats):
+    """Run <function> <repeats> times.  Returns: the timings in milliseconds
+    """
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(fraction * len(timings)))]
+
+
+def bench_store_inserts(workdir):
+    results = []
+    store = SensorStore(os.path.join(workdir, "inserts.db"))
+    rows = synthetic_rows(0, 2000)
+    start = time.perf_counter()
+    for name, when, type, value in rows:
+        store.add_reading(name, when, type, value)
+    elapsed = time.perf_counter() - start
+    results.append(result("store.add_reading", len(rows) / elapsed, "rows/s", batch=1))
+
+    for batch in (100, 1000, 10000):
+        rows = synthetic_rows(100000 * batch, 100000)
+        start = time.perf_counter()
+        for i in range(0, len(rows), batch):
+            store.add_readings(rows[i:i + batch])
+        elapsed = time.perf_counter() - start
+        results.append(result("store.add_readings", len(rows) / elapsed, "rows/s", batch=batch))
+    store.close()
+    return results
+
+
+def bench_store_queries(workdir, sizes):
+    results = []
+    store = SensorStore(os.path.join(workdir, "queries.db"))
+    rows = 0
+    for size in sorted(sizes):
+        while rows < size:
+            batch = min(50000, size - rows)
+            store.add_readings(synthetic_rows(rows, batch))
+            rows += batch
+        queries = {
+            "store.get_readings": lambda: store.get_readings(10),
+            "store.get_readings_for_sensor": lambda: store.get_readings_for_sensor("sensor 7", 10),
+            "store.get_series_for_sensor(1h)": lambda: store.get_series_for_sensor(
+                "sensor 7", count=None, start=1500000000000 + READING_INTERVAL_MS * (rows // SENSOR_COUNT)
+                - 3600000),
+        }
+        for benchmark, query in queries.items():
+            timings = timed(query, 200)
+            results.append(result(benchmark, statistics.median(timings), "ms", rows=size, stat="median"))
+            results.append(result(benchmark, percentile(timings, 0.95), "ms", rows=size, stat="p95"))
+    store.close()
+    return results
+
+
+def start_server(workdir, port):
+    """Serve /json and /statusupdate from this process, as iot_fridge's main() would
+    """
+    import cherrypy
+    import iot_fridge
+    from blockchain import CHAIN
+
+    iot_fridge.SENSOR_STORE = SensorStore(os.path.join(workdir, "http.db"))
+    rows = synthetic_rows(0, 100000)
+    iot_fridge.SENSOR_STORE.add_readings(rows)
+    iot_fridge.RECENT_READINGS.add_readings(SensorReading(name, type, when, value)
+                                          for name, when, type, value in rows[-1000:])
+    CHAIN.start()
+
+    conf = {
+        '/': {
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+            'tools.sessions.on': True,
+            'tools.response_headers.on': True,
+            'tools.response_headers.headers': [('Content-Type', 'application/json')],
+        }
+    }
+    cherrypy.config.update({'environment': 'production', 'log.screen': False,
+                            'server.socket_host': '127.0.0.1', 'server.socket_port': port,
+                            'server.thread_pool': 30})
+    cherrypy.tree.mount(iot_fridge.JSONGeneratorWebService(), '/json', conf)
+    cherrypy.tree.mount(iot_fridge.StatusUpdate(), '/statusupdate', conf)
+    cherrypy.engine.start()
+    cherrypy.engine.wait(cherrypy.engine.states.STARTED)
+    return
+
+
+def stop_server():
+    import cherrypy
+    import iot_fridge
+    from blockchain import CHAIN
+
+    cherrypy.engine.exit()
+    CHAIN.stop()
+    iot_fridge.SENSOR_STORE.close()
+    return
+
+
+def hammer(port, method, paths, duration, clients):
+    """Have <clients> threads make requests, cycling through <paths>, for <duration> seconds.
+       Returns: (requests/s, median ms, p95 ms, errors)
+    """
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        mine = []
+        i = offset
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            conn.request(method, paths[i % len(paths)], headers={'Accept': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            mine.append((time.perf_counter() - start) * 1000)
+            if response.status >= 400:
+                with lock:
+                    errors[0] += 1
+            i += 1
+        conn.close()
+        with lock:
+            timings.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(timings) / elapsed, statistics.median(timings), percentile(timings, 0.95), errors[0]
+
+
+def bench_ingest(port, batch, batches=10):
+    """Upload <batches> batches of <batch> new readings to POST /json, as JSON and as the
+       columnar format.  Returns: results in rows/s, end to end
+    """
+    from export import columnar_chunks
+
+    results = []
+    first = 10000000
+    encoders = {
+        "application/json": lambda rows: json.dumps([{'sensor': name, 't': when, 'v': value}
+                                                     for name, when, type, value in rows]).encode(),
+        "application/octet-stream": lambda rows: b"".join(columnar_chunks(
+            [sorted((name, when, value) for name, when, type, value in rows)])),
+    }
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for content_type, encode in encoders.items():
+        bodies = [encode(synthetic_rows(first + i * batch, batch)) for i in range(batches)]
+        first += batches * batch
+        start = time.perf_counter()
+        for body in bodies:
+            conn.request("POST", "/json", body=body, headers={'Content-Type': content_type})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                raise RuntimeError("POST /json failed: {} {}".format(response.status, response.reason))
+        elapsed = time.perf_counter() - start
+        results.append(result("POST /json (bulk ingest)", batch * batches / elapsed, "rows/s",
+                              batch=batch, format=content_type))
+    conn.close()
+    return results
+
+
+def bench_http(workdir, duration, clients):
+    results = []
+    port = 18080
+    end = 1500000000000 + READING_INTERVAL_MS * (100000 // SENSOR_COUNT)
+    scenarios = [
+        ("GET /json (last 10, from memory)", "GET", ["/json?n=10", "/json?n=10&sensor_name=sensor%203"]),
+        ("GET /json (1h range, from store)", "GET",
+         ["/json?sensor_name=sensor%20{}&start={}&end={}".format(i, end - 3600000, end) for i in range(5)]),
+        ("GET /json (1d in 1m buckets)", "GET",
+         ["/json?sensor_name=sensor%204&bucket=1m&start={}&end={}".format(end - 86400000, end)]),
+        ("PUT /statusupdate", "PUT",
+         ["/statusupdate/dragFromFridge/red_can", "/statusupdate/dropInFridge/red_can"]),
+    ]
+    # the web services print as they go, which would swamp the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start_server(workdir, port)
+    try:
+        for benchmark, method, paths in scenarios:
+            rate, median, p95, errors = hammer(port, method, paths, duration, clients)
+            results.append(result(benchmark, rate, "requests/s", clients=clients))
+            results.append(result(benchmark, median, "ms", clients=clients, stat="median"))
+            results.append(result(benchmark, p95, "ms", clients=clients, stat="p95"))
+            if errors:
+                results.append(result(benchmark, errors, "errors", clients=clients))
+        results += bench_ingest(port, 10000)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        stop_server()
+    return results
+
+
+def result_key(r):
+    return r['benchmark'], json.dumps(r['params'], sort_keys=True), r['unit']
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = dict((result_key(r), r['value']) for r in baseline['results'])
+    for r in results:
+        params = ", ".join("{}={}".format(k, v) for k, v in sorted(r['params'].items()))
+        line = "{:<40} {:<28} {:>12.3f} {}".format(r['benchmark'], params, r['value'], r['unit'])
+        old = previous.get(result_key(r))
+        if old:
+            line += "  ({:+.1f}%)".format(100.0 * (r['value'] - old) / old)
+        print(line, file=sys.stderr)
+    return
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    sizes = [10000, 100000, 1000000]
+    duration, clients = 3.0, 8
+    groups = {"store", "query", "http"}
+    output = compare = None
+    opts, extra_args = getopt.getopt(argv[1:], "h", ["help", "sizes=", "duration=", "clients=",
+                                                     "only=", "output=", "compare="])
+    for opt, value in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--sizes":
+            sizes = [int(size) for size in value.split(",")]
+        elif opt == "--duration":
+            duration = float(value)
+        elif opt == "--clients":
+            clients = int(value)
+        elif opt == "--only":
+            groups = set(value.split(","))
+        elif opt == "--output":
+            output = value
+        elif opt == "--compare":
+            compare = value
+
+    workdir = tempfile.mkdtemp(prefix="iot_fridge_bench")
+    results = []
+    try:
+        if "store" in groups:
+            results += bench_store_inserts(workdir)
+        if "query" in groups:
+            results += bench_store_queries(workdir, sizes)
+        if "http" in groups:
+            results += bench_http(workdir, duration, clients)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    run = {'commit': git_commit(), 'timestamp': int(time.time()), 'python': platform.python_version(),
+           'machine': platform.machine(), 'results': results}
+    baseline = None
+    if compare is not None:
+        with open(compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if output is None:
+        print(json.dumps(run, indent=1))
+    else:
+        with open(output, 'w') as f:
+            json.dump(run, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,31 @@
-""" Simple module that stores a flag when a bitcoin transfer has recently been
-    performed and returns a flag if that is the case, so we can mark up the 
-    display of transaction hashes in blockchain.html
+""" A simple simulated blockchain of the transactions on our accounts.
+    recordBlockchainTransaction() queues each transaction; a background miner
+    takes everything queued, hashes it, and builds it into a block carrying the
+    Merkle root of its transactions and the hash of the previous block.  All the
+    hashing is done by the miner in batches, so recording a transaction costs a
+    request thread only an append to a queue.
+    Each transaction and each new block is also published on the event bus, so
+    blockchain.html can show the real hashes as they are mined.
+    The older isRecentBlockchainTransaction() flag is still kept up to date.
 """
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+
+from eventBus import BUS
+
+logger = logging.getLogger('blockchain')
+
+GENESIS_HASH = '0' * 64
 
 newBlockchainTransaction = False;
 
 def isRecentBlockchainTransaction():
     global newBlockchainTransaction
     if (newBlockchainTransaction):
-        print("newBlockchainTransaction is true")
+        logger.debug("newBlockchainTransaction is true")
         answer = True
         newBlockchainTransaction = False
     else:
@@ -18,4 +35,145 @@ def isRecentBlockchainTransaction():
 def recordBlockchainTransaction(accountName, type, amount):
     global newBlockchainTransaction
     newBlockchainTransaction = True
+    CHAIN.submit(accountName, type, amount)
+    BUS.publish('transaction', {'account': accountName, 'type': type, 'amount': amount})
     return
+
+
+def merkle_root(digests):
+    """Return the Merkle root of a list of transaction digests (as bytes): pairs are
+       hashed together level by level, the last one paired with itself if a level is
+       odd, as in Bitcoin
+    """
+    if not digests:
+        return hashlib.sha256(b'').digest()
+    sha256 = hashlib.sha256
+    level = digests
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + level[-1:]
+        level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0]
+
+
+class Block(object):
+
+    def __init__(self, height, prev_hash, timestamp, transactions, tx_hashes):
+        self.height = height
+        self.prev_hash = prev_hash
+        self.timestamp = timestamp          # epoch ms when mined
+        self.transactions = transactions    # list of (account, type, amount, epoch ms)
+        self.tx_hashes = tx_hashes          # hex digests, in the same order
+        self.merkle_root = merkle_root([bytes.fromhex(h) for h in tx_hashes]).hex()
+        header = "{}|{}|{}|{}|{}".format(height, prev_hash, timestamp, self.merkle_root,
+                                         len(transactions))
+        self.hash = hashlib.sha256(header.encode()).hexdigest()
+
+    def header(self):
+        return {'height': self.height, 'hash': self.hash, 'prev_hash': self.prev_hash,
+                'merkle_root': self.merkle_root, 'timestamp': self.timestamp,
+                'tx_count': len(self.transactions)}
+
+    def as_dict(self):
+        block = self.header()
+        block['transactions'] = [{'hash': h, 'account': account, 'type': type, 'amount': amount,
+                                  'timestamp': created_at}
+                                 for h, (account, type, amount, created_at)
+                                 in zip(self.tx_hashes, self.transactions)]
+        return block
+
+
+class Blockchain(object):
+    """Queues transactions and mines them into blocks, every <block_interval> seconds or
+       as soon as <max_block_txs> are waiting.  Only the last <keep_blocks> blocks are
+       kept in memory.
+    """
+
+    def __init__(self, block_interval=2.0, max_block_txs=2000, keep_blocks=100, max_pending=100000):
+        self.block_interval = block_interval
+        self.max_block_txs = max_block_txs
+        self.dropped = 0            # transactions lost because the queue was full
+        self._pending = deque(maxlen=max_pending)
+        self._blocks = deque(maxlen=keep_blocks)
+        self._height = 0
+        self._last_hash = GENESIS_HASH
+        self._mine_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._miner = None
+
+    def submit(self, account, type, amount):
+        """Queue a transaction for the next block
+        """
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append((account, type, amount, int(time.time() * 1000)))
+        if len(self._pending) >= self.max_block_txs:
+            self._wake.set()
+        return
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def mine(self):
+        """Build the queued transactions (up to max_block_txs of them) into a block.
+           Returns: the new Block, or None if nothing was queued
+        """
+        with self._mine_lock:
+            transactions = []
+            pending = self._pending
+            while pending and len(transactions) < self.max_block_txs:
+                transactions.append(pending.popleft())
+            if not transactions:
+                return None
+            sha256 = hashlib.sha256
+            tx_hashes = [sha256("{}|{}|{!r}|{}".format(account, type, float(amount), created_at)
+                                .encode()).hexdigest()
+                         for account, type, amount, created_at in transactions]
+            self._height += 1
+            block = Block(self._height, self._last_hash, int(time.time() * 1000), transactions,
+                          tx_hashes)
+            self._last_hash = block.hash
+            self._blocks.append(block)
+        event = block.header()
+        event['tx_hashes'] = tx_hashes[:20]
+        BUS.publish('block', event)
+        return block
+
+    def recent_blocks(self, count=3):
+        """Return the last <count> blocks, oldest first
+        """
+        return list(self._blocks)[-count:] if count > 0 else []
+
+    def _mine_periodically(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.block_interval)
+            self._wake.clear()
+            while self.mine() is not None and len(self._pending) >= self.max_block_txs:
+                pass
+        return
+
+    def start(self):
+        """Start mining in a background thread
+        """
+        if self._miner is None:
+            self._stop.clear()
+            self._miner = threading.Thread(target=self._mine_periodically, name="Blockchain miner",
+                                           daemon=True)
+            self._miner.start()
+        return
+
+    def stop(self):
+        """Stop the miner, after building blocks of anything still queued
+        """
+        if self._miner is not None:
+            self._stop.set()
+            self._wake.set()
+            self._miner.join()
+            self._miner = None
+        while self.mine() is not None:
+            pass
+        return
+
+
+CHAIN = Blockchain()     # the process-wide chain
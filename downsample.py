@@ -0,0 +1,158 @@
+"""Helpers for reducing long runs of sensor readings to a chartable number of points.
+ - parse_bucket() turns a bucket width like '1m' or '6h' into milliseconds
+ - lttb() picks a visually representative subset of a series using the
+   Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013)
+ - add_to_buckets() and bucket_summary() aggregate series into time buckets in
+   Python, for when SensorStore.get_buckets() can't do it in SQL
+and one for going the other way:
+ - step_fill() puts back the readings a deadband filter chose not to store
+"""
+
+BUCKET_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+
+def parse_bucket(bucket):
+    """Convert a bucket width such as '30s', '1m', '1h' or '1d' to milliseconds.
+       Raises ValueError if the width isn't a positive whole number of one of those units.
+    """
+    bucket = str(bucket).strip()
+    unit = bucket[-1:].lower()
+    if unit not in BUCKET_UNITS or not bucket[:-1].isdigit() or int(bucket[:-1]) <= 0:
+        raise ValueError("bucket should look like 30s, 5m, 1h or 1d, not '{}'".format(bucket))
+    return int(bucket[:-1]) * BUCKET_UNITS[unit]
+
+
+def lttb(series, max_points):
+    """Downsample a time-ordered sequence of (timestamp, value) pairs to at most
+       <max_points> points, keeping the first and last, and from each of the buckets
+       in between the point that makes the largest triangle with its neighbours.
+       Peaks and troughs survive, which plain decimation or averaging loses.
+       Returns: a list of (timestamp, value) pairs
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    n = len(series)
+    if max_points >= n:
+        return list(series)
+
+    sampled = [series[0]]
+    every = (n - 2) / (max_points - 2)    # width of each bucket between the end points
+    a = 0                                 # index of the point chosen in the previous bucket
+    for i in range(max_points - 2):
+        # average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = 0.0
+        avg_y = 0.0
+        for x, y in series[next_start:next_end]:
+            avg_x += x
+            avg_y += y
+        width = next_end - next_start
+        avg_x /= width
+        avg_y /= width
+
+        ax, ay = series[a]
+        best_area = -1.0
+        best = 0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = series[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(series[best])
+        a = best
+    sampled.append(series[-1])
+    return sampled
+
+
+def step_fill(series, step_ms, max_gap_ms, end=None):
+    """Fill in a time-ordered series of (timestamp, value) pairs that was stored only
+       when the value changed, repeating each value every <step_ms> until the next one.
+       Readings don't land exactly on the step (they jitter by a few ms), so no value
+       is filled in within half a step of the next stored reading.  Gaps longer than
+       <max_gap_ms> are left alone, as the sensor wasn't reporting then.  If <end> is
+       given, the last value is also carried forward up to (not including) <end>, but
+       no more than <max_gap_ms> past it.
+       Returns: a list of (timestamp, value) pairs
+    """
+    if step_ms <= 0:
+        raise ValueError("step_ms must be positive")
+    filled = []
+    for i, (t, value) in enumerate(series):
+        filled.append((t, value))
+        if i + 1 < len(series):
+            if series[i + 1][0] - t > max_gap_ms:
+                continue
+            until = series[i + 1][0] - step_ms / 2
+        elif end is not None:
+            until = min(end, t + max_gap_ms + 1)
+        else:
+            break
+        t += step_ms
+        while t < until:
+            filled.append((t, value))
+            t += step_ms
+    return filled
+
+
+def add_to_buckets(buckets, series, bucket_ms):
+    """Add a series of (timestamp, value) pairs into <buckets>, a dict of bucket start:
+       [min, sum, max, count], for buckets <bucket_ms> wide aligned to the epoch.
+       Readings with no value are left out.
+    """
+    for t, value in series:
+        if value is None:
+            continue
+        b = (t // bucket_ms) * bucket_ms
+        bucket = buckets.get(b)
+        if bucket is None:
+            buckets[b] = [value, value, value, 1]
+        else:
+            bucket[0] = min(bucket[0], value)
+            bucket[1] += value
+            bucket[2] = max(bucket[2], value)
+            bucket[3] += 1
+    return buckets
+
+
+def add_steps_to_buckets(buckets, series, bucket_ms, step_ms, max_gap_ms, end=None):
+    """As add_to_buckets(), for a series stored only when the value changed: each value
+       is weighted by how long it held, counted in readings of <step_ms>, rather than
+       expanding it with step_fill() first.  A value holds until the next one, or for a
+       single step if that is more than <max_gap_ms> away; the last holds until <end>
+       (no more than <max_gap_ms>), or for a single step if <end> isn't given.
+    """
+    for i, (t, value) in enumerate(series):
+        if value is None:
+            continue
+        if i + 1 < len(series):
+            until = series[i + 1][0]
+            if until - t > max_gap_ms:
+                until = t + step_ms
+        elif end is not None:
+            until = min(end, t + max_gap_ms)
+        else:
+            until = t + step_ms
+        while t < until:
+            b = (t // bucket_ms) * bucket_ms
+            held = (min(until, b + bucket_ms) - t) / step_ms
+            bucket = buckets.get(b)
+            if bucket is None:
+                buckets[b] = [value, value * held, value, held]
+            else:
+                bucket[0] = min(bucket[0], value)
+                bucket[1] += value * held
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += held
+            t = b + bucket_ms
+    return buckets
+
+
+def bucket_summary(buckets):
+    """Returns: a list of (bucket_start_ms, min, mean, max, count), oldest first, as
+       SensorStore.get_buckets() returns them; time-weighted counts are rounded to
+       whole readings
+    """
+    return [(b, low, total / count, high, max(1, int(round(count))))
+            for b, (low, total, high, count) in sorted(buckets.items())]
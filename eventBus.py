@@ -0,0 +1,78 @@
+"""In-process publish/subscribe of small events, used to push changes to web clients
+as they happen rather than have every page poll for them.
+
+Publishing is a single non-blocking call: each subscriber has its own bounded queue,
+and a subscriber that isn't keeping up loses its oldest events rather than holding
+up the publisher or the other subscribers.
+"""
+import threading
+from collections import deque
+
+
+class Subscription(object):
+    """One subscriber's queue of (topic, data) events
+    """
+
+    def __init__(self, bus, topics, maxlen):
+        self.bus = bus
+        self.topics = topics        # set of topics wanted, or None for everything
+        self.dropped = 0            # events lost because the queue was full
+        self._events = deque(maxlen=maxlen)
+        self._ready = threading.Condition()
+
+    def put(self, topic, data):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append((topic, data))
+            self._ready.notify()
+        return
+
+    def get(self, timeout=None):
+        """Wait up to <timeout> seconds for events, then return all the queued ones
+           as a list of (topic, data), oldest first (empty if none arrived in time)
+        """
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+        return
+
+
+class EventBus(object):
+
+    def __init__(self):
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics=None, maxlen=100):
+        """Start receiving events on the given topics (all topics if None).
+           Returns: a Subscription, which should be closed when finished with
+        """
+        sub = Subscription(self, None if topics is None else set(topics), maxlen)
+        with self._lock:
+            # copy-on-write, so publish() can walk the list without holding the lock
+            self._subscriptions = self._subscriptions + [sub]
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not sub]
+        return
+
+    def publish(self, topic, data):
+        for sub in self._subscriptions:
+            if sub.topics is None or topic in sub.topics:
+                sub.put(topic, data)
+        return
+
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+
+BUS = EventBus()     # the process-wide bus
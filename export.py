@@ -0,0 +1,86 @@
+"""Encoders for bulk exports of readings, each turning the chunks of (sensor_name,
+epoch_ms, value) rows from SensorStore.iter_series_chunks() into chunks of bytes to
+stream, so an export of any size is encoded a chunk at a time.
+ - csv_chunks(): CSV with a header line, "sensor,timestamp_ms,value"
+ - columnar_chunks(): a compact binary format, laid out as
+       MAGIC
+       then blocks of one sensor's readings, in time order:
+           uint16 length of the name, uint32 count n     (little-endian)
+           the sensor name, UTF-8
+           n int64 timestamps (epoch ms), then n float64 values (NaN for none)
+       ended by a block with a zero-length name and a count of 0
+   so the columns can be loaded directly, e.g. with numpy.frombuffer()
+ - read_columnar() decodes the binary format again
+"""
+import csv
+import io
+import struct
+import sys
+from array import array
+from itertools import groupby
+
+MAGIC = b"IOTFCOL1"
+_BLOCK_HEADER = struct.Struct("<HI")
+
+
+def csv_chunks(chunks):
+    yield b"sensor,timestamp_ms,value\n"
+    for rows in chunks:
+        text = io.StringIO()
+        csv.writer(text, lineterminator="\n").writerows(rows)
+        yield text.getvalue().encode()
+
+
+def _little_endian(column):
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def columnar_block(name, timestamps, values):
+    """Return one block of the columnar format
+    """
+    name = name.encode()
+    return b"".join((_BLOCK_HEADER.pack(len(name), len(timestamps)), name,
+                     _little_endian(array('q', timestamps)), _little_endian(array('d', values))))
+
+
+def columnar_chunks(chunks):
+    yield MAGIC
+    for rows in chunks:
+        yield b"".join(columnar_block(name, [r[1] for r in block],
+                                      [float('nan') if r[2] is None else r[2] for r in block])
+                       for name, block in ((name, list(rows)) for name, rows in groupby(rows, lambda r: r[0])))
+    yield _BLOCK_HEADER.pack(0, 0)
+
+
+def read_columnar(data):
+    """Decode the columnar format from a bytes-like object.  A sensor's readings may
+       be split across several blocks.
+       Returns: a list of (sensor_name, timestamps, values) per block, the columns as arrays.
+       Raises ValueError if the data isn't in the format, or is cut short.
+    """
+    data = memoryview(data)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not columnar readings data")
+    offset = len(MAGIC)
+    blocks = []
+    while True:
+        if offset + _BLOCK_HEADER.size > len(data):
+            raise ValueError("columnar readings data is cut short")
+        name_length, count = _BLOCK_HEADER.unpack_from(data, offset)
+        offset += _BLOCK_HEADER.size
+        if name_length == 0 and count == 0:
+            return blocks
+        end = offset + name_length + 16 * count
+        if end > len(data):
+            raise ValueError("columnar readings data is cut short")
+        name = bytes(data[offset:offset + name_length]).decode()
+        offset += name_length
+        timestamps = array('q', bytes(data[offset:offset + 8 * count]))
+        values = array('d', bytes(data[offset + 8 * count:end]))
+        if sys.byteorder == "big":
+            timestamps.byteswap()
+            values.byteswap()
+        blocks.append((name, timestamps, values))
+        offset = end
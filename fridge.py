@@ -1,25 +1,38 @@
+import threading
 from collections import Counter
 import cherrypy
 
+from eventBus import BUS
+
 class Fridge():
-    
+    """The cans in a fridge.  All methods are safe to call from several threads; use
+       stateLock.locked() on the fridge to make a sequence of calls atomic.
+    """
+
     contents = {}
     can_types = {'red_can', 'blue_can', 'green_can'}
     needsRestock = False
 
-    def __init__ (self,red_count = 0, blue_count = 0, green_count = 0):
+    def __init__ (self,red_count = 0, blue_count = 0, green_count = 0, fridge_id = None):
         self.contents = Counter({'red_can': red_count, 'blue_can': blue_count, 'green_can': green_count})
         self.needsRestock = False
+        self.lock = threading.RLock()
+        self.fridge_id = fridge_id
+        self.restock_listener = None   # called as listener(fridge, needsRestock) when that changes
+        self.generation = 0            # counts changes, so cached views of the fridge can be checked
 
     def set_red_can(self,n=0):
-        self.contents['red_can'] = n
-        self.check_stock()
+        with self.lock:
+            self.contents['red_can'] = n
+            self._changed()
     def set_green_can(self,n=0):
-        self.contents['green_can'] = n
-        self.check_stock()
+        with self.lock:
+            self.contents['green_can'] = n
+            self._changed()
     def set_blue_can(self,n=0):
-        self.contents['blue_can'] = n
-        self.check_stock()
+        with self.lock:
+            self.contents['blue_can'] = n
+            self._changed()
 
     def get_red_can(self):
         return self.contents['red_can']
@@ -30,9 +43,10 @@ class Fridge():
       
     def incr_can(self,canColour):
         assert canColour in self.can_types
-        self.contents[canColour] += 1
-        self.check_stock()
-        return self.contents[canColour]
+        with self.lock:
+            self.contents[canColour] += 1
+            self._changed()
+            return self.contents[canColour]
     def incr_red_can(self):
         return self.incr_can('red_can')
     def incr_green_can(self):
@@ -42,10 +56,11 @@ class Fridge():
 
     def decr_can(self,canColour):
         assert canColour in self.can_types 
-        if self.contents[canColour] > 0:
-           self.contents[canColour] -= 1
-           self.check_stock()
-        return self.contents[canColour]
+        with self.lock:
+            if self.contents[canColour] > 0:
+               self.contents[canColour] -= 1
+               self._changed()
+            return self.contents[canColour]
     def decr_red_can(self):
         return self.decr_can('red_can')
     def decr_green_can(self):
@@ -54,34 +69,57 @@ class Fridge():
         return self.decr_can('blue_can')
 
     def check_stock(self):
-        restock = False
-        for can_type, stock_level in self.contents.items():
-            restock |= (stock_level <=1)
-        self.needsRestock = restock
-        return self.needsRestock
+        with self.lock:
+            restock = False
+            for can_type, stock_level in self.contents.items():
+                restock |= (stock_level <=1)
+            changed = restock != self.needsRestock
+            self.needsRestock = restock
+            if changed and self.restock_listener is not None:
+                self.restock_listener(self, restock)
+            return self.needsRestock
 
     def restock(self):
         """ Restock the fridge back to standard levels
             Return value is the number of cans added
         """
-        added_cans = 0
-        for can_colour, stock_level in self.contents.items():
-            if can_colour=="red_can":
-                if stock_level<4:
-                    added_cans += 4 - stock_level
-                    self.contents["red_can"] = 4
-            else:
-                if (stock_level<2):
-                    if (stock_level==0):
-                        count_to_add = 3
-                    else: 
-                        count_to_add = 2
-                    added_cans += count_to_add - stock_level
-                    self.contents[can_colour] = count_to_add 
-        self.needsRestock = False
-        return added_cans
+        with self.lock:
+            added_cans = 0
+            for can_colour, stock_level in self.contents.items():
+                if can_colour=="red_can":
+                    if stock_level<4:
+                        added_cans += 4 - stock_level
+                        self.contents["red_can"] = 4
+                else:
+                    if (stock_level<2):
+                        if (stock_level==0):
+                            count_to_add = 3
+                        else: 
+                            count_to_add = 2
+                        added_cans += count_to_add - stock_level
+                        self.contents[can_colour] = count_to_add 
+            self._changed()
+            return added_cans
+
+    def _changed(self):
+        """Called after every change to the contents: re-check the stock levels, and
+           tell anyone listening on the event bus
+        """
+        self.generation += 1
+        self.check_stock()
+        BUS.publish('fridge', self.as_dict())
+        return
+
+    def as_dict(self):
+        with self.lock:
+            return {'fridge_id': self.fridge_id,
+                    'red_can_count': self.get_red_can(),
+                    'green_can_count': self.get_green_can(),
+                    'blue_can_count': self.get_blue_can(),
+                    'needs_restock': self.needsRestock}
 
     def status(self):
-        return repr(self.contents)
+        with self.lock:
+            return repr(self.contents)
  
 
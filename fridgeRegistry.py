@@ -0,0 +1,69 @@
+"""Registry of all the fridges managed by this server, keyed by fridge id.
+
+State is sharded per fridge: each FridgeShard holds a fridge with its own account
+and escrow account, each with their own locks, so operations on different fridges
+never wait for one another.  The registry also keeps an index of which fridges
+need restocking, updated as each fridge's stock changes, so asking for that list
+doesn't mean checking every fridge.
+"""
+import threading
+
+
+class FridgeShard(object):
+    """The state belonging to one fridge
+    """
+
+    def __init__(self, fridge_id, fridge, account, escrow):
+        self.fridge_id = fridge_id
+        self.fridge = fridge
+        self.account = account     # takes payment for cans from this fridge
+        self.escrow = escrow       # holds restock bonds for this fridge
+
+
+class FridgeRegistry(object):
+
+    def __init__(self):
+        self._shards = {}
+        self._needs_restock = set()
+        self._lock = threading.Lock()
+
+    def add(self, fridge_id, fridge, account, escrow):
+        """Register a fridge, with its account and escrow account, under <fridge_id>
+           Returns: the FridgeShard
+        """
+        shard = FridgeShard(fridge_id, fridge, account, escrow)
+        with self._lock:
+            if fridge_id in self._shards:
+                raise ValueError("fridge '{}' is already registered".format(fridge_id))
+            # copy-on-write, so lookups never need the lock
+            shards = dict(self._shards)
+            shards[fridge_id] = shard
+            self._shards = shards
+        fridge.fridge_id = fridge_id
+        fridge.restock_listener = self._restock_changed
+        self._restock_changed(fridge, fridge.check_stock())
+        return shard
+
+    def get(self, fridge_id):
+        """Return the FridgeShard for <fridge_id>; KeyError if there isn't one
+        """
+        return self._shards[fridge_id]
+
+    def fridge_ids(self):
+        return sorted(self._shards)
+
+    def needing_restock(self):
+        """Return the ids of the fridges that currently need restocking
+        """
+        with self._lock:
+            return sorted(self._needs_restock)
+
+    def _restock_changed(self, fridge, needs_restock):
+        """Called by a fridge whenever its needsRestock flag changes
+        """
+        with self._lock:
+            if needs_restock:
+                self._needs_restock.add(fridge.fridge_id)
+            else:
+                self._needs_restock.discard(fridge.fridge_id)
+        return
@@ -0,0 +1,91 @@
+"""Parsing and validation of batches of readings uploaded to POST /json, e.g. by edge
+devices that buffered their readings while offline.  Two formats are accepted:
+ - application/json: a list of readings, each {"sensor": name, "t": epoch_ms, "v": value}
+   as in the 'reading' events, with an optional "type" (the reading type)
+ - application/octet-stream: the columnar format of export.py, so an export from one
+   fridge can be uploaded to another unchanged; NaN values are stored as no value
+parse_batch() returns (sensor_name, epoch_ms, reading_type, value) tuples ready for
+SensorStore.add_readings(), with any repeated (sensor, timestamp) left out.
+"""
+import json
+import math
+
+from export import read_columnar
+
+# Kept small enough that parsing a batch, and writing it, fits easily in a Pi's memory
+# (100k JSON readings take a few tens of MB); larger uploads should be split up
+MAX_BATCH_ROWS = 100000
+MAX_BATCH_BYTES = 8 * 1024 * 1024      # request bodies larger than this are refused with 413
+MAX_SENSOR_NAME = 200
+DEFAULT_READING_TYPE = "temperature"
+
+
+def _check(sensor_name, when, reading_type, value, row):
+    if not isinstance(sensor_name, str) or not 0 < len(sensor_name) <= MAX_SENSOR_NAME:
+        raise ValueError("reading {}: sensor must be a name of 1 to {} characters".format(row, MAX_SENSOR_NAME))
+    if not isinstance(when, int) or isinstance(when, bool) or when < 0:
+        raise ValueError("reading {}: t must be a non-negative integer of epoch milliseconds".format(row))
+    if not isinstance(reading_type, str):
+        raise ValueError("reading {}: type must be a string".format(row))
+    if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                              or not math.isfinite(value)):
+        raise ValueError("reading {}: v must be a finite number or null".format(row))
+    return
+
+
+def _from_json(body, reading_type):
+    try:
+        readings = json.loads(body.decode())
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("not valid JSON: {}".format(e))
+    if not isinstance(readings, list):
+        raise ValueError("expected a list of readings")
+    if len(readings) > MAX_BATCH_ROWS:
+        raise ValueError("at most {} readings may be sent at once".format(MAX_BATCH_ROWS))
+    for row, reading in enumerate(readings):
+        if not isinstance(reading, dict) or 'sensor' not in reading or 't' not in reading:
+            raise ValueError("reading {}: expected an object with sensor, t and v".format(row))
+        item = (reading['sensor'], reading['t'], reading.get('type', reading_type), reading.get('v'))
+        _check(*item, row)
+        yield item
+
+
+def _from_columnar(body, reading_type):
+    blocks = read_columnar(body)
+    if sum(len(timestamps) for name, timestamps, values in blocks) > MAX_BATCH_ROWS:
+        raise ValueError("at most {} readings may be sent at once".format(MAX_BATCH_ROWS))
+    row = 0
+    for sensor_name, timestamps, values in blocks:
+        for when, value in zip(timestamps.tolist(), values.tolist()):
+            value = None if math.isnan(value) else value
+            _check(sensor_name, when, reading_type, value, row)
+            yield sensor_name, when, reading_type, value
+            row += 1
+
+
+PARSERS = {
+    'application/json': _from_json,
+    'application/octet-stream': _from_columnar,
+}
+
+
+def parse_batch(body, content_type, reading_type=DEFAULT_READING_TYPE):
+    """Parse and validate an uploaded batch of readings.  All of it is checked before
+       anything is returned, so a bad batch is rejected as a whole.
+       Returns: (list of (sensor_name, epoch_ms, reading_type, value), number received)
+       Raises ValueError describing the first problem found, or if <content_type> isn't
+       one of PARSERS.
+    """
+    parser = PARSERS.get(content_type)
+    if parser is None:
+        raise ValueError("Content-Type must be one of {}".format(", ".join(sorted(PARSERS))))
+    batch = []
+    seen = set()
+    received = 0
+    for item in parser(body, reading_type):
+        received += 1
+        key = (item[0], item[1])
+        if key not in seen:
+            seen.add(key)
+            batch.append(item)
+    return batch, received
@@ -10,77 +10,506 @@ reads sensors every few seconds, writing to database.
    fridge.  When they agree to a restock mission, a bond is put in escrow on the 
    blockchain, and this is released, together with a bounty, when the mission is complete.
  - web page /blockchain shows the blockchain blocks filling up, being mined, and then
-   locked.  When a transaction happens locally on our system, the next hash written
-   to the "blockchain" is written in red, to hilight this for discussions.
+   locked.  Every transaction on our accounts is mined into a real hash-chained block,
+   and the hashes of our transactions are written in red as each block arrives.
 """
+import json
 import logging
 import os
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
 
 import cherrypy
 
 from mako.lookup import TemplateLookup
 
-from sensor import TemperatureSensor
-from sensorStore import SensorStore
+from sensor import TemperatureSensor, I2CSensor
+from acquisition import SensorPoller, SamplingSchedule, DeadbandFilter
+from sensorStore import SensorStore, align_range
+from downsample import parse_bucket, lttb, step_fill, add_to_buckets, add_steps_to_buckets, bucket_summary
+from retention import RetentionPolicy, RetentionPlugin
+from ringBuffer import RecentReadings
+from eventBus import BUS
+from metrics import REGISTRY
+from responseCache import ResponseCache, make_etag, etag_matches
+from export import csv_chunks, columnar_chunks
+from ingest import parse_batch, DEFAULT_READING_TYPE, MAX_BATCH_BYTES
 
 from fridge import Fridge
+from fridgeRegistry import FridgeRegistry
 from account import Account
-from blockchain import isRecentBlockchainTransaction
+from stateLock import locked
+from ledger import Ledger
+from blockchain import CHAIN
+
+logger = logging.getLogger('iot_fridge')
+
+FRIDGES = FridgeRegistry()   # every fridge we manage, by fridge id
+DEFAULT_FRIDGE_ID = "default"
 
 THE_FRIDGE = Fridge()   # initial empty fridge, as globaly accessible variable
 THE_FRIDGE.set_red_can(n=4)
 THE_FRIDGE.set_green_can(n=2)
 THE_FRIDGE.set_blue_can(n=2)
-print("Fridge initial stock loaded")  # fridge now loaded with initial stock
+logger.info("Fridge initial stock loaded")  # fridge now loaded with initial stock
 
 FRIDGE_ACCOUNT = Account("fridge", initialBalance=25.0)
 SUBSCRIBER_ACCOUNT = Account("subscriber", initialBalance=10.0)
 ESCROW_ACCOUNT = Account("escrow", initialBalance=0.0)
 RESTOCK_BOND = 4.0
 
+# The fridge above is the default, used when a URL doesn't name one.  Further fridges
+# are added with FRIDGES.add(fridge_id, Fridge(), Account(...), Account(...)).
+FRIDGES.add(DEFAULT_FRIDGE_ID, THE_FRIDGE, FRIDGE_ACCOUNT, ESCROW_ACCOUNT)
+
+
+def get_shard(fridge_id):
+    """Return the FridgeShard for a fridge id given in a URL, or raise a 404 HTTPError
+    """
+    try:
+        return FRIDGES.get(fridge_id)
+    except KeyError:
+        raise cherrypy.HTTPError(404, "There is no fridge '{}'".format(fridge_id))
+
+
+REQUEST_SECONDS = REGISTRY.histogram('http_request_seconds',
+                                     'Time taken to handle HTTP requests (streams excluded)',
+                                     ['handler', 'method', 'status'])
+EVENT_SUBSCRIBERS = REGISTRY.gauge('event_stream_subscribers', 'Subscriptions open on the event bus')
+STREAMS_REJECTED = REGISTRY.counter('event_streams_rejected_total',
+                                    'Requests for /stream refused with 503 because too many were open')
+INGEST_ROWS = REGISTRY.counter('ingest_rows_total', 'Readings uploaded to POST /json, by whether they were new',
+                               ['result'])
+INGEST_ROWS_PER_SECOND = REGISTRY.gauge('ingest_rows_per_second',
+                                        'Rate at which the last uploaded batch was parsed and stored')
+
+def _start_request_timer():
+    request = cherrypy.request
+    # found now, before other tools wrap the handler
+    handler_name = getattr(getattr(request.handler, 'callable', None), '__name__', None)
+    if handler_name is None:
+        request.metrics_handler = "unmatched"
+    elif handler_name == request.method:
+        # a MethodDispatcher application, e.g. /json's GET()
+        request.metrics_handler = request.script_name or "/"
+    else:
+        request.metrics_handler = request.script_name + "/" + handler_name
+    request.started_at = time.perf_counter()
+    request.hooks.attach('on_end_request', _observe_request_time)
+
+def _observe_request_time():
+    request = cherrypy.request
+    if not cherrypy.response.stream:
+        REQUEST_SECONDS.observe(time.perf_counter() - request.started_at, handler=request.metrics_handler,
+                                method=request.method, status=str(cherrypy.response.status)[:3])
+    return
+
+# times every request, for /metrics; turned on for the whole server in main()
+cherrypy.tools.metrics = cherrypy.Tool('on_start_resource', _start_request_timer)
+
+THREAD_POOL = 30        # CherryPy worker threads
+RESERVED_THREADS = 10   # of which /stream connections may never take these
+SENSOR_STORE = None     # shared, pooled SensorStore; opened once by main() at process start
+SENSORS = [TemperatureSensor("thermometer 1"), TemperatureSensor("thermometer 2")]
+SENSOR_INTERVALS = {}   # sensor name: seconds between readings, if not the default 5s
+DEFAULT_SENSOR_INTERVAL = 5
+# only readings that move by more than 0.1 (or after 5 minutes without one) are stored
+DEADBAND = DeadbandFilter(default_deadband=0.1, max_silence=300)
+SENSOR_POLLER = None    # reads SENSORS concurrently; started by main()
+LEDGER = None           # persistent record of every account transaction; opened by main()
+RECENT_READINGS = RecentReadings(capacity=720)   # last hour of readings at 5 second sampling
+DEFAULT_MAX_POINTS = 1000   # points a /json range is downsampled to, unless it says otherwise
+MAX_RANGE_READINGS = 200000
+MAX_LEDGER_ENTRIES = 1000   # most ledger entries /ledger returns at once
+MAX_BLOCKS = 100            # most blocks /blocks returns at once, as many as CHAIN keeps  # most readings a /json request may read without bucketing
+RESPONSE_CACHE = ResponseCache(max_entries=256, max_bytes=8 * 1024 * 1024, max_body_bytes=256 * 1024)
+# compiled page templates, kept between runs
+MAKO_MODULE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.mako_modules')
+
+
+def parse_count(n, most):
+    """Parse a request's count of items to return, which must be a whole number of at
+       least 1 (400 if not), and limit it to <most>
+    """
+    try:
+        n = int(n)
+    except (TypeError, ValueError):
+        raise cherrypy.HTTPError(400, "n must be a whole number")
+    if n < 1:
+        raise cherrypy.HTTPError(400, "n must be positive")
+    return min(n, most)
+
+
+def cached_response(endpoint, params, generations, build):
+    """Answer a poll from RESPONSE_CACHE.  The response is keyed by the endpoint, its
+       parameters, and the generations of the state it shows; build() makes the body
+       (as bytes) if it isn't cached.  A client that already has this version, by its
+       ETag, gets 304 Not Modified and no body.
+    """
+    key = (endpoint, params, generations)
+    etag = make_etag(key)
+    cherrypy.response.headers['ETag'] = etag
+    # may be kept, but must be checked with us before each use
+    cherrypy.response.headers['Cache-Control'] = 'no-cache'
+    if etag_matches(cherrypy.request.headers.get('If-None-Match'), etag):
+        cherrypy.response.status = 304
+        return b""
+    return RESPONSE_CACHE.get(key, build, group=(endpoint, params))
+
+
 @cherrypy.expose
 class JSONGeneratorWebService(object):
-    """Web service to allow HTTP GET against fridge sensor readings database.
+    """Web service to allow HTTP GET against fridge sensor readings database, and POST
+       of batches of readings into it.
        This is set up in cherrypy using the MethodDispatcher, which maps the HTTP
        verbs to the exposed methods of the class (i.e., to objects).  So the GET
        verb maps to GET(self), while a POST to the url would go to POST(self).
     """
 
     @cherrypy.tools.accept(media='application/json')
-    @cherrypy.tools.json_out()
-    def GET(self, n=10, sensor_name="*"):
-        """Return last n records of sensor data in response to HTTP GET request
+    def GET(self, n=None, sensor_name="*", start=None, end=None, bucket=None, max_points=None):
+        """Return sensor data in response to HTTP GET request.  With no other parameters,
+           the last n (default 10) records.  Otherwise:
+             start, end:  epoch-ms time range to return (either may be left open)
+             bucket:      e.g. 1m or 1h, aggregate the range into buckets of this width;
+                          'data' holds the mean of each bucket, 'min' and 'max' the extremes
+             max_points:  downsample the raw readings in the range to at most this many
+                          points, keeping the shape of the curve (LTTB); a range with
+                          neither this, bucket nor n gets DEFAULT_MAX_POINTS
+           No more than MAX_RANGE_READINGS readings are read to answer a request without
+           bucket (400 if the range holds more): use bucket for long ranges.
+           Readings of a single sensor that weren't stored because they hadn't changed
+           are filled back in (as a step function) before any downsampling.
+           Responses are cached until new readings arrive, and carry an ETag.
         """
-        store = SensorStore()
-        if sensor_name == "*":
-            reading_list = store.get_readings(count=n)
-        else:
-            reading_list = store.get_readings_for_sensor(sensor_name, count=n)
-        store.close()
-
-        cherrypy.log("In GET: retrieve {} readings from database for {}".format(n, sensor_name))
+        try:
+            start = None if start is None else int(start)
+            end = None if end is None else int(end)
+            bucket_ms = None if bucket is None else parse_bucket(bucket)
+            max_points = None if max_points is None else int(max_points)
+            if max_points is not None and max_points < 3:
+                raise ValueError("max_points must be at least 3")
+            n = None if n is None else int(n)
+            if n is not None and n <= 0:
+                raise ValueError("n must be positive")
+            if n is not None and n > MAX_RANGE_READINGS:
+                raise ValueError("n must be no more than {}".format(MAX_RANGE_READINGS))
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        if (start is not None or end is not None) and bucket_ms is None and max_points is None and n is None:
+            max_points = DEFAULT_MAX_POINTS
+
+        params = (n, sensor_name, start, end, bucket_ms, max_points)
+        # unchanged readings are filled in up to now, so unless the range ended in the
+        # past, an answer is only good until the next sampling tick
+        now = int(time.time() * 1000)
+        interval_ms = int(1000 * SENSOR_INTERVALS.get(sensor_name, DEFAULT_SENSOR_INTERVAL))
+        tick = None if end is not None and end <= now else now // interval_ms
+        return cached_response("/json", params, (RECENT_READINGS.generation, SENSOR_STORE.generation, tick),
+                               lambda: json.dumps(self._results(*params, now=now)).encode())
+
+    def POST(self, reading_type=DEFAULT_READING_TYPE):
+        """Store a batch of readings uploaded in the request body, e.g. by an edge device
+           that buffered them while offline (see ingest.py for the formats).  The batch
+           is validated as a whole and written in one transaction; readings already
+           stored for the same sensor and timestamp, or repeated in the batch, are skipped.
+             reading_type:  the reading type for readings that don't give one
+           A batch may hold at most ingest.MAX_BATCH_ROWS readings (400 if more), in a
+           body of at most MAX_BATCH_BYTES (413 if larger).
+           Returns: JSON {"received", "inserted", "duplicates", "seconds", "rows_per_second"}
+           Uploaded readings are stored only, not added to the live views.
+        """
+        started = time.perf_counter()
+        content_type = cherrypy.request.headers.get('Content-Type', '').split(';')[0].strip()
+        try:
+            batch, received = parse_batch(cherrypy.request.body.read(), content_type, reading_type)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        inserted = SENSOR_STORE.add_readings(batch) if batch else 0
+        seconds = time.perf_counter() - started
+
+        rate = received / seconds if seconds > 0 else 0.0
+        INGEST_ROWS.inc(inserted, result="inserted")
+        INGEST_ROWS.inc(received - inserted, result="duplicate")
+        INGEST_ROWS_PER_SECOND.set(rate)
+        logger.info("Ingested %d of %d uploaded readings in %.3fs (%.0f rows/s)",
+                    inserted, received, seconds, rate)
+        return json.dumps({'received': received, 'inserted': inserted, 'duplicates': received - inserted,
+                           'seconds': round(seconds, 6), 'rows_per_second': round(rate, 1)}).encode()
+    POST._cp_config = {'request.body.maxbytes': MAX_BATCH_BYTES}
+
+    def _results(self, n, sensor_name, start, end, bucket_ms, max_points, now=None):
         results = dict()
         if sensor_name == "*":
             results['label'] = "All sensor readings"
         else:
             results['label'] = sensor_name
 
-        results['data'] = [ \
-                           [int(1000 * r.get_timestamp().timestamp()), r.get_value()] \
-                           for r in reading_list \
-                          ]
+        # borrows this worker thread's pooled reader connection
+        if bucket_ms is not None:
+            logger.debug("In GET: aggregate %s readings into %dms buckets", sensor_name, bucket_ms)
+            # whole buckets, as get_buckets() gives them
+            start, end = align_range(bucket_ms, start, end)
+            if (SENSOR_STORE.rollup_table(bucket_ms, start, end) is None
+                    and (sensor_name == "*" or is_deadbanded(sensor_name))):
+                # the raw readings are missing the unchanged ones, which the rollups count
+                buckets = filled_buckets(bucket_ms, sensor_name, start, end, now)
+            else:
+                buckets = SENSOR_STORE.get_buckets(bucket_ms, sensor_name, start, end)
+            results['bucket'] = bucket_ms
+            results['data'] = [[b[0], b[2]] for b in buckets]
+            results['min'] = [[b[0], b[1]] for b in buckets]
+            results['max'] = [[b[0], b[3]] for b in buckets]
+            return results
+
+        series = None
+        if start is None and end is None:
+            n = 10 if n is None else n
+            # the live dashboard's "last few readings" polls are answered from memory
+            series = RECENT_READINGS.get_series(sensor_name, n)
+        if series is None:
+            logger.debug("In GET: retrieve %s readings from database for %s",
+                         "all" if n is None else n, sensor_name)
+            count = MAX_RANGE_READINGS + 1 if n is None else n
+            series = SENSOR_STORE.get_series_for_sensor(sensor_name, count=count, start=start, end=end)
+            if len(series) > MAX_RANGE_READINGS or too_many_to_fill(sensor_name, series):
+                raise cherrypy.HTTPError(400, "More than {} readings in the range: narrow it, or use "
+                                              "bucket".format(MAX_RANGE_READINGS))
+            if sensor_name != "*":
+                series = fill_unchanged_readings(sensor_name, series, start, end, now)
+                if n is not None:
+                    series = series[-n:]
+        if max_points is not None:
+            series = lttb(series, max_points)
+
+        # already [epoch_ms, value] pairs, as flot wants them
+        results['data'] = series
 
         return results
 
 
+def is_deadbanded(sensor_name):
+    """True if the sensor's readings are stored through DEADBAND, so that unchanged
+       ones are missing from the store; not so for uploaded readings, for instance
+    """
+    return any(sensor.name == sensor_name for sensor in SENSORS)
+
+
+def too_many_to_fill(sensor_name, series):
+    """True if filling in the unchanged readings of the sensor's stored <series> could
+       make more than MAX_RANGE_READINGS of them.  Only gaps no longer than DEADBAND's
+       heartbeat are filled, and the value held at either end is carried no further
+       than that, so this is worked out from the gaps alone.
+    """
+    if not is_deadbanded(sensor_name):
+        return False
+    interval_ms, max_gap_ms = deadband_gaps(sensor_name)
+    # the value held at <start>, and the last value, carried forward as far as they can be
+    count = len(series) + 2 * (max_gap_ms // interval_ms + 1)
+    for (t, _), (following, _) in zip(series, series[1:]):
+        if following - t <= max_gap_ms:
+            count += (following - t) // interval_ms
+    return count > MAX_RANGE_READINGS
+
+
+def fill_unchanged_readings(sensor_name, series, start=None, end=None, now=None):
+    """Put back the readings of a sensor that DEADBAND didn't store because they hadn't
+       changed, so a chart of the stored readings from [<start>, <end>) looks like one
+       of every reading (see unchanged_readings_span() for where the fill starts and stops).
+    """
+    if not is_deadbanded(sensor_name):
+        return series
+    interval_ms, max_gap_ms = deadband_gaps(sensor_name)
+    series, carry_to = unchanged_readings_span(sensor_name, series, start, end, now)
+    return step_fill(series, interval_ms, max_gap_ms, carry_to)
+
+
+def deadband_gaps(sensor_name):
+    """Returns: (the ms between a sensor's readings, the longest gap in ms between its
+       stored readings while it's still reporting, i.e. DEADBAND's heartbeat plus a reading)
+    """
+    interval_ms = int(1000 * SENSOR_INTERVALS.get(sensor_name, DEFAULT_SENSOR_INTERVAL))
+    return interval_ms, int(1000 * DEADBAND.max_silence) + interval_ms
+
+
+def unchanged_readings_span(sensor_name, series, start=None, end=None, now=None):
+    """Work out where the unchanged readings of a deadbanded sensor begin and end, for
+       its stored <series> from [<start>, <end>).  The value it held at <start> is the
+       last one stored before it, so that is put first, at <start>, unless the sensor
+       was silent by then.  The last value is carried forward to <end> (or <now>) only
+       if the sensor was still reporting: if its next stored reading after the range,
+       or else the end of the range, is no further off than DEADBAND's heartbeat.
+       Returns: (the series, where to carry its last value to, or None not to)
+    """
+    interval_ms, max_gap_ms = deadband_gaps(sensor_name)
+    now = int(time.time() * 1000) if now is None else now
+    if start is not None and (not series or series[0][0] > start):
+        before = SENSOR_STORE.get_reading_before(sensor_name, start)
+        if before is not None and start - before[0] <= max_gap_ms:
+            series = [(start, before[1])] + list(series)
+    if not series:
+        return series, None
+    limit = now if end is None else min(end, now)
+    following = None
+    if end is not None and end < now:
+        following = SENSOR_STORE.get_reading_from(sensor_name, end)
+    reference = limit if following is None else following[0]
+    return series, (limit if reference - series[-1][0] <= max_gap_ms else None)
+
+
+def filled_buckets(bucket_ms, sensor_name, start=None, end=None, now=None):
+    """As SENSOR_STORE.get_buckets(), but counting the unchanged readings of deadbanded
+       sensors too, so that buckets are weighted by time and steady stretches aren't
+       empty.  Each stored value is weighted by how long it held, rather than filling
+       in every reading.  Reads the range a sensor at a time.
+    """
+    sensor_names = None if sensor_name == "*" else [sensor_name]
+    rows = (row for chunk in SENSOR_STORE.iter_series_chunks(sensor_names, start, end) for row in chunk)
+    buckets = {}
+    seen = set()
+    for name, readings in groupby(rows, itemgetter(0)):
+        seen.add(name)
+        _add_sensor_to_buckets(buckets, bucket_ms, name, [(t, value) for _, t, value in readings],
+                               start, end, now)
+    # a deadbanded sensor that held steady throughout has nothing stored in the range
+    for sensor in SENSORS:
+        if sensor.name not in seen and sensor_name in ("*", sensor.name):
+            _add_sensor_to_buckets(buckets, bucket_ms, sensor.name, [], start, end, now)
+    if end is not None:
+        buckets = dict((b, bucket) for b, bucket in buckets.items() if b < end)
+    return bucket_summary(buckets)
+
+
+def _add_sensor_to_buckets(buckets, bucket_ms, sensor_name, series, start, end, now):
+    if not is_deadbanded(sensor_name):
+        return add_to_buckets(buckets, series, bucket_ms)
+    interval_ms, max_gap_ms = deadband_gaps(sensor_name)
+    series, carry_to = unchanged_readings_span(sensor_name, series, start, end, now)
+    return add_steps_to_buckets(buckets, series, bucket_ms, interval_ms, max_gap_ms, carry_to)
+
+
+class EventStream(object):
+    """Server-Sent Events endpoints, mounted at /stream.  Each connection subscribes to
+       the event bus and is sent events as they're published, rather than the browser
+       polling for them.  Every open stream occupies a server worker thread, so no more
+       than <max_streams> are allowed at once, leaving the rest of the pool for ordinary
+       requests; beyond that a stream is refused with 503, and the page should poll.
+    """
+    _cp_config = {'response.stream': True}
+
+    KEEPALIVE = 15      # seconds of quiet before sending a comment, to detect closed connections
+    RETRY_AFTER = 30    # seconds a refused client is asked to wait before trying again
+
+    def __init__(self, max_streams=20):
+        self.max_streams = max_streams
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def _claim_stream(self):
+        """Count this request as an open stream until it ends, or raise a 503 HTTPError
+           if max_streams are already open
+        """
+        with self._lock:
+            if self._open >= self.max_streams:
+                STREAMS_REJECTED.inc()
+                cherrypy.response.headers['Retry-After'] = str(self.RETRY_AFTER)
+                raise cherrypy.HTTPError(503, "Too many open streams, poll instead")
+            self._open += 1
+        # run once the response has been sent, or the connection dropped
+        cherrypy.request.hooks.attach('on_end_request', self._release_stream)
+
+    def _release_stream(self):
+        with self._lock:
+            self._open -= 1
+        return
+
+    def open_streams(self):
+        return self._open
+
+    @cherrypy.expose
+    def readings(self, sensor_name="*"):
+        """ Called as /stream/readings to push each new sensor reading, as an event of type
+            'reading' with data {"sensor": name, "t": epoch_ms, "v": value}
+        """
+        self._claim_stream()
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        sub = BUS.subscribe(topics=['reading'])
+
+        def wanted(topic, data):
+            return sensor_name == "*" or data['sensor'] == sensor_name
+        return self._stream(sub, wanted)
+
+    @cherrypy.expose
+    def events(self, topics="fridge,account,transaction", fridge=None):
+        """ Called as /stream/events to push changes of state to a kiosk page over one
+            connection, as typed events:
+              fridge:       {"fridge_id", "red_can_count", "green_can_count", "blue_can_count",
+                             "needs_restock"}
+              account:      {"name", "balance"}
+              transaction:  {"account", "type", "amount"}
+              block:        {"height", "hash", "prev_hash", "merkle_root", "timestamp",
+                             "tx_count", "tx_hashes"} (the first 20 hashes)
+            <topics> is a comma-separated list of the event types wanted.  If <fridge> is
+            given, only events for that fridge, its accounts and the subscriber are sent.
+            The current state of the fridge (the default one if none is given) and its
+            accounts is sent as soon as the stream opens.
+        """
+        shard = get_shard(DEFAULT_FRIDGE_ID if fridge is None else fridge)
+        self._claim_stream()
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        topics = set(topics.split(","))
+        sub = BUS.subscribe(topics=topics)
+        # queued behind the subscription, so no change can be missed in between
+        if 'fridge' in topics:
+            sub.put('fridge', shard.fridge.as_dict())
+        accounts = (shard.account, SUBSCRIBER_ACCOUNT, shard.escrow)
+        if 'account' in topics:
+            for account in accounts:
+                sub.put('account', account.as_dict())
+
+        account_names = set(account.name for account in accounts)
+        def wanted(topic, data):
+            if fridge is None:
+                return True
+            elif topic == 'fridge':
+                return data['fridge_id'] == fridge
+            elif topic == 'account':
+                return data['name'] in account_names
+            elif topic == 'transaction':
+                return data['account'] in account_names
+            else:
+                return True
+        return self._stream(sub, wanted)
+
+    def _stream(self, sub, wanted):
+        """Generator of the text/event-stream body for a subscription; events that
+           arrive together are sent in one chunk
+        """
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                events = sub.get(timeout=self.KEEPALIVE)
+                chunk = "".join("event: {}\ndata: {}\n\n".format(topic, json.dumps(data))
+                                for topic, data in events if wanted(topic, data))
+                yield chunk.encode() if chunk else b": keepalive\n\n"
+        finally:
+            sub.close()
+
+
 @cherrypy.expose
 class Root(object):
     """Used to service requests for templates in the root of http://my.domain.com/
        Includes code to feed the fqdn for our web server into the templates, to allow callbacks.
     """
 
-    # tell mako the list of directories in which to hunt for templates
-    mylookupdirs = TemplateLookup(directories=['./'])
+    # tell mako the list of directories in which to hunt for templates, and where to keep
+    # the compiled ones, so a restarted server needn't compile them again
+    mylookupdirs = TemplateLookup(directories=['./'], module_directory=MAKO_MODULE_DIR)
+    TEMPLATES = ["flot_livedata.html", "subscriber.html", "blockchain.html", "fridge.html"]
     # get our fully-qualified domain name
     import socket
     hostname = socket.gethostname()
@@ -89,8 +518,25 @@ class Root(object):
         myfqdn = '127.0.0.1'
     else:
         myfqdn = socket.getfqdn(hostname)
-    print("My fully-qualified domain name is: %s"%(myfqdn))
+    logger.info("My fully-qualified domain name is: %s", myfqdn)
 
+    @classmethod
+    def precompile(cls):
+        """ Compile every page template now, at startup, rather than on its first request
+        """
+        for template in cls.TEMPLATES:
+            cls.mylookupdirs.get_template(template)
+        return
+
+    def render_page(self, template, params=(), generations=(), **values):
+        """ Render a page template, with our fqdn and the given values, through
+            RESPONSE_CACHE: pages whose values only change with the state counted
+            by <generations> are rendered once per change, not once per request.
+            <params> are the request parameters that pick the page.
+        """
+        def build():
+            return self.mylookupdirs.get_template(template).render(fqdn=self.myfqdn, **values).encode()
+        return cached_response("/" + template, params, generations, build)
 
     @cherrypy.expose
     def index(self):
@@ -104,57 +550,56 @@ class Root(object):
     def livedata(self):
         """ Called to as /livedata url and returns a web page that shows the live data
         """
-        mytemplate = self.mylookupdirs.get_template("flot_livedata.html")
-        return mytemplate.render(fqdn=self.myfqdn)
+        return self.render_page("flot_livedata.html")
 
     @cherrypy.expose
-    def subscriber(self):
+    def subscriber(self, fridge=DEFAULT_FRIDGE_ID):
         """ Called as /subscriber url and returns a web page that shows
-            the subscriber what they can do now
+            the subscriber what they can do now, for the given fridge
         """
-        print("subscriber online")
-        mytemplate = self.mylookupdirs.get_template("subscriber.html")
-        return mytemplate.render(fqdn=self.myfqdn)
+        logger.debug("subscriber online")
+        shard = get_shard(fridge)
+        return self.render_page("subscriber.html", (shard.fridge_id,), fridgeId=shard.fridge_id)
 
     @cherrypy.expose
-    def blockchain(self):
-        """ Called as /blockchain url to return the web page with this
-        """
-        print('blockchain display requested')
-        mytemplate = self.mylookupdirs.get_template("blockchain.html")
-        return mytemplate.render(fqdn=self.myfqdn)
-
-    @cherrypy.expose
-    def fridge(self):
+    def fridge(self, fridge=DEFAULT_FRIDGE_ID):
         """ Called as /fridge url to render an html template into a web page for the fridge
         """
-        mytemplate = self.mylookupdirs.get_template("fridge.html")
-        red_cans = THE_FRIDGE.get_red_can()
-        green_cans = THE_FRIDGE.get_green_can()
-        blue_cans = THE_FRIDGE.get_blue_can()
-        return mytemplate.render(fqdn=self.myfqdn, \
-                                 totalCanCount=red_cans + green_cans + blue_cans, \
-                                 redCanCount=red_cans, \
-                                 greenCanCount=green_cans, \
-                                 blueCanCount=blue_cans, \
-                                 balance=FRIDGE_ACCOUNT.balance)
+        shard = get_shard(fridge)
+        with locked(shard.fridge, shard.account):
+            generations = (shard.fridge.generation, shard.account.generation)
+            red_cans = shard.fridge.get_red_can()
+            green_cans = shard.fridge.get_green_can()
+            blue_cans = shard.fridge.get_blue_can()
+            balance = shard.account.balance
+        return self.render_page("fridge.html", (shard.fridge_id,), generations, \
+                                fridgeId=shard.fridge_id, \
+                                accountName=shard.account.name, \
+                                totalCanCount=red_cans + green_cans + blue_cans, \
+                                redCanCount=red_cans, \
+                                greenCanCount=green_cans, \
+                                blueCanCount=blue_cans, \
+                                balance=balance)
+
     @cherrypy.expose
     def blockchain(self):
         """ Called as /blockchain url and returns a web page that shows
             the progressively updating blockchain
         """
-        print("blockchain updating")
-        mytemplate = self.mylookupdirs.get_template("blockchain.html")
-        return mytemplate.render(fqdn=self.myfqdn)
+        logger.debug("blockchain updating")
+        return self.render_page("blockchain.html")
 
     @cherrypy.expose
-    def fridgeAccountBalance(self, *args):
+    def fridgeAccountBalance(self, *args, fridge=DEFAULT_FRIDGE_ID):
         """ Called by jQuery on the fridge page to GET the current balance
         """
-        cherrypy.log("Getting fridge account balance")
+        logger.debug("Getting fridge account balance")
+        shard = get_shard(fridge)
         cherrypy.response.status = 200
         cherrypy.response.headers['Content-Type'] = 'text/plain'
-        return "%.2f" % FRIDGE_ACCOUNT.balance
+        account = shard.account
+        return cached_response("/fridgeAccountBalance", (account.name,), (account.generation,),
+                               lambda: ("%.2f" % account.balance).encode())
 
     @cherrypy.expose
     def subscriberAccountBalance(self):
@@ -162,40 +607,105 @@ class Root(object):
         """
         cherrypy.response.status = 200
         cherrypy.response.headers['Content-Type'] = 'text/plain'
-        return "%.2f" % SUBSCRIBER_ACCOUNT.balance
+        account = SUBSCRIBER_ACCOUNT
+        return cached_response("/subscriberAccountBalance", (account.name,), (account.generation,),
+                               lambda: ("%.2f" % account.balance).encode())
 
     @cherrypy.expose
-    def fridgeCheckRestock(self):
+    def fridgeCheckRestock(self, fridge=DEFAULT_FRIDGE_ID):
         """ Called by jQuery on the subscriber page to GET the flag that
             indicates if the fridge needs restocking
         """
+        shard = get_shard(fridge)
         cherrypy.response.status = 200
         cherrypy.response.headers['Content-Type'] = 'text/plain'
-        return repr(THE_FRIDGE.check_stock())
+        return repr(shard.fridge.check_stock())
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def fridgeContents(self):
+    def fridgesNeedingRestock(self):
+        """ Called by GET to return a JSON list of the ids of all fridges that need restocking
+        """
+        return FRIDGES.needing_restock()
+
+    @cherrypy.expose
+    def fridgeContents(self, fridge=DEFAULT_FRIDGE_ID):
         """ Called by jQuery to GET the current contents of the fridge
         """
+        shard = get_shard(fridge)
         cherrypy.response.status = 200
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        results = dict()
-        results['red_can_count'] = THE_FRIDGE.get_red_can()
-        results['green_can_count'] = THE_FRIDGE.get_green_can()
-        results['blue_can_count'] = THE_FRIDGE.get_blue_can()
-        return results
+
+        def build():
+            contents = shard.fridge.as_dict()
+            results = dict()
+            results['red_can_count'] = contents['red_can_count']
+            results['green_can_count'] = contents['green_can_count']
+            results['blue_can_count'] = contents['blue_can_count']
+            return json.dumps(results).encode()
+        return cached_response("/fridgeContents", (shard.fridge_id,), (shard.fridge.generation,), build)
 
     @cherrypy.expose
-    def recentTransaction(self):
-        """ Returns 'True' if recent transaction has occurred on the blockchain, else 'False'.
-            Used so the blockchain.html javascript can notify such events by colouring a hash, 
+    @cherrypy.tools.json_out()
+    def ledger(self, n=20):
+        """ Called by GET to return the last n (at most MAX_LEDGER_ENTRIES) transactions
+            in the ledger as JSON, each with its account, type, amount, timestamp and
+            chained hash
         """
-        print("Looking for any recent transactions")
-        cherrypy.response.status = 200
-        cherrypy.response.headers['Content-Type'] = 'text/plain'
-        return repr(isRecentBlockchainTransaction())
-    
+        n = parse_count(n, MAX_LEDGER_ENTRIES)
+        if LEDGER is None:
+            return []
+        return LEDGER.recent(n)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def blocks(self, n=3):
+        """ Called by GET to return the last n mined blocks as JSON, each with its hash,
+            the previous block's hash, Merkle root and transactions with their hashes.
+            Used by blockchain.html to show the real chain.
+        """
+        return [block.as_dict() for block in CHAIN.recent_blocks(parse_count(n, MAX_BLOCKS))]
+
+    @cherrypy.expose
+    def metrics(self):
+        """ Called by GET (e.g. by Prometheus) to return request, database and sensor
+            acquisition timings and counts, in the Prometheus text format
+        """
+        EVENT_SUBSCRIBERS.set(BUS.subscriber_count())
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        return REGISTRY.render()
+
+    # format: (encoder, Content-Type, file extension)
+    EXPORT_FORMATS = {
+        'csv': (csv_chunks, 'text/csv', 'csv'),
+        'columnar': (columnar_chunks, 'application/octet-stream', 'bin'),
+    }
+
+    @cherrypy.expose
+    def export(self, sensors="*", start=None, end=None, format="csv"):
+        """ Called by GET to download the stored readings in bulk, streamed from a database
+            cursor a chunk at a time, so the memory used doesn't depend on the range:
+              sensors:     comma-separated sensor names (default: all of them)
+              start, end:  epoch-ms time range, start <= t < end (either may be left open)
+              format:      csv, or columnar for packed arrays of timestamps and values
+                           per sensor (see export.py)
+            Readings come sensor by sensor, each sensor's in time order.
+        """
+        try:
+            start = None if start is None else int(start)
+            end = None if end is None else int(end)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        if format not in self.EXPORT_FORMATS:
+            raise cherrypy.HTTPError(400, "format must be one of {}".format(", ".join(sorted(self.EXPORT_FORMATS))))
+        encode, content_type, extension = self.EXPORT_FORMATS[format]
+        sensor_names = None if sensors == "*" else sensors.split(",")
+
+        cherrypy.response.headers['Content-Type'] = content_type
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="readings.{}"'.format(extension)
+        return encode(SENSOR_STORE.iter_series_chunks(sensor_names, start, end))
+    export._cp_config = {'response.stream': True}
+
 
 @cherrypy.expose
 class StatusUpdate():
@@ -213,99 +723,148 @@ class StatusUpdate():
             "agreeToRestock": self.agreeToRestock,
         }   
 
-    def dragFromFridge(self, can_type):
+    # price paid into the fridge's account for each type of can taken out
+    CAN_PRICES = {"red_can": 0.3, "green_can": 0.4, "blue_can": 0.5}
+
+    def _check_can_type(self, can_type):
+        """Raise a 404 HTTPError for a can type the fridge doesn't hold
+        """
+        if can_type not in self.CAN_PRICES:
+            raise cherrypy.HTTPError(404, "There is no can type '{}'".format(can_type))
+        return
+    def dragFromFridge(self, shard, can_type):
         """PUT dragFromFridge command: Deposit the right amount in the fridge's account 
-           when we take a can from it
+           when we take a can from it.  Nothing is charged if there was no can to take.
         """
-        if can_type == "red_can":
-            THE_FRIDGE.decr_red_can()
-            FRIDGE_ACCOUNT.deposit(0.3)
-            cherrypy.response.status = "204 No Content"
-        elif can_type == "green_can":
-            THE_FRIDGE.decr_green_can()
-            FRIDGE_ACCOUNT.deposit(0.4)
-            cherrypy.response.status = "204 No Content"
-        elif can_type == "blue_can":
-            THE_FRIDGE.decr_blue_can()
-            FRIDGE_ACCOUNT.deposit(0.5)
-            cherrypy.response.status = "204 No Content"
-        else:
-            cherrypy.response.status = "404 Error"
+        self._check_can_type(can_type)
+        with locked(shard.fridge, shard.account):
+            if shard.fridge.contents[can_type] > 0:
+                shard.fridge.decr_can(can_type)
+                shard.account.deposit(self.CAN_PRICES[can_type])
+        cherrypy.response.status = "204 No Content"
         return
-    def dropInFridge(self, can_type):
+    def dropInFridge(self, shard, can_type):
         """PUT dropInFridge command: If we are returning a can to the fridge, we issue a small refund
         """
-        THE_FRIDGE.incr_can(can_type)
-        FRIDGE_ACCOUNT.withdraw(0.1)
+        self._check_can_type(can_type)
+        with locked(shard.fridge, shard.account):
+            shard.fridge.incr_can(can_type)
+            shard.account.withdraw(0.1)
         cherrypy.response.status = "204 No Content"
         return
-    def restockFridge(self,null_parameter):
+    def restockFridge(self, shard, null_parameter):
         """ PUT restockFridge command: run the restock method on the fridge, return subscriber's bond
             from escrow, and pay out their bounty (based on number of cans restocked)
         """
-        cans_added = THE_FRIDGE.restock()
-        ESCROW_ACCOUNT.withdraw(RESTOCK_BOND)
-        SUBSCRIBER_ACCOUNT.deposit(RESTOCK_BOND)
-        SUBSCRIBER_ACCOUNT.deposit(cans_added * 0.1)
+        with locked(shard.fridge, shard.escrow, SUBSCRIBER_ACCOUNT):
+            cans_added = shard.fridge.restock()
+            shard.escrow.withdraw(RESTOCK_BOND)
+            SUBSCRIBER_ACCOUNT.deposit(RESTOCK_BOND)
+            SUBSCRIBER_ACCOUNT.deposit(cans_added * 0.1)
         cherrypy.response.status = "204 No Content"
         return
-    def agreeToRestock(self, null_parameter):
-        """ PUT agreeToRestock command: take the subscriber's bond into escrow
+    def agreeToRestock(self, shard, null_parameter):
+        """ PUT agreeToRestock command: take the subscriber's bond into the fridge's escrow
         """
-        SUBSCRIBER_ACCOUNT.withdraw(RESTOCK_BOND)
-        ESCROW_ACCOUNT.deposit(RESTOCK_BOND)
+        with locked(SUBSCRIBER_ACCOUNT, shard.escrow):
+            SUBSCRIBER_ACCOUNT.withdraw(RESTOCK_BOND)
+            shard.escrow.deposit(RESTOCK_BOND)
         cherrypy.response.status = "204 No Content"
         return
 
     @cherrypy.expose
     def PUT(self, *args, **kw):
         """Handle the HTTP PUT command from javascript in the web pages to update
-           the contents of the fridge in various ways.
+           the contents of the fridge in various ways, as /statusupdate/<command>/<param>
+           for the default fridge, or /statusupdate/<fridge_id>/<command>/<param>.
+           Each command runs atomically, holding the locks of every fridge and account
+           it touches.
         """
-        print(args, kw)
-        print("Pre-move contents: "+THE_FRIDGE.status())
-        if args[0] in self.commandDict:
-            self.commandDict[args[0]](args[1])
+        logger.debug("PUT %s %s", args, kw)
+        if len(args) == 3:
+            fridge_id, command, param = args
+        elif len(args) == 2:
+            fridge_id = DEFAULT_FRIDGE_ID
+            command, param = args
+        else:
+            cherrypy.response.status = "404 Error"
+            return
+        try:
+            shard = FRIDGES.get(fridge_id)
+        except KeyError:
+            cherrypy.response.status = "404 Error"
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Pre-move contents: %s", shard.fridge.status())
+        if command in self.commandDict:
+            self.commandDict[command](shard, param)
         else:
             cherrypy.response.status = "404 Error"
-        print("Post-move contents: "+THE_FRIDGE.status())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Post-move contents: %s", shard.fridge.status())
         # Possible responses are 204 (No Content)  or 404 (Error)
         return
 
 
-def read_and_store_sensors():
-    """function spun off into separate thread by main() in order to
-       periodically read the sensor(s) and write their values to the database
+def store_sensor_readings(sensor_readings):
+    """called by the sampling schedule's thread with each batch of sensor readings,
+       to write their values to the database
     """
-    logging.info("reading the sensors and writing to the database")
-
-    store = SensorStore()
+    logger.debug("writing %d sensor readings to the database", len(sensor_readings))
 
-    sensor_list = [TemperatureSensor("thermometer 1"), TemperatureSensor("thermometer 2")]
+    # Write the results to the local db, as one transaction, leaving out any that haven't
+    # changed, though they still count in the rollups; the live views are still sent
+    # every reading
+    stored, unchanged = DEADBAND.split(sensor_readings)
+    SENSOR_STORE.add_readings(stored, unstored=unchanged)
+    RECENT_READINGS.add_readings(sensor_readings)
 
-    # Read the sensors
-    sensor_readings = []
-    for sensor in sensor_list:
-        sensor_readings.append(sensor.get_reading())
-
-    # Write the results to the local db
-    for result in sensor_readings:
-        store.add_reading(sensor_name=result.get_name(), when=result.get_timestamp(),
-                          reading_type=result.get_type(), value=result.get_value())
-
-    print("+", end='', flush=True)
-
-    store.close()
+    # Push each new reading to anyone watching the live data
+    for r in sensor_readings:
+        BUS.publish('reading', {'sensor': r.get_name(), 't': r.get_timestamp_ms(), 'v': r.get_value()})
 
 if __name__ == '__main__':
+    # Hot paths log at debug level, so cost nothing unless this is lowered to DEBUG
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
     # Global config
     cherrypy.config.update({'environment': 'production', \
                             'log.access_file' : '', \
-                            'access_log': None})
-
-    # Kick off the background process that reads the sensor values into the database
-    MONITOR_PROC = cherrypy.process.plugins.BackgroundTask(5, read_and_store_sensors)
-    MONITOR_PROC.start()
+                            'access_log': None, \
+                            'tools.metrics.on': True, \
+                            'server.thread_pool': THREAD_POOL})
+
+    # Open the sensor database once, bootstrapping its schema, and share it between threads
+    SENSOR_STORE = SensorStore()
+    # high priority number, so the store closes after the plugins that use it have stopped
+    cherrypy.engine.subscribe('stop', SENSOR_STORE.close, priority=90)
+
+    # Restore every account's balance from the ledger, and record all changes there
+    LEDGER = Ledger()
+    for fridge_id in FRIDGES.fridge_ids():
+        shard = FRIDGES.get(fridge_id)
+        shard.account.attach_ledger(LEDGER)
+        shard.escrow.attach_ledger(LEDGER)
+    SUBSCRIBER_ACCOUNT.attach_ledger(LEDGER)
+    cherrypy.engine.subscribe('stop', LEDGER.close, priority=90)
+
+    # Mine account transactions into blocks in the background
+    CHAIN.start()
+    cherrypy.engine.subscribe('stop', CHAIN.stop)
+
+    # Periodically drop raw readings past their retention time, and shrink the file
+    RetentionPlugin(cherrypy.engine, SENSOR_STORE, RetentionPolicy()).subscribe()
+
+    # Kick off the background process that reads the sensor values into the database.
+    # Each sensor is read on its own wall-clock schedule; those due together are read
+    # concurrently and written in one batch, and any that take over 2s are left out.
+    SENSOR_POLLER = SensorPoller(SENSORS, timeout=2.0)
+    SENSOR_SCHEDULE = SamplingSchedule(SENSOR_POLLER, SENSOR_INTERVALS,
+                                       default_interval=DEFAULT_SENSOR_INTERVAL)
+    SENSOR_SCHEDULE.start(store_sensor_readings)
+    cherrypy.engine.subscribe('stop', SENSOR_SCHEDULE.stop, priority=20)
+    cherrypy.engine.subscribe('stop', SENSOR_POLLER.close)
+    cherrypy.engine.subscribe('stop', I2CSensor.close_buses)
 
     # Set up configs for the different application classes that we run
     JSON_CONF = {
@@ -318,6 +877,13 @@ if __name__ == '__main__':
         }
     }
 
+    STREAM_CONF = {
+        '/': {
+            'tools.response_headers.on': True,
+            'tools.response_headers.headers': [('Access-Control-Allow-Origin', '*')],
+        }
+    }
+
     PATH = os.path.abspath(os.path.dirname(__file__))
     HTML_CONF = {
         '/': {
@@ -331,12 +897,17 @@ if __name__ == '__main__':
     # Attach the JSON web service applications to the right places
     cherrypy.tree.mount(JSONGeneratorWebService(), '/json', JSON_CONF)
     cherrypy.tree.mount(StatusUpdate(), '/statusupdate', JSON_CONF)
+    # each open /stream connection holds a worker thread, so keep some back for the rest
+    cherrypy.tree.mount(EventStream(max_streams=THREAD_POOL - RESERVED_THREADS), '/stream', STREAM_CONF)
     # Attach the fridge serving methods
     cherrypy.tree.mount(Root(), '/', HTML_CONF)
 
     # Bind to all IP addresses (accessible locally in browser at 127.0.0.1)
     cherrypy.server.socket_host = '0.0.0.0'
 
+    # Compile the page templates before the first request for them
+    Root.precompile()
+
     # Boot up the web server
     cherrypy.engine.start()
     cherrypy.engine.block()
@@ -0,0 +1,190 @@
+"""Append-only, persistent ledger of account transactions, so money survives a restart.
+
+Every deposit and withdrawal is appended as an entry (sequence number, account,
+type, amount, timestamp) whose hash chains it to the entry before, so any later
+change to the history can be detected with verify().  Entries are written to an
+SQLite database by a background thread in batches, one transaction (and fsync) per
+batch.  Every <snapshot_every> entries the balances are snapshotted too, so at
+startup they are rebuilt from the latest snapshot plus the few entries after it,
+rather than by replaying the whole ledger.
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('ledger')
+
+DEFAULT_LEDGER_FILE = 'ledger.db'
+GENESIS_HASH = '0' * 64
+
+
+def entry_hash(prev_hash, seq, account, type, amount, created_at):
+    text = "{}|{}|{}|{}|{!r}|{}".format(prev_hash, seq, account, type, float(amount), created_at)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Ledger(object):
+
+    def __init__(self, db_file=DEFAULT_LEDGER_FILE, flush_interval=0.5, batch_size=500,
+                 snapshot_every=1000):
+        self.flush_interval = flush_interval    # most seconds an entry waits to be written
+        self.batch_size = batch_size            # entries that trigger an immediate write
+        self.snapshot_every = snapshot_every
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        with self.db:
+            self.db.execute(
+                '''CREATE TABLE IF NOT EXISTS entries(seq INTEGER PRIMARY KEY, account TEXT NOT NULL,
+                   type TEXT NOT NULL, amount REAL NOT NULL, created_at INTEGER NOT NULL,
+                   hash TEXT NOT NULL)''')
+            self.db.execute(
+                '''CREATE TABLE IF NOT EXISTS snapshots(seq INTEGER NOT NULL, account TEXT NOT NULL,
+                   balance REAL NOT NULL, PRIMARY KEY (seq, account))''')
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending = []
+        self._load()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._write_periodically, name="Ledger writer",
+                                        daemon=True)
+        self._writer.start()
+        return
+
+    def _load(self):
+        """Rebuild the balances from the latest snapshot and the entries after it
+        """
+        self._balances = {}
+        row = self.db.execute('SELECT MAX(seq) FROM snapshots').fetchone()
+        self._snapshot_seq = row[0] or 0
+        for account, balance in self.db.execute('SELECT account, balance FROM snapshots WHERE seq=?',
+                                                (self._snapshot_seq,)):
+            self._balances[account] = balance
+        self._seq = self._snapshot_seq
+        self._last_hash = GENESIS_HASH
+        for seq, account, type, amount, hash in self.db.execute(
+                'SELECT seq, account, type, amount, hash FROM entries WHERE seq>? ORDER BY seq',
+                (self._snapshot_seq,)):
+            self._apply(account, type, amount)
+            self._seq = seq
+            self._last_hash = hash
+        if self._seq == self._snapshot_seq and self._seq > 0:
+            self._last_hash = self.db.execute('SELECT hash FROM entries WHERE seq=?',
+                                              (self._seq,)).fetchone()[0]
+        return
+
+    def _apply(self, account, type, amount):
+        if type == "open":
+            self._balances[account] = amount
+        elif type == "credit":
+            self._balances[account] = self._balances.get(account, 0.0) + amount
+        elif type == "debit":
+            self._balances[account] = self._balances.get(account, 0.0) - amount
+        else:
+            raise ValueError("unknown ledger entry type '{}'".format(type))
+        return
+
+    def append(self, account, type, amount):
+        """Record a transaction: type is "open" (set the starting balance), "credit" or
+           "debit".  It is written to disk within flush_interval seconds.
+           Returns: the entry's hash
+        """
+        with self._lock:
+            self._apply(account, type, amount)
+            self._seq += 1
+            created_at = int(time.time() * 1000)
+            self._last_hash = entry_hash(self._last_hash, self._seq, account, type, amount, created_at)
+            self._pending.append((self._seq, account, type, amount, created_at, self._last_hash))
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+            return self._last_hash
+
+    def balance(self, account):
+        """Return the account's balance according to the ledger, or None if the ledger
+           has never seen the account
+        """
+        with self._lock:
+            return self._balances.get(account)
+
+    def recent(self, count=10):
+        """Return the last <count> entries, oldest first, as dicts
+        """
+        self.flush()
+        with self._db_lock:
+            rows = self.db.execute(
+                '''SELECT seq, account, type, amount, created_at, hash FROM entries
+                   ORDER BY seq DESC LIMIT ?''', (count,)).fetchall()
+        rows.reverse()
+        return [dict(zip(('seq', 'account', 'type', 'amount', 'timestamp', 'hash'), row)) for row in rows]
+
+    def flush(self, snapshot=False):
+        """Write all pending entries, and a snapshot of the balances if one is due (or
+           <snapshot> is True), in one transaction.  If that fails, the entries are put
+           back ahead of any appended since, so the chain has no gaps, and the error is raised.
+        """
+        with self._db_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                due = self._seq - self._snapshot_seq >= self.snapshot_every
+                if (due or snapshot) and self._seq > self._snapshot_seq:
+                    snapshot = (self._seq, dict(self._balances))
+                else:
+                    snapshot = None
+            if not batch and snapshot is None:
+                return
+            try:
+                with self.db:
+                    self.db.executemany(
+                        '''INSERT INTO entries(seq, account, type, amount, created_at, hash)
+                           VALUES(?,?,?,?,?,?)''', batch)
+                    if snapshot is not None:
+                        seq, balances = snapshot
+                        self.db.executemany('INSERT INTO snapshots(seq, account, balance) VALUES(?,?,?)',
+                                            [(seq, account, balance) for account, balance in balances.items()])
+                        self.db.execute('DELETE FROM snapshots WHERE seq<?', (seq,))
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            if snapshot is not None:
+                self._snapshot_seq = snapshot[0]
+        return
+
+    def verify(self):
+        """Check the hash chain over every entry written so far.
+           Returns: the seq of the first entry that doesn't match, or None if all is well
+        """
+        self.flush()
+        prev_hash = GENESIS_HASH
+        with self._db_lock:
+            for seq, account, type, amount, created_at, hash in self.db.execute(
+                    'SELECT seq, account, type, amount, created_at, hash FROM entries ORDER BY seq'):
+                if entry_hash(prev_hash, seq, account, type, amount, created_at) != hash:
+                    return seq
+                prev_hash = hash
+        return None
+
+    def _write_periodically(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the entries are still pending, so try again next time
+                logger.exception("Failed to write %d ledger entries; will retry", len(self._pending))
+        return
+
+    def close(self):
+        """Write everything still pending, with a final snapshot so the next start is
+           quick, and close the database
+        """
+        self._stop.set()
+        self._wake.set()
+        self._writer.join()
+        self.flush(snapshot=True)
+        self.db.close()
+        return
@@ -0,0 +1,173 @@
+"""Lightweight counters and latency histograms, rendered in the Prometheus text format
+for the /metrics endpoint.
+
+Recording is cheap enough for hot paths: a counter increment or a histogram
+observation is one short lock hold and a few additions, with the label values
+looked up in a dict.  Metrics are created once, at import time, from the
+process-wide REGISTRY:
+    QUERY_SECONDS = REGISTRY.histogram('sensorstore_query_seconds',
+                                       'Time taken by SensorStore queries', ['query'])
+    with QUERY_SECONDS.time(query='get_series'):
+        ...
+"""
+import threading
+import time
+from bisect import bisect_left
+
+# upper bounds, in seconds, of the default latency buckets: 0.5ms to 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n'))
+                          for name, value in pairs) + "}"
+
+
+def _number(value):
+    return "+Inf" if value == float('inf') else repr(float(value))
+
+
+class _Metric(object):
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}       # tuple of label values: value(s)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError("{} needs labels {}".format(self.name, self.labels))
+        return tuple(labels[name] for name in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        return
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ["{}{} {}".format(self.name, _label_text(self.labels, key), _number(value))
+                for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        return
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # a count per bucket (the last for values above them all), then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+        return
+
+    def time(self, **labels):
+        """Returns: a context manager that observes how long its block takes, in seconds
+        """
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return 0 if counts is None else sum(counts[:-1])
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _label_text(self.labels, key, [('le', _number(bound))]), total))
+            lines.append("{}_sum{} {}".format(self.name, _label_text(self.labels, key), _number(counts[-1])))
+            lines.append("{}_count{} {}".format(self.name, _label_text(self.labels, key), total))
+        return lines
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labels != metric.labels:
+                    raise ValueError("metric {} is already registered differently".format(metric.name))
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Returns: every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append("# HELP {} {}".format(name, metric.help))
+            lines.append("# TYPE {} {}".format(name, metric.kind))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()     # the process-wide metrics
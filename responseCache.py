@@ -0,0 +1,99 @@
+"""Cache of rendered responses for the endpoints that pages poll, so a poll that finds
+nothing changed costs neither a recomputation nor, given an ETag, a response body.
+
+Each source of state (the fridges, accounts, and recent and stored sensor readings)
+counts its changes in a <generation> attribute.  A response is cached under its
+endpoint, its parameters and the generations of the state it was built from, so a
+change to any of them simply means a new key; stale entries are never served.  A
+response cached in a <group> (the endpoint and parameters) replaces the group's older
+one straight away, and the rest age out as the least recently used, within a limit
+on their total size.  The ETag is derived from the same key, so whether a client's
+copy is current can be told without building anything.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# differs on each start, as the generations start again from 0
+_BOOT_ID = os.urandom(4).hex()
+
+
+def make_etag(key):
+    """Return a strong ETag for the response cached under <key>
+    """
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return '"{}-{}"'.format(_BOOT_ID, digest)
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value names <etag> (or is *)
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+class ResponseCache(object):
+    """LRU cache of up to <max_entries> response bodies, of no more than <max_bytes> in
+       all.  Bodies over <max_body_bytes> are too big to be worth keeping, and aren't.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, max_body_bytes=256 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0                     # bytes of the bodies cached
+        self._entries = OrderedDict()     # key: (body, group)
+        self._groups = {}                 # group: the key cached for it
+        self._lock = threading.Lock()
+
+    def get(self, key, compute, group=None):
+        """Return the body cached under <key>, or call compute() to build it, and cache that.
+           Caching it under <group> drops whatever was cached for the group before.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # built outside the lock, so a slow query doesn't hold up other requests
+        body = compute()
+        if len(body) > self.max_body_bytes:
+            return body
+        with self._lock:
+            self._remove(key)       # if another thread built it too
+            if group is not None:
+                self._remove(self._groups.get(group))
+                self._groups[group] = key
+            self._entries[key] = (body, group)
+            self.size += len(body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return body
+
+    def _remove(self, key):
+        """Drop the entry for <key>, if there is one.  Must be called with _lock held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            body, group = entry
+            self.size -= len(body)
+            if group is not None and self._groups.get(group) == key:
+                del self._groups[group]
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self.size = 0
+        return
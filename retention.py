@@ -0,0 +1,64 @@
+"""Retention policy for the sensor database, so sensorData.db doesn't grow forever.
+ - RetentionPolicy says how long to keep raw readings and each rollup table, and
+   applies that to a SensorStore
+ - RetentionPlugin is a CherryPy engine plugin that applies a policy periodically
+   in a background thread while the web server runs
+"""
+import logging
+import time
+from datetime import timedelta
+
+import cherrypy
+from cherrypy.process.plugins import Monitor
+
+logger = logging.getLogger('retention')
+
+
+class RetentionPolicy(object):
+    """How long to keep each kind of data.  By default raw readings are kept for 7 days
+       and the 1 minute, 1 hour and 1 day rollups are kept forever, so old history can
+       still be charted at coarser resolution.  A keep time of None means forever.
+    """
+
+    def __init__(self, readings=timedelta(days=7), rollup_1m=None, rollup_1h=None, rollup_1d=None,
+                 chunk_size=1000, vacuum_pages=1000):
+        self.keep = {'readings': readings, 'rollup_1m': rollup_1m,
+                     'rollup_1h': rollup_1h, 'rollup_1d': rollup_1d}
+        self.chunk_size = chunk_size        # rows deleted per transaction
+        self.vacuum_pages = vacuum_pages    # pages freed per run (None for all of them)
+
+    def enforce(self, store, now=None):
+        """Delete everything older than its keep time from <store>, then shrink the file.
+           Returns: a dict of table name to the number of rows deleted
+        """
+        now_ms = int(1000 * (time.time() if now is None else now))
+        deleted = {}
+        for table, keep in self.keep.items():
+            if keep is None:
+                continue
+            cutoff = now_ms - int(keep.total_seconds() * 1000)
+            deleted[table] = store.purge(table, cutoff, chunk_size=self.chunk_size)
+        store.vacuum(self.vacuum_pages)
+        return deleted
+
+
+class RetentionPlugin(Monitor):
+    """Enforces a RetentionPolicy on a SensorStore every <frequency> seconds
+       (default hourly) for as long as the CherryPy engine is running
+    """
+
+    def __init__(self, bus, store, policy=None, frequency=3600):
+        self.store = store
+        self.policy = RetentionPolicy() if policy is None else policy
+        Monitor.__init__(self, bus, self.run, frequency=frequency, name='SensorStore retention')
+
+    def run(self):
+        # an exception would end the BackgroundTask, and with it retention, for good
+        try:
+            deleted = self.policy.enforce(self.store)
+        except Exception:
+            cherrypy.log("Retention failed; will try again next time", context='RETENTION',
+                         severity=logging.ERROR, traceback=True)
+            return
+        logger.info("Retention: deleted {}".format(deleted))
+        return
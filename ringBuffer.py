@@ -0,0 +1,85 @@
+"""In-memory ring buffers of the most recent sensor readings, so the live dashboard's
+frequent "last few readings" polls can be answered without touching the database.
+"""
+import threading
+from array import array
+
+
+class ReadingRing(object):
+    """Fixed-size ring of (epoch_ms, value) readings for one series.  Timestamps and
+       values are held in two preallocated arrays rather than as objects, so memory
+       use is fixed and appending never allocates.
+    """
+
+    def __init__(self, capacity=720):
+        self.capacity = capacity
+        self._timestamps = array('q', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._head = 0      # where the next reading goes
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp_ms, value):
+        with self._lock:
+            self._timestamps[self._head] = timestamp_ms
+            self._values[self._head] = value
+            self._head = (self._head + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+        return
+
+    def latest(self, n):
+        """Return the last <n> readings as (epoch_ms, value) pairs, oldest first,
+           or None if fewer than <n> readings are held
+        """
+        with self._lock:
+            if n > self._count:
+                return None
+            start = (self._head - n) % self.capacity
+            end = start + n
+            if end <= self.capacity:
+                timestamps = self._timestamps[start:end]
+                values = self._values[start:end]
+            else:
+                end -= self.capacity
+                timestamps = self._timestamps[start:] + self._timestamps[:end]
+                values = self._values[start:] + self._values[:end]
+        return list(zip(timestamps, values))
+
+
+class RecentReadings(object):
+    """A ReadingRing per sensor, plus one under "*" holding every sensor's readings
+       interleaved in arrival order, as the /json web service reports them
+    """
+
+    def __init__(self, capacity=720):
+        self.capacity = capacity
+        self._rings = {"*": ReadingRing(capacity)}
+        self._lock = threading.Lock()
+        self.generation = 0     # counts batches added, for caches of what we return
+
+    def add_readings(self, readings):
+        """Record an iterable of SensorReadings
+        """
+        for r in readings:
+            ring = self._rings.get(r.get_name())
+            if ring is None:
+                with self._lock:
+                    ring = self._rings.setdefault(r.get_name(), ReadingRing(self.capacity))
+            ring.append(r.get_timestamp_ms(), r.get_value())
+            self._rings["*"].append(r.get_timestamp_ms(), r.get_value())
+        with self._lock:
+            self.generation += 1
+        return
+
+    def get_series(self, sensor_name="*", count=10):
+        """Return the last <count> readings of the sensor (or all sensors, for "*") as
+           (epoch_ms, value) pairs, oldest first, or None if that many aren't held
+        """
+        ring = self._rings.get(sensor_name)
+        if ring is None:
+            return None
+        return ring.latest(count)
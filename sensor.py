@@ -1,23 +1,42 @@
+"""Sensors attached to the system, and a registry of the drivers for each type of sensor.
+Each Sensor subclass that sets its own sensor_type is registered as the driver for
+that type, so sensors can be created by type name with make_sensor().
+"""
 import random
+import threading
 from abc import ABC, abstractmethod
 from datetime import datetime
 from sensorReading import SensorReading
 
+SENSOR_DRIVERS = {}     # sensor_type: Sensor subclass
+
+
+def make_sensor(sensor_type, name, **kwargs):
+    """Create a sensor of the given type, using its registered driver; KeyError if
+       there is no driver for the type
+    """
+    return SENSOR_DRIVERS[sensor_type](name, **kwargs)
+
+
 class Sensor(ABC):
     """A sensor attached to the system, of a particular type, able to return its data value.
-       Subclass this and override the value() method for a particular implementation.
+       Subclass this and override the get_reading() method for a particular implementation.
     Attributes:
         sensor_type:  A string with the type of sensor
         name: A string with the unique name of this particular sensor
         value: current reading of sensor, in units appropriate to its type
     """
+    sensor_type = "abstract sensor"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'sensor_type' in cls.__dict__:
+            SENSOR_DRIVERS[cls.sensor_type] = cls
 
     def __init__(self, name):
         self.name = name
         self.value = -1
-        self.sensor_type = "abstract sensor"
 
-    @classmethod
     @abstractmethod
     def get_reading(self):
         """return the current sensor reading for this sensor instance"""
@@ -30,7 +49,55 @@ class Sensor(ABC):
         return self.name
 
 
-class TemperatureSensor(Sensor):
+class I2CSensor(Sensor):
+    """A sensor on an I2C bus.  Each bus is opened once, on first use, and kept open for
+       every sensor on it; reads on one bus are serialised, as the bus can only carry
+       one transfer at a time.
+    """
+    _buses = {}        # bus number: (SMBus, lock), or (None, None) if smbus isn't available
+    _buses_lock = threading.Lock()
+
+    def __init__(self, name, address, bus_number=1):
+        super().__init__(name)
+        self.address = address          # 7 bit address (left shifted to add the read/write bit)
+        self.bus_number = bus_number    # 0 for /dev/i2c-0, 1 for /dev/i2c-1
+
+    def _bus(self):
+        """Return the (SMBus, lock) for this sensor's bus, or (None, None) if there isn't one.
+           OSError if the bus can't be opened.
+        """
+        with I2CSensor._buses_lock:
+            bus = I2CSensor._buses.get(self.bus_number)
+            if bus is None:
+                try:
+                    import smbus
+                    bus = (smbus.SMBus(self.bus_number), threading.Lock())
+                except ImportError:
+                    bus = (None, None)
+                I2CSensor._buses[self.bus_number] = bus
+        return bus
+
+    def read_word(self, register):
+        """Read a 16 bit register from the device.  Returns None if there is no I2C
+           support; OSError if the device can't be read.
+        """
+        bus, lock = self._bus()
+        if bus is None:
+            return None
+        with lock:
+            return bus.read_word_data(self.address, register)
+
+    @classmethod
+    def close_buses(cls):
+        with cls._buses_lock:
+            for bus, lock in cls._buses.values():
+                if bus is not None:
+                    bus.close()
+            cls._buses.clear()
+        return
+
+
+class TemperatureSensor(I2CSensor):
     """A temperature sensor"""
     sensor_type = "temperature"
 
@@ -38,19 +105,16 @@ class TemperatureSensor(Sensor):
     last_temp = 4.0  
     fan_on = False
 
+    def __init__(self, name, address=0x48, bus_number=1):
+        super().__init__(name, address, bus_number)
+
     def get_reading(self):
         temperature = 0.0
         try:
-            import smbus
-            # 0 for /dev/i2c-0,  1 for /dev/i2c-1
-            I2C_BUS = 1
-            bus = smbus.SMBus(I2C_BUS)
-                
-            #7 bit address (will be left shifted to add the read write bit)
-            DEVICE_ADDRESS = 0x48      
-
             #Read the temp register
-            temp_reg_12bit = bus.read_word_data(DEVICE_ADDRESS , 0 )
+            temp_reg_12bit = self.read_word(0)
+            if temp_reg_12bit is None:
+                raise ImportError("no smbus module")
             temp_low = (temp_reg_12bit & 0xff00) >> 8
             temp_high = (temp_reg_12bit & 0x00ff)
             #convert to temp from page 6 of datasheet
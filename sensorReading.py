@@ -2,14 +2,35 @@
 """
 from datetime import datetime
 
+
+def to_epoch_ms(when):
+    """Convert a datetime (naive datetimes are local time) to integer milliseconds
+       since the epoch.  Integers are assumed to be epoch-ms already.
+    """
+    if isinstance(when, int):
+        return when
+    return int(round(when.timestamp() * 1000))
+
+
 class SensorReading(object):
     def __init__(self, s_name, s_type, timestamp, value):
+        """timestamp may be a datetime, or an int of epoch milliseconds as held in the
+           SensorStore.  Both forms are available from the getters; the datetime is
+           only built if somebody asks for it.
+        """
         self.sensor_name = s_name
         self.sensor_type = s_type
-        self.timestamp = timestamp
+        self.timestamp_ms = to_epoch_ms(timestamp)
+        self._timestamp = None if isinstance(timestamp, int) else timestamp
         self.value = value
         return
 
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            self._timestamp = datetime.fromtimestamp(self.timestamp_ms / 1000.0)
+        return self._timestamp
+
     def __str__(self):
         s = "(name='{}', type='{}', timestamp='{}', " \
             "value={})".format(self.sensor_name, self.sensor_type, self.timestamp, self.value)
@@ -24,6 +45,9 @@ class SensorReading(object):
     def get_timestamp(self):
         return self.timestamp
 
+    def get_timestamp_ms(self):
+        return self.timestamp_ms
+
     def get_value(self):
         return self.value
 
@@ -1,96 +1,580 @@
 """Responsible for storing and retrieving sensor data to a non-volatile database
+
+A SensorStore is intended to be created once per process and shared.  It keeps a
+small pool of long-lived SQLite connections: one reader connection per thread
+that uses the store (e.g. one per CherryPy worker thread), created lazily on first
+use, and a single dedicated writer connection that is shared under a lock.  The
+schema is checked and created once, when the store is opened, not per request.
 """
+import logging
 import sqlite3
+import threading
+
+from sensorReading import SensorReading, to_epoch_ms
+from metrics import REGISTRY
+
+logger = logging.getLogger('sensorStore')
+
+DEFAULT_DB_FILE = 'sensorData.db'
+SCHEMA_VERSION = 2
+
+QUERY_SECONDS = REGISTRY.histogram('sensorstore_query_seconds',
+                                   'Time taken to run SensorStore queries', ['query'])
+COMMIT_SECONDS = REGISTRY.histogram('sensorstore_commit_seconds',
+                                    'Time taken to write a batch of readings, including the commit')
+ROWS_WRITTEN = REGISTRY.counter('sensorstore_rows_written_total', 'Readings passed to SensorStore for writing')
+
+# Pre-aggregated rollup tables, (bucket width in ms, table name), coarsest first
+ROLLUPS = [
+    (24 * 60 * 60 * 1000, 'rollup_1d'),
+    (60 * 60 * 1000, 'rollup_1h'),
+    (60 * 1000, 'rollup_1m'),
+]
+
+
+def _migrate_to_v1(db):
+    """Version 1: readings keyed by (sensor_id, created_at), timestamps as integer
+       epoch milliseconds, and a sensors lookup table for names and reading types.
+       readings is a WITHOUT ROWID table, so its primary key is the clustered,
+       covering index for per-sensor time-range queries; readings_by_time covers
+       the all-sensor "most recent" query.
+       Any version 0 table is migrated in place.  Its created_at strings were written
+       from naive local datetimes, hence the 'utc' modifier when converting them.
+    """
+    legacy = db.execute("""SELECT 1 FROM sqlite_master
+                           WHERE type='table' AND name='readings'""").fetchone()
+    if legacy:
+        db.execute('ALTER TABLE readings RENAME TO readings_v0')
+    db.execute('''CREATE TABLE sensors(sensor_id INTEGER PRIMARY KEY,
+                  sensor_name TEXT NOT NULL UNIQUE, reading_type TEXT)''')
+    db.execute('''CREATE TABLE readings(sensor_id INTEGER NOT NULL REFERENCES sensors(sensor_id),
+                  created_at INTEGER NOT NULL, value REAL,
+                  PRIMARY KEY (sensor_id, created_at)) WITHOUT ROWID''')
+    db.execute('CREATE INDEX readings_by_time ON readings(created_at, value)')
+    if legacy:
+        db.execute('''INSERT INTO sensors(sensor_name, reading_type)
+                      SELECT sensor_name, MAX(reading_type) FROM readings_v0
+                      GROUP BY sensor_name''')
+        db.execute('''INSERT OR IGNORE INTO readings(sensor_id, created_at, value)
+                      SELECT s.sensor_id,
+                             CAST(ROUND((julianday(o.created_at, 'utc') - 2440587.5) * 86400000.0) AS INTEGER),
+                             o.value
+                      FROM readings_v0 AS o JOIN sensors AS s USING (sensor_name)''')
+        db.execute('DROP TABLE readings_v0')
+    return
+
+
+def _migrate_to_v2(db):
+    """Version 2: per-sensor rollup tables holding count, sum, min and max for each
+       1 minute, 1 hour and 1 day bucket (UTC, aligned to the epoch).  They are kept
+       up to date by triggers as readings are inserted, so the cost is paid once per
+       reading rather than on every query, and they are backfilled here from any
+       readings already stored.  Deleting raw readings leaves the rollups alone.
+       The triggers use INSERT OR IGNORE then UPDATE rather than an upsert, to work
+       with the older sqlite found on Raspbian.
+    """
+    for width, table in ROLLUPS:
+        db.execute('''CREATE TABLE {table}(sensor_id INTEGER NOT NULL REFERENCES sensors(sensor_id),
+                      bucket INTEGER NOT NULL, count INTEGER NOT NULL, sum REAL NOT NULL,
+                      min REAL NOT NULL, max REAL NOT NULL,
+                      PRIMARY KEY (sensor_id, bucket)) WITHOUT ROWID'''.format(table=table))
+        db.execute('''INSERT INTO {table}(sensor_id, bucket, count, sum, min, max)
+                      SELECT sensor_id, (created_at / {width}) * {width},
+                             COUNT(*), SUM(value), MIN(value), MAX(value)
+                      FROM readings WHERE value IS NOT NULL
+                      GROUP BY 1, 2'''.format(table=table, width=width))
+        db.execute('''CREATE TRIGGER {table}_on_insert AFTER INSERT ON readings
+                      WHEN NEW.value IS NOT NULL
+                      BEGIN
+                        INSERT OR IGNORE INTO {table}(sensor_id, bucket, count, sum, min, max)
+                          VALUES(NEW.sensor_id, (NEW.created_at / {width}) * {width}, 0, 0.0,
+                                 NEW.value, NEW.value);
+                        UPDATE {table} SET count = count + 1, sum = sum + NEW.value,
+                                           min = MIN(min, NEW.value), max = MAX(max, NEW.value)
+                          WHERE sensor_id = NEW.sensor_id
+                            AND bucket = (NEW.created_at / {width}) * {width};
+                      END'''.format(table=table, width=width))
+    return
+
+
+# (schema version, function that upgrades the previous version to it), in order
+_MIGRATIONS = [
+    (1, _migrate_to_v1),
+    (2, _migrate_to_v2),
+]
+
+
+def align_range(bucket_ms, start=None, end=None):
+    """Round an epoch-ms (or datetime) range out to whole buckets of <bucket_ms>.
+       Returns: (start rounded down, end rounded up), either None if open
+    """
+    start = None if start is None else (to_epoch_ms(start) // bucket_ms) * bucket_ms
+    end = None if end is None else -(-to_epoch_ms(end) // bucket_ms) * bucket_ms
+    return start, end
 
-from datetime import datetime
-from sensorReading import SensorReading
 
 class SensorStore(object):
 
-    def __init__(self):
-        try:
-            # Creates or opens a file called mydb with a SQLite3 DB
-            self.db = sqlite3.connect('sensorData.db')
-            self.db_open = True
-            cursor = self.db.cursor()
-            # Check if table users does not exist and create it
-            cursor.execute('''CREATE TABLE IF NOT EXISTS
-                          readings(sensor_name TEXT NOT NULL, created_at timestamp NOT NULL, 
-                          reading_type TEXT, value INTEGER)''')
-            # Commit the change
-            self.db.commit()
-        # Catch the exception
-        except Exception as e:
-            # Roll back any change if something goes wrong
-            self.db.rollback()
-            raise e
+    def __init__(self, db_file=DEFAULT_DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()    # holds each thread's reader connection
+        self._readers = []                 # every reader connection we've handed out
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sensor_ids = {}              # sensor name -> id, cache for the writer
+        self.generation = 0                # counts committed changes, for caches of query results
+        # The writer is shared between threads, so sqlite's same-thread check must be off;
+        # _write_lock serialises all use of it.
+        self.db = self._connect()
+        self.db_open = True
+        self._create_schema()
+        return
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, check_same_thread=False)
+
+    def _create_schema(self):
+        """Bring the database up to SCHEMA_VERSION, running any migrations it needs.
+           The version is held in sqlite's PRAGMA user_version; a file created before
+           versioning (the original single readings table) reports version 0.
+        """
+        with self._write_lock:
+            # Incremental auto-vacuum lets vacuum() hand pages freed by purge() back to
+            # the filesystem a few at a time.  It only takes effect on a new file, so
+            # an existing one is converted by a one-off full VACUUM below.
+            self.db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            # Write-ahead logging lets the readers carry on while the writer commits, and
+            # with synchronous=NORMAL the log is only fsync'd at checkpoints, which
+            # spares the SD card.  journal_mode is persistent; synchronous is per connection.
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            version = self.db.execute('PRAGMA user_version').fetchone()[0]
+            for target_version, migration in _MIGRATIONS:
+                if version >= target_version:
+                    continue
+                try:
+                    self.db.execute('BEGIN')
+                    migration(self.db)
+                    self.db.execute('PRAGMA user_version = {:d}'.format(target_version))
+                    self.db.commit()
+                except Exception as e:
+                    # Roll back any change if something goes wrong
+                    self.db.rollback()
+                    raise e
+                version = target_version
+            if self.db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                self.db.execute('VACUUM')
         return
 
+    def _sensor_id(self, sensor_name, reading_type):
+        """Return the id of the named sensor, registering it if it is new.
+           Must be called with _write_lock held.
+        """
+        sensor_id = self._sensor_ids.get(sensor_name)
+        if sensor_id is None:
+            self.db.execute('''INSERT OR IGNORE INTO sensors(sensor_name, reading_type)
+                               VALUES(?,?)''', (sensor_name, reading_type))
+            sensor_id = self.db.execute('''SELECT sensor_id FROM sensors WHERE sensor_name=?''',
+                                        (sensor_name,)).fetchone()[0]
+            self._sensor_ids[sensor_name] = sensor_id
+        return sensor_id
+
+    def _reader(self):
+        """Return the reader connection for the calling thread, opening it on first use
+        """
+        if not self.db_open:
+            raise sqlite3.ProgrammingError("SensorStore has been closed")
+        conn = getattr(self._local, 'db', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.db = conn
+            with self._pool_lock:
+                self._readers.append(conn)
+        return conn
+
     def add_reading(self, sensor_name, when, reading_type, value):
-        try:
-            with self.db:
-                self.db.execute('''INSERT INTO readings(sensor_name, created_at, reading_type, value) 
-                                VALUES(?,?,?,?)''',
-                                (sensor_name, when, reading_type, value))
-                self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
+        self.add_readings([(sensor_name, when, reading_type, value)])
+        return
+
+    def _rows(self, batch):
+        """(sensor_id, epoch_ms, value) rows for a batch of readings.
+           Must be called with _write_lock held.
+        """
+        rows = []
+        for item in batch:
+            if isinstance(item, SensorReading):
+                item = (item.get_name(), item.get_timestamp_ms(), item.get_type(), item.get_value())
+            sensor_name, when, reading_type, value = item
+            rows.append((self._sensor_id(sensor_name, reading_type), to_epoch_ms(when), value))
+        return rows
+
+    def add_readings(self, batch, unstored=()):
+        """Write a batch of readings in a single transaction (one commit, one fsync).
+           Each item is a SensorReading or a (sensor_name, when, reading_type, value) tuple.
+           Only one reading is kept per sensor per millisecond; later duplicates are dropped.
+           <unstored> readings, e.g. those a deadband left out because they hadn't changed,
+           aren't kept as raw readings but are still counted in the rollups, so that
+           aggregates stay weighted by time rather than by changes.
+           Returns: the number of readings actually inserted, i.e. not duplicates
+        """
+        with self._write_lock, COMMIT_SECONDS.time():
+            try:
+                with self.db:
+                    rows = self._rows(batch)
+                    # rowcount leaves out ignored rows, and rows the rollup triggers touch
+                    inserted = self.db.executemany('''INSERT OR IGNORE INTO readings(sensor_id, created_at, value)
+                                                   VALUES(?,?,?)''', rows).rowcount
+                    if unstored:
+                        self._add_to_rollups([row for row in self._rows(unstored) if row[2] is not None])
+                ROWS_WRITTEN.inc(len(rows))
+                self.generation += 1
+            except Exception as e:
+                self.db.rollback()
+                self._sensor_ids.clear()   # may hold ids from the rolled-back transaction
+                raise e
+        return inserted
+
+    def _add_to_rollups(self, rows):
+        """Count (sensor_id, epoch_ms, value) rows in every rollup, as the insert triggers
+           do for stored readings.  Must be called with _write_lock held, in a transaction.
+        """
+        for width, table in ROLLUPS:
+            buckets = [(sensor_id, (when // width) * width, value) for sensor_id, when, value in rows]
+            self.db.executemany('''INSERT OR IGNORE INTO {}(sensor_id, bucket, count, sum, min, max)
+                                   VALUES(?, ?, 0, 0.0, ?, ?)'''.format(table),
+                                [(sensor_id, bucket, value, value) for sensor_id, bucket, value in buckets])
+            self.db.executemany('''UPDATE {} SET count = count + 1, sum = sum + ?,
+                                                min = MIN(min, ?), max = MAX(max, ?)
+                                    WHERE sensor_id = ? AND bucket = ?'''.format(table),
+                                [(value, value, value, sensor_id, bucket) for sensor_id, bucket, value in buckets])
         return
 
     def get_readings(self, count=10):
         """Retrieve the most recent <count> readings (default 10) from the store
-           Returns: a list of SensorReading
+           Returns: a list of SensorReading, oldest first
         """
-        rdr = []
-        try:
-            with self.db:
-                cursor = self.db.cursor()
-                cursor.execute('''SELECT sensor_name, created_at, reading_type, value 
-                                    FROM readings
-                                    ORDER BY created_at DESC
-                                    LIMIT ?''', (count,))
-                for row in cursor:
-                    rdr.insert(0, SensorReading(s_name=row[0], s_type=row[2], timestamp=datetime.strptime(row[1],"%Y-%m-%d %H:%M:%S.%f"), value=row[3]))
-        except Exception as e:
-            # TODO do better error processing if no data retrieved from db
-            raise e
-        return rdr
+        return list(self.iter_readings(count=count))
 
     def get_readings_as_dicts(self, count=10):
-        rdr = self.get_readings(count)
-        r_as_dicts = []
-        for i in rdr:
-            r_as_dicts.append(i.as_dict())
-        return r_as_dicts
+        return [r.as_dict() for r in self.iter_readings(count=count)]
 
     def get_readings_for_sensor(self, sensor_name, count=10):
-        rdr = []
+        """As get_readings(), for the named sensor only
+        """
+        return list(self.iter_readings(sensor_name=sensor_name, count=count))
+
+    def iter_readings(self, sensor_name=None, start=None, end=None, count=None):
+        """Generator yielding SensorReadings oldest first, one row at a time from the
+           cursor, so arbitrarily large ranges can be walked in constant memory.
+             sensor_name: only this sensor (None or "*" for all sensors)
+             start, end:  only readings with start <= timestamp < end (datetime or epoch-ms)
+             count:       only the most recent <count> of the matching readings
+        """
+        where, params = self._filter(sensor_name, start, end)
+        query = '''SELECT s.sensor_name, r.created_at, s.reading_type, r.value
+                     FROM sensors AS s JOIN readings AS r USING (sensor_id)''' + where
+        if count is None:
+            query += " ORDER BY r.created_at"
+        else:
+            # pick the newest <count> using the index, then put them back in time order
+            query = '''SELECT * FROM ({} ORDER BY r.created_at DESC LIMIT ?)
+                       ORDER BY created_at'''.format(query)
+            params.append(count)
+
+        cursor = self._reader().cursor()
         try:
-            with self.db:
-                cursor = self.db.cursor()
-                cursor.execute('''SELECT sensor_name, created_at, reading_type, value 
-                                    FROM readings 
-                                    WHERE (sensor_name=?)
-                                    ORDER BY created_at DESC
-                                    LIMIT ?''', (sensor_name, count)
-                               )
-                for row in cursor:
-                    rdr.insert(0, SensorReading(s_name=row[0], s_type=row[2], timestamp=datetime.strptime(row[1],"%Y-%m-%d %H:%M:%S.%f"), value=row[3]))
-        except Exception as e:
-            # TODO do better error processing if no data retrieved from db
-            raise e
-        return rdr
+            with QUERY_SECONDS.time(query="readings"):
+                cursor.execute(query, params)
+            for row in cursor:
+                yield SensorReading(s_name=row[0], s_type=row[2], timestamp=row[1], value=row[3])
+        finally:
+            cursor.close()
+
+    def get_series(self, count=10, start=None, end=None):
+        """Fast path for charting: the most recent <count> readings from all sensors as
+           (epoch_ms, value) pairs, oldest first, straight from the cursor.
+           No SensorReading objects are built.  start and end limit the time range as
+           for iter_readings(); count=None returns every reading in the range.
+        """
+        return self.get_series_for_sensor("*", count, start, end)
+
+    def get_series_for_sensor(self, sensor_name, count=10, start=None, end=None):
+        """As get_series(), for the named sensor only
+        """
+        where, params = self._filter(sensor_name, start, end)
+        if where:
+            query = '''SELECT r.created_at, r.value
+                         FROM sensors AS s JOIN readings AS r USING (sensor_id)''' + where
+        else:
+            query = '''SELECT r.created_at, r.value FROM readings AS r'''
+        with QUERY_SECONDS.time(query="series"):
+            if count is None:
+                return self._reader().execute(query + " ORDER BY r.created_at", params).fetchall()
+            series = self._reader().execute(query + " ORDER BY r.created_at DESC LIMIT ?",
+                                            params + [count]).fetchall()
+        series.reverse()
+        return series
+
+    def get_reading_before(self, sensor_name, when):
+        """Returns: the named sensor's last (epoch_ms, value) stored before <when>
+           (datetime or epoch-ms), or None if there isn't one
+        """
+        where, params = self._filter(sensor_name, None, when)
+        query = '''SELECT r.created_at, r.value
+                     FROM sensors AS s JOIN readings AS r USING (sensor_id)''' + where
+        with QUERY_SECONDS.time(query="neighbour"):
+            return self._reader().execute(query + " ORDER BY r.created_at DESC LIMIT 1", params).fetchone()
+
+    def get_reading_from(self, sensor_name, when):
+        """Returns: the named sensor's first (epoch_ms, value) stored at or after <when>
+           (datetime or epoch-ms), or None if there isn't one
+        """
+        where, params = self._filter(sensor_name, when, None)
+        query = '''SELECT r.created_at, r.value
+                     FROM sensors AS s JOIN readings AS r USING (sensor_id)''' + where
+        with QUERY_SECONDS.time(query="neighbour"):
+            return self._reader().execute(query + " ORDER BY r.created_at LIMIT 1", params).fetchone()
+
+    def iter_series_chunks(self, sensor_names=None, start=None, end=None, chunk_size=5000):
+        """Generator for bulk export: yields lists of up to <chunk_size> (sensor_name,
+           epoch_ms, value) rows, sensor by sensor and each sensor's in time order, read
+           from the cursor a chunk at a time so memory use doesn't grow with the range.
+             sensor_names: a list of the sensors wanted (None for all of them)
+             start, end:   as for iter_readings()
+        """
+        where, params = self._filter(sensor_names, start, end)
+        query = '''SELECT s.sensor_name, r.created_at, r.value
+                     FROM sensors AS s JOIN readings AS r USING (sensor_id)''' + where + '''
+                    ORDER BY r.sensor_id, r.created_at'''
+        cursor = self._reader().cursor()
+        try:
+            with QUERY_SECONDS.time(query="export"):
+                cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def get_buckets(self, bucket_ms, sensor_name=None, start=None, end=None):
+        """Aggregate readings into fixed-width time buckets of <bucket_ms> milliseconds,
+           computed in SQL, so the size of the result depends only on the range and
+           the bucket width, not on how many readings fall in the range.
+           Buckets are always whole: start is rounded down, and end up, to the bucket
+           width.  So whenever the width is a multiple of a rollup's, the coarsest such
+           rollup table answers (see rollup_table()), even once the raw readings have
+           been purged; otherwise the raw readings are aggregated.
+           Returns: a list of (bucket_start_ms, min, mean, max, count), oldest first
+        """
+        start, end = align_range(bucket_ms, start, end)
+        table = self.rollup_table(bucket_ms, start, end)
+        if table is not None:
+            where, params = self._filter(sensor_name, start, end, time_column="r.bucket")
+            query = '''SELECT (r.bucket / ?) * ? AS b, MIN(r.min),
+                                SUM(r.sum) / SUM(r.count), MAX(r.max), SUM(r.count)
+                         FROM sensors AS s JOIN {} AS r USING (sensor_id)'''.format(table)
+        else:
+            where, params = self._filter(sensor_name, start, end)
+            query = '''SELECT (r.created_at / ?) * ? AS b,
+                                MIN(r.value), AVG(r.value), MAX(r.value), COUNT(r.value)
+                         FROM sensors AS s JOIN readings AS r USING (sensor_id)'''
+        query += where + " GROUP BY b ORDER BY b"
+        with QUERY_SECONDS.time(query="buckets"):
+            return self._reader().execute(query, [bucket_ms, bucket_ms] + params).fetchall()
+
+    def rollup_table(self, bucket_ms, start=None, end=None):
+        """Return the coarsest rollup table that can answer get_buckets() exactly, i.e.
+           whose width divides bucket_ms and lines up with start and end (epoch-ms), or
+           None if the raw readings must be aggregated
+        """
+        for width, table in ROLLUPS:
+            if bucket_ms % width == 0 and all(t is None or t % width == 0 for t in (start, end)):
+                return table
+        return None
+
+    def _filter(self, sensor_name, start, end, time_column="r.created_at"):
+        """Build the WHERE clause, and its parameters, that restricts a query on
+           readings (aliased r) joined to sensors (aliased s) by sensor and time range
+        """
+        conditions = []
+        params = []
+        if isinstance(sensor_name, (list, tuple, set)):
+            conditions.append("s.sensor_name IN ({})".format(",".join("?" * len(sensor_name))))
+            params.extend(sensor_name)
+        elif sensor_name not in (None, "*"):
+            conditions.append("s.sensor_name=?")
+            params.append(sensor_name)
+        if start is not None:
+            conditions.append(time_column + ">=?")
+            params.append(to_epoch_ms(start))
+        if end is not None:
+            conditions.append(time_column + "<?")
+            params.append(to_epoch_ms(end))
+        if not conditions:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+    def purge(self, table, before, chunk_size=1000):
+        """Delete rows older than <before> (datetime or epoch-ms) from readings or one
+           of the rollup tables, <chunk_size> rows per transaction, so the write lock
+           is only ever held briefly and acquisition can carry on in between.
+           Returns: the number of rows deleted
+        """
+        if table == 'readings':
+            column = 'created_at'
+        elif table in dict((t, w) for w, t in ROLLUPS):
+            column = 'bucket'
+        else:
+            raise ValueError("can't purge unknown table '{}'".format(table))
+        before = to_epoch_ms(before)
+        deleted = 0
+        while True:
+            with self._write_lock:
+                with self.db:
+                    # the timestamp <chunk_size> rows in; deleting up to and including it
+                    # always makes progress, even if several rows share a timestamp
+                    boundary = self.db.execute('''SELECT {col} FROM {table} WHERE {col}<?
+                                                 ORDER BY {col} LIMIT 1 OFFSET ?'''.format(
+                                                     col=column, table=table),
+                                               (before, chunk_size - 1)).fetchone()
+                    if boundary is None:
+                        cursor = self.db.execute('''DELETE FROM {table} WHERE {col}<?'''.format(
+                            col=column, table=table), (before,))
+                    else:
+                        cursor = self.db.execute('''DELETE FROM {table} WHERE {col}<=?'''.format(
+                            col=column, table=table), (boundary[0],))
+                    deleted += cursor.rowcount
+                if cursor.rowcount:
+                    self.generation += 1
+            if boundary is None:
+                return deleted
+
+    def vacuum(self, pages=None):
+        """Return up to <pages> free pages (all of them if None) to the filesystem,
+           so the database file actually shrinks after a purge()
+        """
+        with self._write_lock:
+            if pages is None:
+                self.db.execute('PRAGMA incremental_vacuum').fetchall()
+            else:
+                self.db.execute('PRAGMA incremental_vacuum({:d})'.format(pages)).fetchall()
+        return
 
     def close(self):
+        """Close the writer and every pooled reader connection
+        """
         if self.db_open:
-            self.db.close()
             self.db_open = False
+            with self._pool_lock:
+                for conn in self._readers:
+                    conn.close()
+                self._readers = []
+            with self._write_lock:
+                self.db.close()
         return
 
     def __del__(self):
-        # Close the db connection
-        self.close()
+        # Close the db connections
+        if getattr(self, 'db_open', False):
+            self.close()
+        return
+
+
+class WriteBuffer(object):
+    """Optional write-behind buffer in front of a SensorStore.  Readings are held in
+       memory and written with add_readings() as a single group commit once
+       <max_rows> have built up, at least every <max_delay> seconds, and finally
+       on flush()/close().  Buffered readings are not visible to the store's
+       readers until flushed.  While the database is locked or otherwise can't be
+       written, readings are kept and retried, but no more than <max_retained_rows>
+       of them: beyond that the oldest are dropped.
+    """
+
+    def __init__(self, store, max_rows=100, max_delay=30.0, max_retained_rows=100000):
+        self.store = store
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retained_rows = max_retained_rows
+        self._pending = []
+        self._unstored = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name="SensorStore write buffer", daemon=True)
+        self._flusher.start()
+        return
+
+    def add_reading(self, sensor_name, when, reading_type, value):
+        self.add_readings([(sensor_name, when, reading_type, value)])
+        return
+
+    def add_readings(self, batch, unstored=()):
+        """Buffer the readings, writing them out if the buffer is full.  A failed write
+           is logged rather than raised: the readings stay buffered, and are retried.
+        """
+        with self._lock:
+            self._pending.extend(batch)
+            self._unstored.extend(unstored)
+            full = len(self._pending) >= self.max_rows
+        if full:
+            try:
+                self.flush()
+            except sqlite3.OperationalError:
+                logger.warning("Failed to write %d buffered readings; will retry", len(self._pending),
+                               exc_info=True)
+        return
+
+    def flush(self):
+        """Write everything buffered so far to the store.  If the database can't be
+           written just now (OperationalError, e.g. it's locked), the readings are put
+           back in the buffer, ahead of any added since, and the error is raised.  A
+           batch that can never be written (e.g. an IntegrityError, or a reading of
+           the wrong type) is logged and dropped, so it doesn't block those after it.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+            unstored, self._unstored = self._unstored, []
+        if not (batch or unstored):
+            return
+        try:
+            self.store.add_readings(batch, unstored)
+        except sqlite3.OperationalError:
+            with self._lock:
+                self._pending[:0] = batch
+                self._unstored[:0] = unstored
+                self._limit_retained()
+            raise
+        except Exception:
+            logger.exception("Dropped a batch of %d buffered readings that can't be written", len(batch))
+        return
+
+    def _limit_retained(self):
+        excess = len(self._pending) - self.max_retained_rows
+        if excess > 0:
+            logger.warning("Write buffer is full: dropped the oldest %d readings", excess)
+            del self._pending[:excess]
+        excess = len(self._unstored) - self.max_retained_rows
+        if excess > 0:
+            del self._unstored[:excess]
+        return
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.max_delay):
+            try:
+                self.flush()
+            except Exception:
+                # keep the readings and the thread, and try again next time
+                logger.exception("Failed to write %d buffered readings; will retry", len(self._pending))
+        return
+
+    def close(self):
+        """Stop the background flusher and write out anything still buffered
+        """
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
         return
 
 
@@ -0,0 +1,57 @@
+// Listen for the events the server pushes over /stream/events, falling back to polling.
+// The server only allows so many streams open at once, to keep worker threads free for
+// ordinary requests, and refuses any more with 503; the browser then gives the stream
+// up, so we poll instead until it can be opened again.
+//   url:       the /stream/events URL to open
+//   handlers:  {topic: function(data)}, called with each event's data
+//   poll:      function that fetches the same state with ordinary requests and passes
+//              it to the handlers; called every pollMs while there's no stream
+// Returns: an object whose close() stops both listening and polling
+function listenOrPoll(url, handlers, poll, pollMs) {
+	var retryMs = 30000;	// as the server's Retry-After
+	var pollTimer = null;
+	var source = null;
+	var closed = false;
+
+	function stopPolling() {
+		if (pollTimer != null) {
+			clearInterval(pollTimer);
+			pollTimer = null;
+		}
+	}
+
+	function startPolling() {
+		if (pollTimer == null) {
+			poll();
+			pollTimer = setInterval(poll, pollMs);
+		}
+	}
+
+	function open() {
+		if (closed) {
+			return;
+		}
+		source = new EventSource(url);
+		$.each(handlers, function(topic, handler) {
+			source.addEventListener(topic, function(event) {
+				handler(JSON.parse(event.data));
+			});
+		});
+		source.onopen = stopPolling;
+		source.onerror = function() {
+			// a dropped connection is retried by the browser, but a refused one is closed
+			if (source.readyState == EventSource.CLOSED) {
+				startPolling();
+				setTimeout(open, retryMs);
+			}
+		};
+	}
+	open();
+	return {
+		close: function() {
+			closed = true;
+			stopPolling();
+			source.close();
+		}
+	};
+}
@@ -0,0 +1,116 @@
+"""Simulated fridges, to generate realistic sensor load without any hardware.
+
+FridgeFleet holds the thermal model of many independent fridges in NumPy arrays and
+advances them all in one vectorised step: each fridge warms towards room temperature
+(faster while its door is open), its fan cools it towards the evaporator temperature,
+switching on and off with hysteresis between the low and high set points, and each
+reading carries a little sensor noise.  Doors are opened at random for a few seconds.
+
+SimulatedFridgeSensor reads one fridge of a fleet, so the fleet can be driven through
+the same acquisition, storage and HTTP code as real sensors:
+    fleet = FridgeFleet(5000)
+    poller = SensorPoller(fleet.sensors(), max_workers=8)
+"""
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from sensor import Sensor
+from sensorReading import SensorReading
+
+
+class FridgeFleet(object):
+    """<count> fridges, all advanced together.  Time constants are in seconds.
+    """
+
+    def __init__(self, count, seed=None, room_temp=20.0, evaporator_temp=-4.0, low=2.5, high=11.5,
+                 warming_tau=100.0, door_open_tau=20.0, cooling_tau=35.0,
+                 door_opens_per_hour=4.0, door_open_seconds=15.0, noise=0.05, step_seconds=1.0):
+        self.count = count
+        self.room_temp = room_temp
+        self.evaporator_temp = evaporator_temp
+        self.low = low
+        self.high = high
+        self.warming_tau = warming_tau
+        self.door_open_tau = door_open_tau
+        self.cooling_tau = cooling_tau
+        self.door_opens_per_hour = door_opens_per_hour
+        self.door_open_seconds = door_open_seconds
+        self.noise = noise
+        self.step_seconds = step_seconds      # reads closer together than this share a step
+        self._random = np.random.RandomState(seed)
+        # start spread across the cycle, so the fleet isn't in step
+        self.temps = self._random.uniform(low, high, count)
+        self.fan_on = self._random.rand(count) < 0.5
+        self.door_open = np.zeros(count, dtype=bool)
+        self._door_closes = np.zeros(count)      # seconds until each open door closes
+        self._readings = self.temps.copy()        # temps as the sensors last read them
+        self._last_step = None
+        self._lock = threading.Lock()
+
+    def step(self, seconds):
+        """Advance every fridge by <seconds>.  Returns: the new sensor readings, one per fridge
+        """
+        with self._lock:
+            return self._step(seconds)
+
+    def _step(self, seconds):
+        random = self._random
+        # doors open at random, and close again after a while
+        self._door_closes -= seconds
+        self.door_open &= self._door_closes > 0
+        opening = ~self.door_open & (random.rand(self.count) < self.door_opens_per_hour * seconds / 3600)
+        self.door_open |= opening
+        self._door_closes[opening] = random.exponential(self.door_open_seconds, int(opening.sum()))
+
+        # Newton's law: each fridge moves towards room temperature, and its fan pulls it
+        # towards the evaporator temperature
+        warming_tau = np.where(self.door_open, self.door_open_tau, self.warming_tau)
+        temps = self.temps
+        temps += (self.room_temp - temps) * (1.0 - np.exp(-seconds / warming_tau))
+        temps[self.fan_on] += ((self.evaporator_temp - temps[self.fan_on])
+                               * (1.0 - np.exp(-seconds / self.cooling_tau)))
+
+        # thermostat with hysteresis
+        self.fan_on |= temps >= self.high
+        self.fan_on &= temps > self.low
+
+        self._readings = temps + random.normal(0.0, self.noise, self.count)
+        return self._readings
+
+    def read(self, now=None):
+        """Return the sensor readings as of <now> (default: the time now), stepping the
+           fleet forward first if at least step_seconds have passed since the last step
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._last_step is None:
+                self._last_step = now
+            elif now - self._last_step >= self.step_seconds:
+                self._step(now - self._last_step)
+                self._last_step = now
+            return self._readings
+
+    def sensors(self, prefix="simulated fridge"):
+        """Return a SimulatedFridgeSensor for each fridge, named "<prefix> <n>"
+        """
+        return [SimulatedFridgeSensor("{} {}".format(prefix, i), fleet=self, index=i)
+                for i in range(self.count)]
+
+
+class SimulatedFridgeSensor(Sensor):
+    """The temperature sensor in one fridge of a FridgeFleet (by default, a fleet of its own)
+    """
+    sensor_type = "simulated temperature"
+
+    def __init__(self, name, fleet=None, index=0):
+        super().__init__(name)
+        self.fleet = FridgeFleet(1) if fleet is None else fleet
+        self.index = index
+
+    def get_reading(self):
+        now = datetime.now()
+        self.value = round(float(self.fleet.read(now.timestamp())[self.index]), 4)
+        return SensorReading(s_name=self.name, s_type=self.sensor_type, timestamp=now, value=self.value)
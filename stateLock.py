@@ -0,0 +1,23 @@
+"""Locking for the shared fridge and account state, which is changed from CherryPy's
+pool of worker threads.  Each stateful object (Fridge, Account) carries its own
+re-entrant lock, so its own methods are safe to call concurrently.  An operation
+that must change several objects as one atomic step takes all of their locks with
+locked(), which always acquires them in the same order, so two such operations
+can never deadlock each other.
+"""
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(*things):
+    """Hold the locks of all of <things> (each has a .lock attribute) for the duration
+       of a with block
+    """
+    locks = [thing.lock for thing in sorted(set(things), key=id)]
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
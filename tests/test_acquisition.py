@@ -0,0 +1,98 @@
+import threading
+import time
+from datetime import datetime
+
+from acquisition import SensorPoller, SamplingSchedule, DeadbandFilter
+from sensor import Sensor, TemperatureSensor, SENSOR_DRIVERS, make_sensor
+from sensorReading import SensorReading
+
+
+class FakeSensor(Sensor):
+
+    def __init__(self, name, delay=0.0, fail=False, release=None):
+        super().__init__(name)
+        self.delay = delay
+        self.fail = fail
+        self.release = release      # if set, the read hangs until this Event is set
+        self.reads = 0
+
+    def get_reading(self):
+        self.reads += 1
+        if self.release is not None:
+            self.release.wait()
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError("I2C read failed")
+        return SensorReading(self.name, "fake", datetime.now(), 1.0)
+
+
+def test_drivers_are_registered():
+    assert SENSOR_DRIVERS["temperature"] is TemperatureSensor
+    sensor = make_sensor("temperature", "thermometer 3")
+    assert isinstance(sensor, TemperatureSensor)
+    assert sensor.get_reading().get_type()=="temperature"
+    assert "fake" not in SENSOR_DRIVERS
+
+def test_sensors_are_read_concurrently():
+    sensors = [FakeSensor("probe {}".format(i), delay=0.2) for i in range(10)]
+    poller = SensorPoller(sensors, timeout=5.0)
+    start = time.monotonic()
+    readings = poller.read_all()
+    assert time.monotonic() - start < 1.0
+    assert [r.get_name() for r in readings]==[s.get_name() for s in sensors]
+    poller.close()
+
+def test_slow_and_failing_sensors_are_left_out():
+    release = threading.Event()
+    hung = FakeSensor("hung", release=release)
+    broken = FakeSensor("broken", fail=True)
+    good = FakeSensor("good")
+    poller = SensorPoller([hung, broken, good], timeout=0.2)
+    assert [r.get_name() for r in poller.read_all()]==["good"]
+    # the hung read is still outstanding, so it isn't started again
+    assert [r.get_name() for r in poller.read_all()]==["good"]
+    assert (hung.reads, poller.timeouts, poller.errors)==(1, {"hung": 1}, {"broken": 2})
+    release.set()
+    time.sleep(0.05)
+    assert [r.get_name() for r in poller.read_all()]==["hung", "good"]
+    assert hung.reads==2
+    poller.close()
+
+def test_schedule_ticks_on_the_clock():
+    door, ambient = FakeSensor("door"), FakeSensor("ambient")
+    poller = SensorPoller([door, ambient], timeout=1.0)
+    schedule = SamplingSchedule(poller, {"door": 1}, default_interval=60, now=1000.5)
+    assert schedule.next_tick()==1001
+    assert schedule.run_pending(now=1000.9)==[]
+    assert [r.get_name() for r in schedule.run_pending(now=1001.2)]==["door"]
+    assert schedule.next_tick()==1002
+    # both due together are read in one batch
+    assert [r.get_name() for r in schedule.run_pending(now=1020.0)]==["door", "ambient"]
+    assert schedule.missed=={"door": 18}
+    assert (schedule._next["door"], schedule._next["ambient"])==(1021, 1080)
+    poller.close()
+
+def test_schedule_runs_in_background():
+    batches = []
+    poller = SensorPoller([FakeSensor("door")], timeout=1.0)
+    schedule = SamplingSchedule(poller, default_interval=0.05)
+    schedule.start(batches.append)
+    time.sleep(0.3)
+    schedule.stop()
+    assert 3 <= len(batches) <= 7
+    assert all(len(batch)==1 for batch in batches)
+    poller.close()
+
+def test_deadband_keeps_changes_and_heartbeats():
+    deadband = DeadbandFilter({"door": 0.0}, default_deadband=0.5, max_silence=60)
+    def reading(name, seconds, value):
+        return SensorReading(name, "fake", 1000 * seconds, value)
+    readings = [reading("ambient", 0, 4.0), reading("ambient", 5, 4.4), reading("ambient", 10, 3.6),
+                reading("ambient", 15, 3.4), reading("ambient", 75, 3.4),
+                reading("door", 0, 0.0), reading("door", 5, 0.0), reading("door", 10, 1.0)]
+    kept = deadband.filter(readings)
+    assert [(r.get_name(), r.get_timestamp_ms() // 1000) for r in kept]==[
+        ("ambient", 0), ("ambient", 15), ("ambient", 75), ("door", 0), ("door", 10)]
+    assert (deadband.kept, deadband.dropped)==(5, 3)
+    kept, dropped = deadband.split([reading("ambient", 80, 3.5), reading("ambient", 85, 4.0)])
+    assert [r.get_value() for r in kept]==[4.0] and [r.get_value() for r in dropped]==[3.5]
@@ -1,7 +1,62 @@
+import hashlib
+
+import cherrypy
+import pytest
+
+import iot_fridge
 from blockchain import isRecentBlockchainTransaction, recordBlockchainTransaction
+from blockchain import Blockchain, merkle_root, GENESIS_HASH
+from eventBus import BUS
 
 def test_the_basics():
     assert isRecentBlockchainTransaction()==False
     recordBlockchainTransaction("fridge","debit",0.50)
     assert isRecentBlockchainTransaction()==True
     assert isRecentBlockchainTransaction()==False
+
+def test_merkle_root():
+    a, b, c = (hashlib.sha256(x).digest() for x in (b"a", b"b", b"c"))
+    ab = hashlib.sha256(a + b).digest()
+    cc = hashlib.sha256(c + c).digest()
+    assert merkle_root([a])==a
+    assert merkle_root([a, b])==ab
+    assert merkle_root([a, b, c])==hashlib.sha256(ab + cc).digest()
+
+def test_blocks_are_chained():
+    chain = Blockchain(max_block_txs=3)
+    sub = BUS.subscribe(topics=['block'])
+    assert chain.mine() is None
+    for i in range(5):
+        chain.submit("fridge", "credit", 0.5 * i)
+    first = chain.mine()
+    second = chain.mine()
+    assert chain.mine() is None
+    assert (first.height, len(first.transactions), first.prev_hash)==(1, 3, GENESIS_HASH)
+    assert (second.height, len(second.transactions), second.prev_hash)==(2, 2, first.hash)
+    assert chain.recent_blocks(5)==[first, second]
+    tx = first.as_dict()['transactions'][1]
+    assert (tx['account'], tx['amount'], tx['hash'])==("fridge", 0.5, first.tx_hashes[1])
+    assert [data['hash'] for topic, data in sub.get(0)]==[first.hash, second.hash]
+    sub.close()
+
+def test_background_miner():
+    chain = Blockchain(block_interval=60, max_block_txs=100)
+    chain.start()
+    for i in range(250):
+        chain.submit("escrow", "debit", 1.0)
+    chain.stop()
+    assert [len(b.transactions) for b in chain.recent_blocks(10)]==[100, 100, 50]
+    assert chain.pending_count()==0
+
+def test_blocks_endpoint_checks_n(monkeypatch):
+    chain = Blockchain(max_block_txs=1)
+    for i in range(3):
+        chain.submit("fridge", "credit", 0.5)
+        chain.mine()
+    monkeypatch.setattr(iot_fridge, "CHAIN", chain)
+    root = iot_fridge.Root()
+    assert [b['height'] for b in root.blocks("2")]==[2, 3]
+    for n in ("three", "0", "-2"):
+        with pytest.raises(cherrypy.HTTPError) as error:
+            root.blocks(n)
+        assert error.value.code==400
@@ -0,0 +1,54 @@
+from downsample import parse_bucket, lttb, step_fill, add_to_buckets, add_steps_to_buckets, bucket_summary
+
+def test_parse_bucket():
+    assert parse_bucket("30s")==30000
+    assert parse_bucket("1m")==60000
+    assert parse_bucket("1h")==3600000
+    assert parse_bucket("2d")==2 * 86400000
+    for bad in ("", "m", "0m", "1w", "1.5h", "-1h"):
+        try:
+            parse_bucket(bad)
+            assert False, "accepted bucket {}".format(bad)
+        except ValueError:
+            pass
+
+def test_lttb():
+    series = [(t, 0.0) for t in range(1000)]
+    series[500] = (500, 10.0)    # a spike must survive downsampling
+    sampled = lttb(series, 20)
+    assert len(sampled)==20
+    assert sampled[0]==series[0]
+    assert sampled[-1]==series[-1]
+    assert (500, 10.0) in sampled
+    assert [p[0] for p in sampled]==sorted(p[0] for p in sampled)
+    assert lttb(series[:10], 20)==series[:10]
+
+def test_step_fill():
+    stored = [(0, 4.0), (20, 4.5), (1000, 5.0)]
+    assert step_fill(stored, 5, 100)==[(0, 4.0), (5, 4.0), (10, 4.0), (15, 4.0), (20, 4.5), (1000, 5.0)]
+    assert step_fill(stored, 5, 100, end=1012)[-3:]==[(1000, 5.0), (1005, 5.0), (1010, 5.0)]
+    # carried forward no more than the longest gap
+    assert step_fill([(0, 4.0)], 10, 30, end=1000)==[(0, 4.0), (10, 4.0), (20, 4.0), (30, 4.0)]
+    assert step_fill([], 5, 100, end=1000)==[]
+    # the range is half-open: nothing at <end>
+    assert step_fill([(0, 4.0)], 10, 100, end=30)==[(0, 4.0), (10, 4.0), (20, 4.0)]
+
+def test_step_fill_ignores_jitter():
+    # readings a ms or two after each tick are the ticks, not gaps to fill
+    assert step_fill([(0, 1), (5001, 2), (10002, 3)], 5000, 305000)==[(0, 1), (5001, 2), (10002, 3)]
+    jittered = [(5000 * i + i % 3, float(i)) for i in range(100)]
+    assert step_fill(jittered, 5000, 305000)==jittered
+    # an unchanged reading left out is filled in, on the step
+    assert step_fill([(2, 1.0), (10001, 2.0)], 5000, 305000)==[(2, 1.0), (5002, 1.0), (10001, 2.0)]
+
+def test_add_steps_to_buckets():
+    stored = [(0, 4.0), (20, 4.5), (1000, 5.0)]
+    # the same buckets as filling in every step, without doing so
+    filled = bucket_summary(add_to_buckets({}, step_fill(stored, 5, 100, end=1040), 50))
+    assert bucket_summary(add_steps_to_buckets({}, stored, 50, 5, 100, end=1040))==filled
+    # a value is weighted by how long it held
+    assert bucket_summary(add_steps_to_buckets({}, [(0, 1.0), (10, 4.0)], 40, 5, 100, end=40))==[
+        (0, 1.0, (1.0 * 10 + 4.0 * 30) / 40, 4.0, 8)]
+    # a sensor that went silent holds its last value for a single step
+    assert bucket_summary(add_steps_to_buckets({}, [(0, 1.0), (500, 2.0)], 1000, 5, 100))==[
+        (0, 1.0, 1.5, 2.0, 2)]
@@ -0,0 +1,43 @@
+from eventBus import EventBus
+
+def test_the_basics():
+    bus = EventBus()
+    everything = bus.subscribe()
+    readings = bus.subscribe(topics=['reading'])
+    bus.publish('reading', {'v': 1})
+    bus.publish('fridge', {'red_can': 4})
+    assert everything.get(timeout=0)==[('reading', {'v': 1}), ('fridge', {'red_can': 4})]
+    assert readings.get(timeout=0)==[('reading', {'v': 1})]
+    assert readings.get(timeout=0.01)==[]
+    readings.close()
+    bus.publish('reading', {'v': 2})
+    assert readings.get(timeout=0)==[]
+    assert bus.subscriber_count()==1
+
+def test_slow_subscriber_drops_oldest():
+    bus = EventBus()
+    slow = bus.subscribe(maxlen=3)
+    fast = bus.subscribe(maxlen=10)
+    for i in range(5):
+        bus.publish('reading', i)
+    assert slow.get(timeout=0)==[('reading', 2), ('reading', 3), ('reading', 4)]
+    assert slow.dropped==2
+    assert len(fast.get(timeout=0))==5
+
+def test_streams_are_capped():
+    import cherrypy
+    import pytest
+    import iot_fridge
+
+    stream = iot_fridge.EventStream(max_streams=2)
+    cherrypy.request.hooks = cherrypy._cprequest.HookMap(cherrypy._cprequest.hookpoints)
+    first = stream.readings()
+    stream.events()
+    with pytest.raises(cherrypy.HTTPError) as refused:
+        stream.readings()
+    assert refused.value.code==503 and cherrypy.response.headers['Retry-After']=="30"
+    assert stream.open_streams()==2
+    # each stream's slot is given back as its request ends
+    first.close()
+    cherrypy.request.hooks.run('on_end_request')
+    assert stream.open_streams()==0
@@ -0,0 +1,58 @@
+import math
+
+import cherrypy
+import pytest
+
+import iot_fridge
+from export import csv_chunks, columnar_chunks, read_columnar, MAGIC
+from sensorStore import SensorStore
+
+
+def make_store(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("a", 1000 + 10 * i, "temperature", float(i)) for i in range(25)]
+                       + [("b", 1000 + 10 * i, "temperature", 100.0 + i) for i in range(5)])
+    return store
+
+def test_chunks_are_bounded(tmp_path):
+    store = make_store(tmp_path)
+    chunks = list(store.iter_series_chunks(chunk_size=10))
+    assert [len(c) for c in chunks]==[10, 10, 10]
+    rows = [row for chunk in chunks for row in chunk]
+    assert rows[0]==("a", 1000, 0.0) and rows[24]==("a", 1240, 24.0) and rows[25]==("b", 1000, 100.0)
+    wanted = [row for chunk in store.iter_series_chunks(["b"], start=1010, end=1040) for row in chunk]
+    assert wanted==[("b", 1010, 101.0), ("b", 1020, 102.0), ("b", 1030, 103.0)]
+    store.close()
+
+def test_csv():
+    body = b"".join(csv_chunks([[("a", 1000, 1.5), ("a, b", 1010, None)]]))
+    assert body==b'sensor,timestamp_ms,value\na,1000,1.5\n"a, b",1010,\n'
+
+def test_columnar_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    body = b"".join(columnar_chunks(store.iter_series_chunks(chunk_size=20)))
+    assert body.startswith(MAGIC)
+    blocks = read_columnar(body)
+    # a's readings are split across the first two chunks
+    assert [(name, len(timestamps)) for name, timestamps, values in blocks]==[("a", 20), ("a", 5), ("b", 5)]
+    assert list(blocks[2][1])==[1000, 1010, 1020, 1030, 1040]
+    assert list(blocks[2][2])==[100.0, 101.0, 102.0, 103.0, 104.0]
+    assert math.isnan(read_columnar(b"".join(columnar_chunks([[("c", 5, None)]])))[0][2][0])
+    with pytest.raises(ValueError):
+        read_columnar(body[:-3])
+    store.close()
+
+def test_export_endpoint(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    monkeypatch.setattr(iot_fridge, "SENSOR_STORE", store, raising=False)
+    root = iot_fridge.Root()
+    body = b"".join(root.export(sensors="b", start="1030"))
+    assert body==b"sensor,timestamp_ms,value\nb,1030,103.0\nb,1040,104.0\n"
+    assert cherrypy.response.headers['Content-Type']=='text/csv'
+    blocks = read_columnar(b"".join(root.export(format="columnar")))
+    assert sum(len(timestamps) for name, timestamps, values in blocks)==30
+    with pytest.raises(cherrypy.HTTPError):
+        root.export(format="xml")
+    with pytest.raises(cherrypy.HTTPError):
+        root.export(start="yesterday")
+    store.close()
@@ -16,3 +16,14 @@ def test_the_basics():
     assert f.get_red_can()==0
     f.decr_can('red_can')
     assert f.get_red_can()==0
+
+def test_changes_are_published():
+    from eventBus import BUS
+    sub = BUS.subscribe(topics=['fridge'])
+    f=Fridge(red_count=4, green_count=2, blue_count=2)
+    f.decr_can('green_can')
+    f.restock()
+    events = sub.get(timeout=0)
+    sub.close()
+    assert [data['green_can_count'] for topic, data in events]==[1, 2]
+    assert [data['needs_restock'] for topic, data in events]==[True, False]
@@ -0,0 +1,18 @@
+from account import Account
+from fridge import Fridge
+from fridgeRegistry import FridgeRegistry
+
+def test_restock_index():
+    fleet = FridgeRegistry()
+    for fridge_id in ("a", "b", "c"):
+        fleet.add(fridge_id, Fridge(red_count=4, green_count=2, blue_count=2), Account("fridge:" + fridge_id), Account("escrow:" + fridge_id))
+    assert fleet.needing_restock()==[]
+    fleet.get("b").fridge.decr_can("green_can")
+    fleet.get("c").fridge.set_blue_can(0)
+    assert fleet.needing_restock()==["b", "c"]
+    fleet.get("b").fridge.restock()
+    assert fleet.needing_restock()==["c"]
+    fleet.add("d", Fridge(), Account("fridge:d"), Account("escrow:d"))
+    assert fleet.needing_restock()==["c", "d"]
+    assert fleet.get("d").fridge.as_dict()['fridge_id']=="d"
+    assert fleet.fridge_ids()==["a", "b", "c", "d"]
@@ -0,0 +1,72 @@
+import io
+import json
+
+import cherrypy
+import pytest
+
+import iot_fridge
+from export import columnar_chunks
+from ingest import parse_batch
+from sensorStore import SensorStore
+
+
+def test_parse_json():
+    body = json.dumps([{"sensor": "a", "t": 1000, "v": 4.5},
+                       {"sensor": "a", "t": 1000, "v": 9.0},
+                       {"sensor": "b", "t": 1000, "v": None, "type": "humidity"}]).encode()
+    batch, received = parse_batch(body, "application/json")
+    assert received==3
+    assert batch==[("a", 1000, "temperature", 4.5), ("b", 1000, "humidity", None)]
+
+@pytest.mark.parametrize("readings", [
+    {"sensor": "a"},
+    [{"sensor": "a", "t": 1000}, {"sensor": "", "t": 1000}],
+    [{"sensor": "a", "t": "yesterday", "v": 1}],
+    [{"sensor": "a", "t": 1000, "v": "cold"}],
+])
+def test_rejects_bad_json(readings):
+    with pytest.raises(ValueError):
+        parse_batch(json.dumps(readings).encode(), "application/json")
+
+def test_parse_columnar():
+    body = b"".join(columnar_chunks([[("a", 1000, 1.0), ("a", 1010, None), ("b", 1000, 2.0)]]))
+    batch, received = parse_batch(body, "application/octet-stream", "pressure")
+    assert batch==[("a", 1000, "pressure", 1.0), ("a", 1010, "pressure", None), ("b", 1000, "pressure", 2.0)]
+    with pytest.raises(ValueError):
+        parse_batch(body[:-1], "application/octet-stream")
+    with pytest.raises(ValueError):
+        parse_batch(body, "text/csv")
+
+def test_batch_size_is_capped(monkeypatch):
+    import ingest
+    monkeypatch.setattr(ingest, "MAX_BATCH_ROWS", 10)
+    readings = [(["a", 1000 + i, 1.0]) for i in range(11)]
+    with pytest.raises(ValueError):
+        parse_batch(json.dumps([{"sensor": s, "t": t, "v": v} for s, t, v in readings]).encode(), "application/json")
+    with pytest.raises(ValueError):
+        parse_batch(b"".join(columnar_chunks([[tuple(r) for r in readings]])), "application/octet-stream")
+    assert len(parse_batch(b"".join(columnar_chunks([[tuple(r) for r in readings[:10]]])),
+                           "application/octet-stream")[0])==10
+
+def post(body, content_type):
+    cherrypy.request.headers = {'Content-Type': content_type}
+    cherrypy.request.body = io.BytesIO(body)
+    try:
+        return json.loads(iot_fridge.JSONGeneratorWebService().POST().decode())
+    finally:
+        cherrypy.request.headers = {}
+
+def test_post_endpoint(tmp_path, monkeypatch):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    monkeypatch.setattr(iot_fridge, "SENSOR_STORE", store, raising=False)
+    readings = [{"sensor": "edge 1", "t": 1000 + 10 * i, "v": float(i)} for i in range(100)]
+    result = post(json.dumps(readings).encode(), "application/json; charset=utf-8")
+    assert (result['received'], result['inserted'], result['duplicates'])==(100, 100, 0)
+    # uploaded again, overlapping: only the new readings are stored
+    body = b"".join(columnar_chunks([[("edge 1", 1000 + 10 * i, float(i)) for i in range(90, 110)]]))
+    result = post(body, "application/octet-stream")
+    assert (result['received'], result['inserted'], result['duplicates'])==(20, 10, 10)
+    assert len(store.get_series_for_sensor("edge 1", count=None))==110
+    with pytest.raises(cherrypy.HTTPError):
+        post(b"[{", "application/json")
+    store.close()
@@ -0,0 +1,135 @@
+import json
+import time
+
+import cherrypy
+import pytest
+
+import iot_fridge
+from sensorStore import SensorStore
+
+
+def make_store(tmp_path, monkeypatch):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    monkeypatch.setattr(iot_fridge, "SENSOR_STORE", store, raising=False)
+    return store
+
+def test_fill_only_deadbanded_sensors():
+    now = 1000000
+    # thermometer 1 is read through DEADBAND; a steady reading is stored once
+    filled = iot_fridge.fill_unchanged_readings("thermometer 1", [(now - 20003, 4.0)], now=now)
+    assert filled==[(now - 20003, 4.0), (now - 15003, 4.0), (now - 10003, 4.0), (now - 5003, 4.0), (now - 3, 4.0)]
+    # uploaded readings were never deadbanded, so are left as they are
+    uploaded = [(1000, 4.0), (2000, 4.0)]
+    assert iot_fridge.fill_unchanged_readings("edge 1", uploaded, now=now)==uploaded
+
+def test_no_carry_forward_once_sensor_is_silent():
+    now = 10000000
+    # last heard from long ago: not carried forward to now
+    assert iot_fridge.fill_unchanged_readings("thermometer 1", [(1000, 4.0), (2000, 4.5)], now=now)==[
+        (1000, 4.0), (2000, 4.5)]
+
+def test_uploaded_sensor_gets_its_own_readings(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    store.add_readings([("edge 1", 1000, "temperature", 4.0), ("edge 1", 2000, "temperature", 4.0)])
+    results = iot_fridge.JSONGeneratorWebService()._results(5, "edge 1", None, None, None, None)
+    assert results['data']==[(1000, 4.0), (2000, 4.0)]
+    store.close()
+
+def test_deadbanded_sensor_is_filled_before_aggregating(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    now = int(time.time() * 1000)
+    start = now - now % 60000 - 120000
+    # steady for two minutes: only the first and a change at the end were stored
+    store.add_readings([("thermometer 1", start + 2, "temperature", 4.0),
+                        ("thermometer 1", start + 115001, "temperature", 6.0)])
+    service = iot_fridge.JSONGeneratorWebService()
+    # 30s buckets can't come from the rollups, so are aggregated from the filled series
+    results = service._results(None, "thermometer 1", start, start + 120000, 30000, None)
+    assert results['data'][:3]==[[start, 4.0], [start + 30000, 4.0], [start + 60000, 4.0]]
+    # weighted by how long each value held
+    assert results['data'][3]==[start + 90000, pytest.approx((4.0 * 25001 + 6.0 * 4999) / 30000)]
+    store.close()
+
+def test_steady_window_is_filled_from_the_reading_before(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    now = int(time.time() * 1000)
+    start = now - now % 60000 - 600000
+    # nothing stored in the window: the value held was stored a minute before it
+    store.add_readings([("thermometer 1", start - 60000, "temperature", 4.0),
+                        ("thermometer 1", start + 200000, "temperature", 5.0)])
+    service = iot_fridge.JSONGeneratorWebService()
+    series = service._results(None, "thermometer 1", start, start + 30000, None, None, now=now)['data']
+    assert series==[(start + 5000 * i, 4.0) for i in range(6)]
+    buckets = service._results(None, "thermometer 1", start, start + 120000, 30000, None, now=now)['data']
+    assert buckets==[[start + 30000 * i, 4.0] for i in range(4)]
+    store.close()
+
+def test_tail_of_past_window_is_carried_only_if_sensor_kept_reporting(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    now = int(time.time() * 1000)
+    start = now - now % 60000 - 3600000
+    store.add_readings([("thermometer 1", start + 2, "temperature", 4.0),
+                        ("thermometer 1", start + 200000, "temperature", 5.0),
+                        ("thermometer 2", start + 2, "temperature", 4.0),
+                        ("thermometer 2", start + 2000000, "temperature", 5.0)])
+    service = iot_fridge.JSONGeneratorWebService()
+    # heard from again within the heartbeat after the window, so it held to the end
+    series = service._results(None, "thermometer 1", start, start + 20000, None, None, now=now)['data']
+    assert series==[(start + 2 + 5000 * i, 4.0) for i in range(4)]
+    # not heard from again for longer than that: it had gone silent
+    series = service._results(None, "thermometer 2", start, start + 20000, None, None, now=now)['data']
+    assert series==[(start + 2, 4.0)]
+    store.close()
+
+def get(**params):
+    cherrypy.request.headers = {}
+    return json.loads(iot_fridge.JSONGeneratorWebService().GET(**params).decode())
+
+def test_get_ranges_buckets_and_downsampling(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    store.add_readings([("edge 1", 1000 * i, "temperature", float(i % 7)) for i in range(600)])
+    assert get(sensor_name="edge 1", start="10000", end="13000")['data']==[[10000, 3.0], [11000, 4.0], [12000, 5.0]]
+    assert get(sensor_name="edge 1", start="595000", n="2")['data']==[[598000, 3.0], [599000, 4.0]]
+    buckets = get(sensor_name="edge 1", start="0", end="120000", bucket="1m")
+    assert buckets['bucket']==60000 and [b[0] for b in buckets['data']]==[0, 60000]
+    assert buckets['min'][0]==[0, 0.0] and buckets['max'][0]==[0, 6.0]
+    assert len(get(sensor_name="edge 1", start="0", max_points="50")['data'])==50
+    store.close()
+
+def test_get_ranges_are_bounded(tmp_path, monkeypatch):
+    store = make_store(tmp_path, monkeypatch)
+    store.add_readings([("edge 1", 1000 * i, "temperature", float(i % 7)) for i in range(600)])
+    # a range is downsampled by default
+    monkeypatch.setattr(iot_fridge, "DEFAULT_MAX_POINTS", 50)
+    assert len(get(sensor_name="edge 1", start="0")['data'])==50
+    assert len(get(sensor_name="edge 1", start="0", n="100")['data'])==100
+    # and no more than so many readings are read for it
+    monkeypatch.setattr(iot_fridge, "MAX_RANGE_READINGS", 500)
+    with pytest.raises(cherrypy.HTTPError) as error:
+        get(sensor_name="edge 1", start="0", end="600000", max_points="100")
+    assert error.value.code==400
+    assert len(get(sensor_name="edge 1", start="100000", end="600000", max_points="100")['data'])==100
+    # nor filled in: a deadbanded sensor that stored a reading every 5 minutes for a day
+    store.add_readings([("thermometer 1", 300000 * i, "temperature", 4.0) for i in range(288)])
+    with pytest.raises(cherrypy.HTTPError) as error:
+        get(sensor_name="thermometer 1", start="0", end=str(24 * 60 * 60 * 1000))
+    assert error.value.code==400
+    # but a long silence isn't filled, so isn't counted
+    assert len(get(sensor_name="thermometer 1", n="2")['data'])==2
+    with pytest.raises(cherrypy.HTTPError) as error:
+        get(n="501")
+    assert error.value.code==400
+    store.close()
+
+@pytest.mark.parametrize("params", [
+    {"n": "0"}, {"n": "-1"}, {"n": "ten"},
+    {"start": "yesterday"}, {"end": "1.5"},
+    {"bucket": "1w"}, {"bucket": "0m"},
+    {"max_points": "2"}, {"max_points": "lots"},
+])
+def test_get_rejects_bad_parameters(tmp_path, monkeypatch, params):
+    store = make_store(tmp_path, monkeypatch)
+    with pytest.raises(cherrypy.HTTPError) as error:
+        get(**params)
+    assert error.value.code==400
+    store.close()
@@ -0,0 +1,122 @@
+import sqlite3
+import time
+
+import cherrypy
+import pytest
+
+import iot_fridge
+from account import Account
+from ledger import Ledger
+
+def test_balances_survive_restart(tmp_path):
+    ledger_file = str(tmp_path / "ledger.db")
+    ledger = Ledger(ledger_file, snapshot_every=10)
+    fridge = Account("fridge", initialBalance=25.0)
+    fridge.attach_ledger(ledger)
+    for i in range(25):
+        fridge.deposit(0.5)
+    fridge.withdraw(2.5)
+    assert ledger.balance("fridge")==fridge.balance==35.0
+    ledger.flush()
+    assert ledger.db.execute("SELECT MAX(seq) FROM snapshots").fetchone()[0]==27
+    ledger.close()
+
+    # a new process: the starting balance is ignored in favour of the ledger's
+    ledger = Ledger(ledger_file, snapshot_every=10)
+    fridge = Account("fridge", initialBalance=25.0)
+    fridge.attach_ledger(ledger)
+    assert fridge.balance==35.0
+    fridge.deposit(1.0)
+    assert [e['type'] for e in ledger.recent(2)]==["debit", "credit"]
+    assert ledger.verify() is None
+    ledger.close()
+
+def test_replay_after_snapshot(tmp_path):
+    ledger_file = str(tmp_path / "ledger.db")
+    ledger = Ledger(ledger_file, snapshot_every=5)
+    ledger.append("escrow", "open", 0.0)
+    for i in range(7):
+        ledger.append("escrow", "credit", 4.0)
+    ledger.flush()
+    # entries after the snapshot aren't lost if we stop without a final snapshot
+    ledger._stop.set()
+    ledger._wake.set()
+    ledger._writer.join()
+    ledger.db.close()
+    ledger = Ledger(ledger_file, snapshot_every=5)
+    assert ledger.balance("escrow")==28.0
+    ledger.close()
+
+def test_tampering_is_detected(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.append("subscriber", "open", 10.0)
+    ledger.append("subscriber", "debit", 4.0)
+    ledger.append("subscriber", "credit", 4.0)
+    assert ledger.verify() is None
+    ledger.db.execute("UPDATE entries SET amount=400.0 WHERE seq=2")
+    ledger.db.commit()
+    assert ledger.verify()==2
+    ledger.close()
+
+class FailingWrites(object):
+    """Stands in for a ledger's connection, failing the next <failures> writes as if
+       the database were locked
+    """
+
+    def __init__(self, db, failures):
+        self.db = db
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc):
+        return self.db.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if self.failures > 0:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.db.executemany(sql, rows)
+
+def test_failed_write_loses_nothing(tmp_path):
+    ledger_file = str(tmp_path / "ledger.db")
+    ledger = Ledger(ledger_file, flush_interval=0.01)
+    ledger.append("fridge", "open", 25.0)
+    ledger.flush()
+    ledger.db = FailingWrites(ledger.db, failures=2)
+    ledger.append("fridge", "credit", 1.0)
+    with pytest.raises(sqlite3.OperationalError):
+        ledger.flush()
+    ledger.append("fridge", "debit", 0.5)
+    # the background writer fails once more, then retries and succeeds
+    deadline = time.time() + 5
+    while ledger.db.failures and time.time() < deadline:
+        time.sleep(0.01)
+    assert ledger._writer.is_alive()
+    assert [e['seq'] for e in ledger.recent(10)]==[1, 2, 3]
+    assert ledger.verify() is None
+    ledger.db = ledger.db.db
+    ledger.close()
+    ledger = Ledger(ledger_file)
+    assert ledger.balance("fridge")==25.5
+    ledger.close()
+
+def test_ledger_endpoint_checks_n(tmp_path, monkeypatch):
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    monkeypatch.setattr(iot_fridge, "LEDGER", ledger)
+    monkeypatch.setattr(iot_fridge, "MAX_LEDGER_ENTRIES", 2)
+    for i in range(3):
+        ledger.append("fridge", "credit", 1.0)
+    root = iot_fridge.Root()
+    assert [e['seq'] for e in root.ledger("1")]==[3]
+    # capped, rather than every entry there is
+    assert [e['seq'] for e in root.ledger("100")]==[2, 3]
+    for n in ("ten", "1.5", "0", "-1"):
+        with pytest.raises(cherrypy.HTTPError) as error:
+            root.ledger(n)
+        assert error.value.code==400
+    ledger.close()
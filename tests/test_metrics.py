@@ -0,0 +1,40 @@
+from metrics import MetricsRegistry
+
+
+def test_counters_and_histograms_render():
+    registry = MetricsRegistry()
+    reads = registry.counter('reads_total', 'Reads', ['sensor'])
+    latency = registry.histogram('read_seconds', 'Read time', buckets=(0.1, 1.0))
+    reads.inc(sensor='door')
+    reads.inc(2, sensor='door')
+    reads.inc(sensor='say "hi"')
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(seconds)
+    assert reads.value(sensor='door')==3
+    assert latency.count()==4
+    assert registry.render().splitlines()==[
+        '# HELP read_seconds Read time',
+        '# TYPE read_seconds histogram',
+        'read_seconds_bucket{le="0.1"} 2',
+        'read_seconds_bucket{le="1.0"} 3',
+        'read_seconds_bucket{le="+Inf"} 4',
+        'read_seconds_sum 3.65',
+        'read_seconds_count 4',
+        '# HELP reads_total Reads',
+        '# TYPE reads_total counter',
+        'reads_total{sensor="door"} 3.0',
+        'reads_total{sensor="say \\"hi\\""} 1.0',
+    ]
+
+def test_timer_and_registration():
+    registry = MetricsRegistry()
+    latency = registry.histogram('query_seconds', 'Query time', ['query'])
+    with latency.time(query='series'):
+        pass
+    assert latency.count(query='series')==1
+    assert registry.histogram('query_seconds', 'Query time', ['query']) is latency
+    try:
+        registry.counter('query_seconds', 'Query time', ['query'])
+        assert False, "registered a second metric under the same name"
+    except ValueError:
+        pass
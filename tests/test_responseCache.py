@@ -0,0 +1,84 @@
+import cherrypy
+
+import iot_fridge
+from responseCache import ResponseCache, make_etag, etag_matches
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    built = []
+    def build(body):
+        built.append(body)
+        return body
+    assert cache.get("a", lambda: build(b"A"))==b"A"
+    assert cache.get("b", lambda: build(b"B"))==b"B"
+    assert cache.get("a", lambda: build(b"A again"))==b"A"    # a is now the most recent
+    cache.get("c", lambda: build(b"C"))                       # so b is evicted
+    assert cache.get("b", lambda: build(b"B again"))==b"B again"
+    assert built==[b"A", b"B", b"C", b"B again"]
+    assert (cache.hits, cache.misses, len(cache))==(1, 4, 2)
+
+def test_size_limits():
+    cache = ResponseCache(max_entries=100, max_bytes=250, max_body_bytes=100)
+    for key in "abc":
+        cache.get(key, lambda: b"x" * 100)
+    # a third 100 byte body would go over 250 bytes, so a is evicted
+    assert (len(cache), cache.size)==(2, 200)
+    assert cache.get("a", lambda: b"A")==b"A"
+    # too big to keep at all
+    assert cache.get("big", lambda: b"x" * 101)==b"x" * 101
+    assert cache.get("big", lambda: b"again")==b"again"
+    assert cache.size==206      # b, c, A and again
+
+def test_new_generation_replaces_old():
+    cache = ResponseCache()
+    cache.get(("/json", ("n=10",), (1,)), lambda: b"old", group=("/json", ("n=10",)))
+    cache.get(("/json", ("n=20",), (1,)), lambda: b"other", group=("/json", ("n=20",)))
+    cache.get(("/json", ("n=10",), (2,)), lambda: b"new", group=("/json", ("n=10",)))
+    assert (len(cache), cache.size)==(2, 8)
+    assert cache.get(("/json", ("n=10",), (1,)), lambda: b"rebuilt")==b"rebuilt"
+
+def test_etags():
+    etag = make_etag(("/fridgeContents", ("default",), (3,)))
+    assert etag==make_etag(("/fridgeContents", ("default",), (3,)))
+    assert etag!=make_etag(("/fridgeContents", ("default",), (4,)))
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag_matches(etag, etag)
+    assert etag_matches('"other", ' + etag, etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+def test_unchanged_polls_get_304():
+    root = iot_fridge.Root()
+    fridge = iot_fridge.get_shard(iot_fridge.DEFAULT_FRIDGE_ID).fridge
+    cherrypy.request.headers = {}
+    body = root.fridgeContents()
+    etag = cherrypy.response.headers['ETag']
+    # polled again with the ETag, and nothing has changed
+    cherrypy.request.headers = {'If-None-Match': etag}
+    assert root.fridgeContents()==b""
+    assert cherrypy.response.status==304
+    # a can is taken out, so the contents are sent again
+    fridge.incr_can("red_can")
+    cherrypy.response.status = 200
+    changed = root.fridgeContents()
+    assert cherrypy.response.headers['ETag']!=etag and changed!=body
+    assert cherrypy.response.status==200
+    fridge.decr_can("red_can")
+    cherrypy.request.headers = {}
+
+def test_pages_render_once_per_change():
+    root = iot_fridge.Root()
+    iot_fridge.Root.precompile()
+    shard = iot_fridge.get_shard(iot_fridge.DEFAULT_FRIDGE_ID)
+    cherrypy.request.headers = {}
+    page = root.fridge()
+    assert b"var fridgeId='default'" in page
+    misses = iot_fridge.RESPONSE_CACHE.misses
+    assert root.fridge() is page
+    assert root.livedata() is root.livedata()
+    assert iot_fridge.RESPONSE_CACHE.misses==misses + 1
+    shard.account.deposit(1.0)
+    assert root.fridge()!=page
+    shard.account.withdraw(1.0)
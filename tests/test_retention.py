@@ -0,0 +1,51 @@
+import os
+import sqlite3
+from datetime import timedelta
+
+import cherrypy
+
+from retention import RetentionPolicy, RetentionPlugin
+from sensorStore import SensorStore
+
+def test_the_basics(tmp_path):
+    db_file = str(tmp_path / "sensorData.db")
+    store = SensorStore(db_file)
+    day_ms = 24 * 60 * 60 * 1000
+    store.add_readings([("test sensor", 60000 * i, "temperature", 4.5) for i in range(14 * 24 * 60)])
+    assert store.db.execute("PRAGMA auto_vacuum").fetchone()[0]==2
+    store.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size_before = os.path.getsize(db_file)
+
+    policy = RetentionPolicy(readings=timedelta(days=7), rollup_1m=timedelta(days=10), chunk_size=500,
+                             vacuum_pages=None)
+    deleted = policy.enforce(store, now=14 * day_ms / 1000)
+    assert deleted=={'readings': 7 * 24 * 60, 'rollup_1m': 4 * 24 * 60}
+    assert store.get_series_for_sensor("test sensor", 1, end=14 * day_ms)==[(14 * day_ms - 60000, 4.5)]
+    assert len(store.get_series_for_sensor("test sensor", None))==7 * 24 * 60
+    # the hourly and daily rollups are kept forever
+    assert store.get_buckets(day_ms, "test sensor")[0]==(0, 4.5, 4.5, 4.5, 24 * 60)
+    store.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    assert os.path.getsize(db_file) < size_before
+    store.close()
+
+def test_purge_in_chunks_with_shared_timestamps(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("sensor {}".format(s), 1000 * t, "temperature", t) for t in range(10) for s in range(15)])
+    assert store.purge('readings', 3000, chunk_size=4)==3 * 15
+    assert store.get_series(1000)[0][0]==3000
+    store.close()
+
+def test_plugin_survives_a_failed_run(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("test sensor", 1000, "temperature", 4.5)])
+    real_purge = store.purge
+    def locked_purge(table, before, chunk_size=1000):
+        raise sqlite3.OperationalError("database is locked")
+    store.purge = locked_purge
+    plugin = RetentionPlugin(cherrypy.engine, store, RetentionPolicy(readings=timedelta(days=7)))
+    # logged, not raised, so the background task carries on
+    plugin.run()
+    store.purge = real_purge
+    plugin.run()
+    assert store.get_series(10)==[]
+    store.close()
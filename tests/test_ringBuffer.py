@@ -0,0 +1,22 @@
+from ringBuffer import ReadingRing, RecentReadings
+from sensorReading import SensorReading
+
+def test_ring_wraps():
+    ring = ReadingRing(capacity=4)
+    assert ring.latest(1) is None
+    assert ring.latest(0)==[]
+    for i in range(6):
+        ring.append(1000 * i, float(i))
+    assert len(ring)==4
+    assert ring.latest(3)==[(3000, 3.0), (4000, 4.0), (5000, 5.0)]
+    assert ring.latest(4)==[(2000, 2.0), (3000, 3.0), (4000, 4.0), (5000, 5.0)]
+    assert ring.latest(5) is None
+
+def test_recent_readings():
+    recent = RecentReadings(capacity=10)
+    recent.add_readings([SensorReading(s_name="thermometer {}".format(s), s_type="temperature",
+                                       timestamp=1000 * i + s, value=float(i)) for i in range(3) for s in (1, 2)])
+    assert recent.get_series("thermometer 1", 2)==[(1001, 1.0), (2001, 2.0)]
+    assert recent.get_series("*", 3)==[(1002, 1.0), (2001, 2.0), (2002, 2.0)]
+    assert recent.get_series("thermometer 2", 4) is None
+    assert recent.get_series("thermometer 3", 1) is None
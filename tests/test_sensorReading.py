@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from sensorReading import SensorReading, to_epoch_ms
+
+def test_the_basics():
+    when = datetime(2018, 9, 1, 12, 30, 15, 250000)
+    r = SensorReading(s_name="thermometer 1", s_type="temperature", timestamp=when, value=4.5)
+    assert r.get_timestamp()==when
+    assert r.get_timestamp_ms()==to_epoch_ms(when)
+    r2 = SensorReading(s_name="thermometer 1", s_type="temperature", timestamp=to_epoch_ms(when), value=4.5)
+    assert r2.get_timestamp()==when
+    assert r2.as_dict()==r.as_dict()
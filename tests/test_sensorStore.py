@@ -0,0 +1,208 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sensorStore import SensorStore, WriteBuffer, SCHEMA_VERSION
+
+def test_the_basics(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    now = datetime.now()
+    store.add_reading("test sensor", now - timedelta(seconds=1), "temperature", 17)
+    store.add_reading("test sensor", now, "temperature", 18)
+    store.add_reading("other sensor", now, "temperature", 5)
+    readings = store.get_readings_for_sensor("test sensor", 2)
+    assert [r.get_value() for r in readings]==[17, 18]
+    assert len(store.get_readings(10))==3
+    store.close()
+
+def test_reader_connection_per_thread(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_reading("test sensor", datetime.now(), "temperature", 17)
+    assert store._reader() is store._reader()
+    counts = []
+    def read():
+        counts.append(len(store.get_readings(10)))
+    threads = [threading.Thread(target=read) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counts==[1, 1, 1, 1]
+    assert len(store._readers)==5
+    store.close()
+    assert store._readers==[]
+
+def test_migrates_version_0_database(tmp_path):
+    import sqlite3
+    db_file = str(tmp_path / "sensorData.db")
+    when = datetime(2018, 9, 1, 12, 30, 15, 250000)
+    db = sqlite3.connect(db_file)
+    db.execute('''CREATE TABLE readings(sensor_name TEXT NOT NULL, created_at timestamp NOT NULL,
+                  reading_type TEXT, value INTEGER)''')
+    db.execute("INSERT INTO readings VALUES(?,?,?,?)", ("thermometer 1", str(when), "temperature", 4.5))
+    db.execute("INSERT INTO readings VALUES(?,?,?,?)", ("thermometer 2", str(when), "temperature", 6.0))
+    db.commit()
+    db.close()
+    store = SensorStore(db_file)
+    assert store.db.execute("PRAGMA user_version").fetchone()[0]==SCHEMA_VERSION
+    readings = store.get_readings_for_sensor("thermometer 1")
+    assert len(readings)==1
+    assert readings[0].get_timestamp()==when
+    assert readings[0].get_value()==4.5
+    assert readings[0].get_type()=="temperature"
+    store.add_reading("thermometer 1", when + timedelta(seconds=5), "temperature", 5.0)
+    values = [r.get_value() for r in store.get_readings(10)]
+    assert sorted(values[:2])==[4.5, 6.0]
+    assert values[2]==5.0
+    store.close()
+
+def test_series_fast_path(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_reading("test sensor", 1000, "temperature", 17)
+    store.add_reading("test sensor", 2000, "temperature", 18)
+    store.add_reading("test sensor", 3000, "temperature", 19)
+    store.add_reading("other sensor", 2500, "temperature", 5)
+    assert store.get_series_for_sensor("test sensor", 2)==[(2000, 18), (3000, 19)]
+    assert store.get_series(2)==[(2500, 5), (3000, 19)]
+    assert store.get_readings_for_sensor("test sensor", 1)[0].get_timestamp_ms()==3000
+    store.close()
+
+def test_iter_readings(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    for i in range(10):
+        store.add_reading("test sensor", 1000 * i, "temperature", i)
+        store.add_reading("other sensor", 1000 * i + 500, "temperature", -i)
+    readings = store.iter_readings(sensor_name="test sensor", start=2000, end=6000)
+    assert [r.get_value() for r in readings]==[2, 3, 4, 5]
+    readings = store.iter_readings(start=7000, count=3)
+    assert [r.get_timestamp_ms() for r in readings]==[8500, 9000, 9500]
+    assert len(list(store.iter_readings()))==20
+    assert [r.get_value() for r in store.get_readings_for_sensor("test sensor", 3)]==[7, 8, 9]
+    store.close()
+
+def test_add_readings_batch(tmp_path):
+    from sensorReading import SensorReading
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    assert store.db.execute("PRAGMA journal_mode").fetchone()[0]=="wal"
+    store.add_readings([("test sensor", 1000, "temperature", 17),
+                        SensorReading(s_name="test sensor", s_type="temperature", timestamp=2000, value=18)])
+    assert store.get_series_for_sensor("test sensor")==[(1000, 17), (2000, 18)]
+    # duplicates of (sensor, timestamp) are dropped
+    store.add_readings([("test sensor", 2000, "temperature", 0)])
+    assert store.get_series_for_sensor("test sensor")==[(1000, 17), (2000, 18)]
+    # a bad row rolls back the whole batch
+    try:
+        store.add_readings([("test sensor", 3000, "temperature", 19), ("test sensor", 4000, "temperature", object())])
+        assert False, "unstorable value should have been rejected"
+    except sqlite3.Error:
+        pass
+    assert len(store.get_readings(10))==2
+    store.close()
+
+def test_write_buffer(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    writer = WriteBuffer(store, max_rows=3, max_delay=60)
+    writer.add_reading("test sensor", 1000, "temperature", 17)
+    writer.add_reading("test sensor", 2000, "temperature", 18)
+    assert store.get_readings(10)==[]
+    writer.add_reading("test sensor", 3000, "temperature", 19)
+    assert len(store.get_readings(10))==3
+    writer.add_reading("test sensor", 4000, "temperature", 20)
+    writer.close()
+    assert len(store.get_readings(10))==4
+    store.close()
+
+def test_write_buffer_keeps_readings_when_a_write_fails(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    writer = WriteBuffer(store, max_rows=100, max_delay=0.05)
+    real_add_readings = store.add_readings
+    failures = []
+    def failing_add_readings(batch, unstored=()):
+        failures.append(len(batch))
+        raise sqlite3.OperationalError("database is locked")
+    store.add_readings = failing_add_readings
+    writer.add_reading("test sensor", 1000, "temperature", 17)
+    deadline = time.time() + 5
+    while len(failures) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    # the flusher is still alive and retrying, and nothing was lost
+    assert failures[:2]==[1, 1]
+    store.add_readings = real_add_readings
+    writer.add_reading("test sensor", 2000, "temperature", 18)
+    writer.close()
+    assert [r.get_value() for r in store.get_readings(10)]==[17, 18]
+    store.close()
+
+def test_write_buffer_drops_what_can_never_be_written(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    writer = WriteBuffer(store, max_rows=2, max_delay=60)
+    # a reading with no sensor name can't be stored: the batch is dropped, not retried
+    writer.add_readings([(None, 1000, "temperature", 17), ("test sensor", 2000, "temperature", 18)])
+    writer.add_readings([("test sensor", 3000, "temperature", 19), ("test sensor", 4000, "temperature", 20)])
+    writer.close()
+    assert [r.get_value() for r in store.get_readings(10)]==[19, 20]
+    store.close()
+
+def test_write_buffer_retains_no_more_than_its_limit(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    writer = WriteBuffer(store, max_rows=2, max_delay=60, max_retained_rows=3)
+    real_add_readings = store.add_readings
+    def locked_add_readings(batch, unstored=()):
+        raise sqlite3.OperationalError("database is locked")
+    store.add_readings = locked_add_readings
+    # the failed writes aren't raised to the caller
+    for i in range(6):
+        writer.add_reading("test sensor", 1000 * i, "temperature", i)
+    store.add_readings = real_add_readings
+    writer.close()
+    assert [r.get_value() for r in store.get_readings(10)]==[3, 4, 5]
+    store.close()
+
+def test_buckets(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("test sensor", 1000 * i, "temperature", i) for i in range(120)])
+    store.add_readings([("other sensor", 1000 * i + 1, "temperature", 100) for i in range(120)])
+    buckets = store.get_buckets(60000, "test sensor")
+    assert buckets==[(0, 0, 29.5, 59, 60), (60000, 60, 89.5, 119, 60)]
+    # the range is widened to whole buckets
+    assert store.get_buckets(60000, "test sensor", start=30000, end=90000)==buckets
+    assert store.get_series_for_sensor("test sensor", None, start=118000)==[(118000, 118), (119000, 119)]
+    store.close()
+
+def test_unstored_readings_count_in_rollups(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    # a steady sensor: one reading stored a minute, the rest left out as unchanged
+    stored = [("test sensor", 60000 * i, "temperature", 4.0) for i in range(3)]
+    unchanged = [("test sensor", 60000 * i + 5000 * j, "temperature", 4.0) for i in range(3) for j in range(1, 12)]
+    assert store.add_readings(stored, unstored=unchanged)==3
+    assert len(store.get_series_for_sensor("test sensor", count=None))==3
+    assert store.get_buckets(60000, "test sensor", start=0)==[
+        (0, 4.0, 4.0, 4.0, 12), (60000, 4.0, 4.0, 4.0, 12), (120000, 4.0, 4.0, 4.0, 12)]
+    store.close()
+
+def test_unaligned_range_after_purge(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("test sensor", 5000 * i, "temperature", i % 10) for i in range(2000)])
+    store.purge('readings', 10000000)
+    assert store.get_series_for_sensor("test sensor", count=None)==[]
+    # as a client asks, from Date.now() - N: answered from the rollups all the same
+    buckets = store.get_buckets(3600000, "test sensor", start=123457, end=7654321)
+    assert buckets==[(0, 0, 4.5, 9, 720), (3600000, 0, 4.5, 9, 720), (7200000, 0, 4.5, 9, 560)]
+    store.close()
+
+def test_rollups(tmp_path):
+    store = SensorStore(str(tmp_path / "sensorData.db"))
+    store.add_readings([("test sensor", 5000 * i, "temperature", i % 10) for i in range(2000)])
+    store.add_readings([("test sensor", 0, "temperature", 99)])   # duplicate, ignored
+    rows = store.db.execute("SELECT bucket, count, sum, min, max FROM rollup_1h").fetchall()
+    assert rows==[(0, 720, 3240.0, 0, 9), (3600000, 720, 3240.0, 0, 9), (7200000, 560, 2520.0, 0, 9)]
+    # aligned queries come from the rollups, and agree with the raw readings
+    from_rollup = store.get_buckets(3600000, "test sensor", start=0, end=7200000)
+    assert from_rollup==[(0, 0, 4.5, 9, 720), (3600000, 0, 4.5, 9, 720)]
+    assert store.get_buckets(3600000, "test sensor", start=1, end=7200000)[1]==from_rollup[1]
+    # raw readings removed, rollups remain
+    store.db.execute("DELETE FROM readings")
+    store.db.commit()
+    assert store.get_buckets(7200000, "test sensor")==[(0, 0, 4.5, 9, 1440), (7200000, 0, 4.5, 9, 560)]
+    store.close()
@@ -0,0 +1,44 @@
+import numpy as np
+
+from sensor import SENSOR_DRIVERS, make_sensor
+from simulator import FridgeFleet, SimulatedFridgeSensor
+
+
+def test_fleet_cycles_between_set_points():
+    fleet = FridgeFleet(2000, seed=1, noise=0.0, door_opens_per_hour=0.0)
+    lowest = np.full(2000, 100.0)
+    highest = np.full(2000, -100.0)
+    fans_switched = np.zeros(2000, dtype=bool)
+    for i in range(2000):
+        fan_on = fleet.fan_on.copy()
+        temps = fleet.step(1.0)
+        fans_switched |= fan_on != fleet.fan_on
+        lowest = np.minimum(lowest, temps)
+        highest = np.maximum(highest, temps)
+    assert fans_switched.all()
+    assert lowest.min() > 1.0 and highest.max() < 13.0
+    assert lowest.max() < 3.0 and highest.min() > 11.0
+
+def test_open_doors_warm_the_fridge():
+    # fans that do nothing, so nothing but the doors differs
+    shut = FridgeFleet(500, seed=2, noise=0.0, cooling_tau=1e12, door_opens_per_hour=0.0)
+    opened = FridgeFleet(500, seed=2, noise=0.0, cooling_tau=1e12, door_opens_per_hour=3600.0,
+                         door_open_seconds=60.0)
+    for i in range(10):
+        warm = opened.step(1.0)
+        cool = shut.step(1.0)
+    assert opened.door_open.any()
+    assert (warm >= cool).all() and warm.mean() > cool.mean() + 1.0
+
+def test_sensors_share_one_step():
+    fleet = FridgeFleet(3, seed=3, step_seconds=1.0)
+    first = fleet.read(now=100.0).copy()
+    assert (fleet.read(now=100.5)==first).all()
+    assert (fleet.read(now=101.0)!=first).all()
+    sensors = fleet.sensors()
+    assert [s.get_name() for s in sensors]==["simulated fridge 0", "simulated fridge 1", "simulated fridge 2"]
+    reading = sensors[1].get_reading()
+    assert reading.get_type()=="simulated temperature"
+    assert SENSOR_DRIVERS["simulated temperature"] is SimulatedFridgeSensor
+    # each sensor made on its own has a fridge of its own
+    assert make_sensor("simulated temperature", "spare").fleet is not make_sensor("simulated temperature", "other").fleet
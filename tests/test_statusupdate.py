@@ -0,0 +1,101 @@
+import sys
+import threading
+
+import cherrypy
+import pytest
+
+import iot_fridge
+from account import Account
+from fridge import Fridge
+from fridgeRegistry import FridgeRegistry
+
+def new_fleet(monkeypatch, fridge_ids, red_count, green_count, blue_count):
+    """Replace the server's fridges and subscriber with fresh ones, for this test only
+    """
+    monkeypatch.setattr(iot_fridge, "FRIDGES", FridgeRegistry())
+    monkeypatch.setattr(iot_fridge, "SUBSCRIBER_ACCOUNT", Account("subscriber", initialBalance=10.0))
+    for fridge_id in fridge_ids:
+        iot_fridge.FRIDGES.add(fridge_id, Fridge(red_count=red_count, green_count=green_count, blue_count=blue_count),
+                               Account("fridge:" + fridge_id, initialBalance=25.0),
+                               Account("escrow:" + fridge_id, initialBalance=0.0))
+    return iot_fridge.FRIDGES
+
+def test_concurrent_puts_conserve_money(monkeypatch):
+    # plenty of red cans, and green/blue at standard levels, so restocking adds nothing
+    fleet = new_fleet(monkeypatch, [iot_fridge.DEFAULT_FRIDGE_ID, "kitchen"], 1000, 2, 2)
+    status_update = iot_fridge.StatusUpdate()
+    threads_per_kind = 8
+    iterations = 200
+
+    def drinker(fridge_id):
+        for i in range(iterations):
+            status_update.PUT(fridge_id, "dragFromFridge", "red_can")
+            status_update.PUT(fridge_id, "dropInFridge", "red_can")
+
+    def subscriber(fridge_id):
+        for i in range(iterations):
+            status_update.PUT(fridge_id, "agreeToRestock", "all_cans")
+            status_update.PUT(fridge_id, "restockFridge", "all_cans")
+
+    finished = threading.Event()
+
+    def observer():
+        # the subscriber's money is always either in their account or in an escrow
+        shards = [fleet.get(fridge_id) for fridge_id in fleet.fridge_ids()]
+        while not finished.is_set():
+            with iot_fridge.locked(iot_fridge.SUBSCRIBER_ACCOUNT, *[shard.escrow for shard in shards]):
+                total = iot_fridge.SUBSCRIBER_ACCOUNT.balance + sum(shard.escrow.balance for shard in shards)
+            assert total==pytest.approx(10.0)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)    # switch threads as often as possible, to shake out races
+    try:
+        threads = [threading.Thread(target=target, args=(fridge_id,))
+                   for target in (drinker, subscriber) for fridge_id in fleet.fridge_ids()
+                   for i in range(threads_per_kind)]
+        errors = []
+        def watch():
+            try:
+                observer()
+            except AssertionError as e:
+                errors.append(e)
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        finished.set()
+        watcher.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors==[]
+    pairs = threads_per_kind * iterations
+    for fridge_id in fleet.fridge_ids():
+        shard = fleet.get(fridge_id)
+        assert shard.fridge.get_red_can()==1000
+        assert shard.account.balance==pytest.approx(25.0 + pairs * (0.3 - 0.1))
+        assert shard.escrow.balance==pytest.approx(0.0)
+    assert iot_fridge.SUBSCRIBER_ACCOUNT.balance==pytest.approx(10.0)
+
+def test_no_charge_for_empty_fridge(monkeypatch):
+    fleet = new_fleet(monkeypatch, [iot_fridge.DEFAULT_FRIDGE_ID], 0, 2, 2)
+    iot_fridge.StatusUpdate().PUT("dragFromFridge", "red_can")
+    shard = fleet.get(iot_fridge.DEFAULT_FRIDGE_ID)
+    assert shard.account.balance==25.0
+    assert shard.fridge.get_red_can()==0
+
+def test_unknown_can_type(monkeypatch):
+    fleet = new_fleet(monkeypatch, [iot_fridge.DEFAULT_FRIDGE_ID], 4, 2, 2)
+    for command in ("dragFromFridge", "dropInFridge"):
+        with pytest.raises(cherrypy.HTTPError) as error:
+            iot_fridge.StatusUpdate().PUT(command, "purple_can")
+        assert error.value.code==404
+    # and no money changed hands
+    assert fleet.get(iot_fridge.DEFAULT_FRIDGE_ID).account.balance==25.0
+
+def test_unknown_fridge(monkeypatch):
+    new_fleet(monkeypatch, [iot_fridge.DEFAULT_FRIDGE_ID], 4, 2, 2)
+    iot_fridge.StatusUpdate().PUT("garage", "dragFromFridge", "red_can")
+    assert iot_fridge.cherrypy.response.status=="404 Error"